@@ -1,23 +1,46 @@
 import streamlit as st
 import requests
-from datetime import datetime
+from datetime import datetime, timezone
 import socket
 import ssl
 import re
 import random
 import time
-from PIL import Image
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageOps
 import io
 import base64
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
+import altair as alt
 from io import StringIO
 from bs4 import BeautifulSoup
 import hashlib
 import subprocess
 import platform
 import json
+import ipaddress
+import urllib.parse
+import mmap
+import os
+import threading
+import gzip
+import zlib
+import zipfile
+import itertools
+import collections
+import difflib
+import bisect
+import heapq
+import math
+import tempfile
+import atexit
+import shutil
+import sqlite3
+from contextlib import closing
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 # ============================================================================
 # PART 1: IMPORT GUARDS AND CONFIGURATION
@@ -36,6 +59,7 @@ try:
     import dns.resolver
     import dns.query
     import dns.zone
+    import dns.reversename
     DNS_AVAILABLE = True
 except ImportError:
     pass
@@ -56,6 +80,7 @@ try:
     import imaplib
     import smtplib
     import email
+    import email.utils
     from email import policy
     from email.parser import BytesParser
     IMAPLIB_AVAILABLE = True
@@ -91,7 +116,50 @@ CONFIG = {
     'dns_timeout': 5,
     'max_redirects': 10,
     'user_agent': 'SupportBuddy/1.0',
-    'cache_ttl': 300  # 5 minutes
+    'cache_ttl': 300,  # 5 minutes
+    'max_workers': 16,
+    'mail_probe_timeout': 8,
+    'dns_negative_ttl': 300,
+    'dns_cache_max_entries': 10_000,
+    'spf_lookup_limit': 10,
+    'spf_void_limit': 2,
+    'dkim_workers': 48,
+    'data_dir': os.environ.get('SUPPORTBUDDY_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')),
+    'ai_cache_ttl': 7 * 24 * 3600,  # 7 days
+    'ai_cache_max_entries': 2000,
+    'chat_token_budget': 4000,  # approx. tokens of raw history sent per chat turn
+    'chat_keep_messages': 4,
+    'screenshot_max_edge': 1600,  # px; enough to keep UI text legible
+    'screenshot_quality': 85,
+    'ai_model': 'gemini-2.5-flash-lite',
+    'ai_fallback_model': 'gemini-2.0-flash-lite',
+    'ai_max_concurrency': 8,  # simultaneous Gemini requests per process
+    'ai_queue_timeout': 30,
+    'ai_timeout': 60,
+    'ai_max_retries': 3,
+    'triage_workers': 4,
+    'triage_per_minute': 60,
+    'triage_max_rows': 500,
+    'api_max_wait': 20,  # seconds a caller may queue for a rate-limited API
+    'history_cache_ttl': 7 * 24 * 3600,
+    'history_max_pages': 20,
+    'kb_path': os.environ.get('SUPPORTBUDDY_KB_PATH', ''),  # article directory or JSON/JSONL file; defaults to <data_dir>/kb
+    'kb_mirror_url': os.environ.get('SUPPORTBUDDY_KB_MIRROR_URL', 'https://help.hostafrica.com'),
+    'kb_mirror_workers': 8,
+    'kb_mirror_max_pages': 5000,
+    'notes_autosave_interval': 5,  # seconds between note writes while typing
+    'notes_revision_window': 300,  # saves closer together than this amend one revision
+    'annotator_work_edge': 1600,  # px; annotations are previewed on a copy this size
+    'annotator_max_pixels': 50_000_000,
+    'bulk_max_items': 200,  # entries per bulk DNS/IP/SSL run
+    # Names ending in these right after a path separator (/var/www/setup.py) are files, not domains
+    'entity_file_extensions': (
+        'md txt log csv json xml yml yaml html htm php js css py sh bash ps1 pl rs rb go '
+        'zip gz tgz tar rar 7z bak sql conf cfg ini mov mp4 exe dll so'
+    ).split(),
+    'line_sort_chunk': 200_000,  # lines sorted in memory before spilling a run to disk
+    # Server-side mailboxes the Bounce Analyzer may read (os.pathsep-separated); empty disables server paths
+    'mailbox_roots': [p for p in os.environ.get('SUPPORTBUDDY_MAILBOX_ROOTS', '').split(os.pathsep) if p]
 }
 
 # Configure Gemini API
@@ -335,8 +403,15 @@ st.markdown("""
 # Session state initialization
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'chat_summary' not in st.session_state:
+    st.session_state.chat_summary = ""
+    st.session_state.chat_summarized = 0  # messages already folded into chat_summary
 if 'session_notes' not in st.session_state:
     st.session_state.session_notes = ""
+    st.session_state.notes_loaded_for = None  # (agent, ticket) the editor holds
+    st.session_state.notes_saved_text = ""
+    st.session_state.notes_saved_at = 0.0
+    st.session_state.notes_revision = 0
 # Simplified navigation: only selected_tool is required
 if 'selected_tool' not in st.session_state:
     st.session_state.selected_tool = None
@@ -377,6 +452,7 @@ TOOL_CATEGORIES = {
         "tools": [
             "✅ Support Ticket Checklist",
             "🔍 AI Ticket Analysis",
+            "📋 Batch Ticket Triage",
             "🩺 Smart Symptom Checker"
         ],
         "description": "Let's analyse the tickets",
@@ -395,6 +471,7 @@ TOOL_CATEGORIES = {
     "Domain & DNS": {
         "icon": "🌐",
         "tools": [
+            "🏥 Domain Health Report",
             "🔍 Domain Status Check",
             "🔎 DNS Analyzer",
             "📋 NS Authority Checker",
@@ -422,8 +499,11 @@ TOOL_CATEGORIES = {
         "tools": [
             "📮 MX Record Checker",
             "✉️ Email Account Tester",
+            "📡 Mail Port Matrix",
             "🔒 SPF/DKIM Check",
-            "📄 Email Header Analyzer"
+            "📄 Email Header Analyzer",
+            "📭 Bounce Analyzer",
+            "📊 DMARC Report Analyzer"
         ],
         "description": "Essential Email Tools",
         "color": CATEGORY_COLORS.get("Email")
@@ -466,31 +546,9 @@ TOOL_CATEGORIES = {
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
-def search_tools(query):
+def search_tools(query, limit=10):
     """Search for tools across all categories"""
-    query = query.lower().strip()
-    results = []
-    
-    for category_name, category_info in TOOL_CATEGORIES.items():
-        for tool in category_info['tools']:
-            # Search in tool name
-            if query in tool.lower():
-                results.append({
-                    'tool': tool,
-                    'category': category_name,
-                    'description': category_info['description'],
-                    'icon': category_info['icon']
-                })
-            # Also search in category name
-            elif query in category_name.lower():
-                results.append({
-                    'tool': tool,
-                    'category': category_name,
-                    'description': category_info['description'],
-                    'icon': category_info['icon']
-                })
-    
-    return results
+    return get_search_index().search(query, kind='tool', limit=limit)
 
 def show_missing_dependency(feature_name, package_name):
     """Display a helpful message when a required package is missing"""
@@ -574,6 +632,223 @@ def safe_request(url, method='get', **kwargs):
     except Exception as e:
         return False, f"Unexpected error: {str(e)}"
 
+_DB_SCHEMAS_APPLIED = set()
+
+def get_db(name, schema=None):
+    """Open a SQLite database in the data directory, shared by all sessions and processes"""
+    os.makedirs(CONFIG['data_dir'], exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CONFIG['data_dir'], f"{name}.db"), timeout=10, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if schema and name not in _DB_SCHEMAS_APPLIED:
+        conn.executescript(schema)
+        _DB_SCHEMAS_APPLIED.add(name)
+    return conn
+
+# Free-tier limits per provider: a token bucket (`rate` requests per `per` seconds,
+# up to `burst` at once) plus an optional request quota per calendar period (UTC)
+API_LIMITS = {
+    'securitytrails': {'label': 'SecurityTrails', 'rate': 1, 'per': 1, 'burst': 1, 'quota': 50, 'period': 'month'},
+    'virustotal': {'label': 'VirusTotal', 'rate': 4, 'per': 60, 'burst': 4, 'quota': 500, 'period': 'day'},
+    'ipapi.co': {'label': 'ipapi.co', 'rate': 1, 'per': 1, 'burst': 5, 'quota': 1000, 'period': 'day'},
+    'ip-api.com': {'label': 'ip-api.com', 'rate': 45, 'per': 60, 'burst': 45, 'quota': None, 'period': None},
+    'ip-api.com/batch': {'label': 'ip-api.com batch', 'rate': 15, 'per': 60, 'burst': 15, 'quota': None, 'period': None},
+    'gemini': {'label': 'Gemini', 'rate': 15, 'per': 60, 'burst': 15, 'quota': 1000, 'period': 'day'}
+}
+
+API_QUOTA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_buckets (
+    provider TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS api_usage (
+    provider TEXT NOT NULL,
+    period TEXT NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (provider, period)
+);
+"""
+
+QUOTA_PERIOD_LABELS = {'day': 'today', 'month': 'this month'}
+
+def _quota_period(period):
+    """Ledger key for the current quota period, e.g. '2025-06' or '2025-06-14'"""
+    return datetime.now(timezone.utc).strftime('%Y-%m' if period == 'month' else '%Y-%m-%d')
+
+def _bucket_tokens(conn, provider, now):
+    """Current token count after refilling since the last update"""
+    limits = API_LIMITS[provider]
+    row = conn.execute("SELECT tokens, updated FROM api_buckets WHERE provider = ?", (provider,)).fetchone()
+    if row is None:
+        return float(limits['burst'])
+    return min(float(limits['burst']), row[0] + (now - row[1]) * limits['rate'] / limits['per'])
+
+def acquire_api(provider, max_wait=None):
+    """Take one request from a provider's token bucket and quota ledger.
+    
+    The ledger lives in SQLite, so the budget is shared by every session and
+    process. Waits up to `max_wait` seconds for the bucket to refill; returns
+    (True, None) or (False, reason) so callers can degrade instead of
+    hitting 429s. If the ledger itself is unavailable the call is allowed.
+    """
+    limits = API_LIMITS[provider]
+    rate = limits['rate'] / limits['per']
+    deadline = time.monotonic() + (CONFIG['api_max_wait'] if max_wait is None else max_wait)
+    
+    while True:
+        try:
+            with closing(get_db('api_quota', API_QUOTA_SCHEMA)) as conn:
+                # IMMEDIATE takes the write lock up front so concurrent processes can't double-spend
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = time.time()
+                    if limits['quota']:
+                        period = _quota_period(limits['period'])
+                        row = conn.execute("SELECT used FROM api_usage WHERE provider = ? AND period = ?", (provider, period)).fetchone()
+                        used = row[0] if row else 0
+                        if used >= limits['quota']:
+                            return False, f"{limits['label']} quota used up ({used}/{limits['quota']} {QUOTA_PERIOD_LABELS[limits['period']]})"
+                    
+                    tokens = _bucket_tokens(conn, provider, now)
+                    if tokens >= 1:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO api_buckets (provider, tokens, updated) VALUES (?, ?, ?)",
+                            (provider, tokens - 1, now)
+                        )
+                        if limits['quota']:
+                            conn.execute(
+                                "INSERT INTO api_usage (provider, period, used) VALUES (?, ?, 1) "
+                                "ON CONFLICT(provider, period) DO UPDATE SET used = used + 1",
+                                (provider, period)
+                            )
+                        return True, None
+                finally:
+                    conn.commit()
+        except sqlite3.Error:
+            return True, None
+        
+        delay = (1 - tokens) / rate
+        if time.monotonic() + delay > deadline:
+            return False, f"{limits['label']} rate limit reached - try again in {delay:.0f}s"
+        time.sleep(delay)
+
+def mark_api_throttled(provider, retry_after=None):
+    """Drain a provider's bucket after a 429 so every caller backs off for `retry_after` seconds"""
+    limits = API_LIMITS[provider]
+    retry_after = retry_after or limits['per']
+    try:
+        with closing(get_db('api_quota', API_QUOTA_SCHEMA)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO api_buckets (provider, tokens, updated) VALUES (?, ?, ?)",
+                (provider, 1 - retry_after * limits['rate'] / limits['per'], time.time())
+            )
+    except sqlite3.Error:
+        pass
+
+def api_budget(provider):
+    """Remaining quota and currently available burst for a provider"""
+    limits = API_LIMITS[provider]
+    budget = {'label': limits['label'], 'quota': limits['quota'], 'period': limits['period'], 'remaining': None, 'available': limits['burst']}
+    try:
+        with closing(get_db('api_quota', API_QUOTA_SCHEMA)) as conn:
+            budget['available'] = max(0, int(_bucket_tokens(conn, provider, time.time())))
+            if limits['quota']:
+                row = conn.execute(
+                    "SELECT used FROM api_usage WHERE provider = ? AND period = ?",
+                    (provider, _quota_period(limits['period']))
+                ).fetchone()
+                budget['remaining'] = limits['quota'] - (row[0] if row else 0)
+    except sqlite3.Error:
+        pass
+    return budget
+
+def show_api_budget(*providers):
+    """Caption with the remaining shared budget for the given providers"""
+    parts = []
+    for provider in providers:
+        budget = api_budget(provider)
+        if budget['quota']:
+            parts.append(f"{budget['label']}: {max(0, budget['remaining'])}/{budget['quota']} left {QUOTA_PERIOD_LABELS[budget['period']]}")
+        else:
+            parts.append(f"{budget['label']}: {budget['available']}/{API_LIMITS[provider]['burst']} requests available now")
+    st.caption("📊 Shared API budget · " + " · ".join(parts))
+
+PASSIVE_DNS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rrsets (
+    name TEXT NOT NULL,
+    rtype TEXT NOT NULL,
+    value TEXT NOT NULL,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (name, rtype, value)
+) WITHOUT ROWID;
+"""
+
+PASSIVE_DNS_BATCH = 500  # buffered observations that trigger a write
+
+@st.cache_resource
+def _passive_dns_state():
+    # Observations buffered across reruns; resolver threads only append to the list
+    atexit.register(lambda: flush_passive_dns())
+    return [], threading.Lock()
+
+_PASSIVE_DNS_PENDING, _PASSIVE_DNS_LOCK = _passive_dns_state()
+
+def record_passive_dns(name, record_type, values):
+    """Queue a resolved RRset for our own passive DNS history (first/last-seen times)"""
+    if not values:
+        return
+    name = name.lower().rstrip('.')
+    now = int(time.time())
+    with _PASSIVE_DNS_LOCK:
+        _PASSIVE_DNS_PENDING.extend((name, record_type, value, now, now) for value in dict.fromkeys(values))
+        full = len(_PASSIVE_DNS_PENDING) >= PASSIVE_DNS_BATCH
+    if full:
+        flush_passive_dns()
+
+def flush_passive_dns():
+    """Write every queued observation in one transaction"""
+    with _PASSIVE_DNS_LOCK:
+        rows = _PASSIVE_DNS_PENDING[:]
+        del _PASSIVE_DNS_PENDING[:]
+    if not rows:
+        return
+    try:
+        with closing(get_db('passive_dns', PASSIVE_DNS_SCHEMA)) as conn, conn:
+            conn.executemany(
+                "INSERT INTO rrsets (name, rtype, value, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name, rtype, value) DO UPDATE SET last_seen = excluded.last_seen, seen = seen + 1",
+                rows
+            )
+    except sqlite3.Error:
+        pass
+
+def passive_dns_history(name, record_type=None):
+    """Rows of locally observed records for a name, most recently seen first"""
+    flush_passive_dns()
+    query = "SELECT rtype, value, first_seen, last_seen, seen FROM rrsets WHERE name = ?"
+    params = [name.lower().rstrip('.')]
+    if record_type:
+        query += " AND rtype = ?"
+        params.append(record_type)
+    try:
+        with closing(get_db('passive_dns', PASSIVE_DNS_SCHEMA)) as conn:
+            rows = conn.execute(query + " ORDER BY last_seen DESC", params).fetchall()
+    except sqlite3.Error:
+        return []
+    return [
+        {
+            'Type': rtype,
+            'Value': value,
+            'First Seen': datetime.fromtimestamp(first, tz=timezone.utc).strftime('%Y-%m-%d %H:%M'),
+            'Last Seen': datetime.fromtimestamp(last, tz=timezone.utc).strftime('%Y-%m-%d %H:%M'),
+            'Lookups': seen
+        }
+        for rtype, value, first, last, seen in rows
+    ]
+
 @st.cache_data(ttl=CONFIG['cache_ttl'])
 def lookup_dns_record(domain, record_type='A'):
     """Lookup DNS records with caching"""
@@ -587,6 +862,7 @@ def lookup_dns_record(domain, record_type='A'):
         
         answers = resolver.resolve(domain, record_type)
         results = [str(rdata) for rdata in answers]
+        record_passive_dns(domain, record_type, results)
         return True, results
     except dns.resolver.NXDOMAIN:
         return False, f"Domain {domain} does not exist"
@@ -597,6 +873,86 @@ def lookup_dns_record(domain, record_type='A'):
     except Exception as e:
         return False, f"DNS error: {str(e)}"
 
+# Process-wide DNS cache shared by worker threads (st.cache_data needs a script context)
+@st.cache_resource
+def _dns_cache_state():
+    # Module globals are rebuilt on every rerun of the script; this survives them
+    return collections.OrderedDict(), {}, threading.Lock()
+
+_DNS_CACHE, _DNS_INFLIGHT, _DNS_LOCK = _dns_cache_state()
+_DNS_RESOLVER = None
+
+def _get_resolver():
+    """Return a shared resolver (dnspython resolvers are thread-safe once configured)"""
+    global _DNS_RESOLVER
+    if _DNS_RESOLVER is None:
+        resolver = dns.resolver.Resolver()
+        resolver.timeout = CONFIG['dns_timeout']
+        resolver.lifetime = CONFIG['dns_timeout']
+        _DNS_RESOLVER = resolver
+    return _DNS_RESOLVER
+
+def resolve_dns_cached(name, record_type='A'):
+    """Thread-safe memoized DNS lookup.
+    
+    Returns (records, error): NXDOMAIN/NoAnswer give ([], None) so callers can
+    count void lookups; timeouts and server failures give ([], message).
+    Negative answers are cached as well, and concurrent lookups of the same
+    name share a single query.
+    """
+    if not DNS_AVAILABLE:
+        return [], "DNS library not available"
+    
+    key = (name.lower().rstrip('.'), record_type)
+    while True:
+        with _DNS_LOCK:
+            cached = _DNS_CACHE.get(key)
+            if cached and cached[0] > time.monotonic():
+                _DNS_CACHE.move_to_end(key)
+                return cached[1], cached[2]
+            event = _DNS_INFLIGHT.get(key)
+            if event is None:
+                event = _DNS_INFLIGHT[key] = threading.Event()
+                break
+        event.wait(CONFIG['dns_timeout'] * 2)
+    
+    records, error, ttl = [], None, CONFIG['dns_negative_ttl']
+    try:
+        answers = _get_resolver().resolve(key[0], record_type)
+        records = [str(rdata) for rdata in answers]
+        ttl = min(max(answers.rrset.ttl, 30), CONFIG['cache_ttl'])
+        record_passive_dns(key[0], record_type, records)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        pass
+    except dns.resolver.Timeout:
+        error, ttl = "DNS query timed out", 0
+    except Exception as e:
+        error, ttl = f"DNS error: {str(e)}", 0
+    
+    with _DNS_LOCK:
+        if ttl:
+            now = time.monotonic()
+            _DNS_CACHE[key] = (now + ttl, records, error)
+            _DNS_CACHE.move_to_end(key)
+            # Drop expired answers from the cold end, then trim to the size cap
+            while _DNS_CACHE and next(iter(_DNS_CACHE.values()))[0] <= now:
+                _DNS_CACHE.popitem(last=False)
+            while len(_DNS_CACHE) > CONFIG['dns_cache_max_entries']:
+                _DNS_CACHE.popitem(last=False)
+        _DNS_INFLIGHT.pop(key, None)
+    event.set()
+    return records, error
+
+def resolve_dns_many(queries, max_workers=None):
+    """Resolve many (name, type) pairs concurrently; returns {(name, type): (records, error)}"""
+    queries = list(dict.fromkeys(queries))
+    if not queries:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers or CONFIG['max_workers'], len(queries))) as executor:
+        results = dict(zip(queries, executor.map(lambda q: resolve_dns_cached(*q), queries)))
+    flush_passive_dns()
+    return results
+
 @st.cache_data(ttl=CONFIG['cache_ttl'])
 def lookup_whois(domain):
     """Lookup WHOIS information"""
@@ -609,184 +965,366 @@ def lookup_whois(domain):
     except Exception as e:
         return False, f"WHOIS error: {str(e)}"
 
-def check_historical_dns(domain, use_virustotal=True, use_securitytrails=True, record_type="A"):
-    """Check historical DNS records from free sources"""
-    
-    st.markdown("---")
+HISTORY_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_cache (
+    source TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    record_type TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (source, domain, record_type)
+);
+"""
+
+def history_cache_get(source, domain, record_type):
+    """Cached (rows, fetched) for a source/domain/type, or None if missing or stale"""
+    try:
+        with closing(get_db('dns_history', HISTORY_CACHE_SCHEMA)) as conn:
+            row = conn.execute(
+                "SELECT payload, fetched FROM history_cache WHERE source = ? AND domain = ? AND record_type = ?",
+                (source, domain, record_type)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None or row[1] < time.time() - CONFIG['history_cache_ttl']:
+        return None
+    return json.loads(row[0]), row[1]
+
+def history_cache_put(source, domain, record_type, rows):
+    try:
+        with closing(get_db('dns_history', HISTORY_CACHE_SCHEMA)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO history_cache (source, domain, record_type, fetched, payload) VALUES (?, ?, ?, ?, ?)",
+                (source, domain, record_type, time.time(), json.dumps(rows))
+            )
+    except sqlite3.Error:
+        pass
+
+def _securitytrails_value(record_type, value):
+    """Render one SecurityTrails value object (shape differs per record type)"""
+    if not isinstance(value, dict):
+        return str(value)
+    if record_type == "MX":
+        return f"{value.get('priority', '')} {value.get('host', value.get('hostname', ''))}".strip()
+    if record_type == "SOA":
+        return f"Primary: {value.get('email', 'N/A')}"
+    for field in ('ip', 'ipv6', 'nameserver', 'value'):
+        if field in value:
+            return str(value[field])
+    return json.dumps(value)
+
+def fetch_securitytrails_history(domain, record_type, api_key):
+    """Fetch every page of SecurityTrails history for one record type.
     
-    # SecurityTrails Historical DNS
-    if use_securitytrails:
-        st.subheader("🔒 SecurityTrails Historical DNS")
-        
-        # Check for API key in secrets first, then allow manual input
-        api_key = SECURITYTRAILS_API_KEY
-        
-        if not api_key:
-            api_key = st.text_input("SecurityTrails API Key:", type="password", 
-                                   help="Add to secrets.toml as SECURITYTRAILS_API_KEY or enter here")
-        
-        if api_key:
+    Each page costs one query from the shared quota; if the budget runs out
+    part-way the pages fetched so far are returned as incomplete.
+    Returns (rows, complete, message).
+    """
+    url = f"https://api.securitytrails.com/v1/history/{domain}/dns/{record_type.lower()}"
+    headers = {'APIKEY': api_key, 'Accept': 'application/json'}
+    rows = []
+    page, pages = 1, 1
+    while page <= min(pages, CONFIG['history_max_pages']):
+        allowed, reason = acquire_api('securitytrails')
+        if not allowed:
+            return rows, False, reason
+        response = requests.get(url, headers=headers, params={'page': page}, timeout=15)
+        if response.status_code == 401:
+            return rows, False, "Invalid API key. Please check your SecurityTrails API key."
+        if response.status_code == 429:
+            mark_api_throttled('securitytrails', 3600)
+            return rows, False, "Rate limit exceeded. Free tier: 50 queries/month"
+        if response.status_code == 404:
+            return rows, True, "No data found for this domain on SecurityTrails"
+        if response.status_code != 200:
             try:
-                # Map record types to SecurityTrails endpoints
-                record_map = {
-                    "A": "a",
-                    "AAAA": "aaaa",
-                    "MX": "mx",
-                    "NS": "ns",
-                    "SOA": "soa",
-                    "TXT": "txt"
-                }
-                
-                endpoint_type = record_map.get(record_type, "a")
-                url = f"https://api.securitytrails.com/v1/history/{domain}/dns/{endpoint_type}"
-                headers = {
-                    'APIKEY': api_key,
-                    'Accept': 'application/json'
-                }
-                
-                response = requests.get(url, headers=headers, timeout=15)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    if 'records' in data and len(data['records']) > 0:
-                        records = []
-                        for record in data['records']:
-                            values = record.get('values', [])
-                            
-                            # Handle different record types
-                            if record_type == "MX":
-                                value_str = ', '.join([f"{v.get('priority', '')} {v.get('hostname', '')}" for v in values if isinstance(v, dict)])
-                            elif record_type == "SOA":
-                                if values and isinstance(values[0], dict):
-                                    soa = values[0]
-                                    value_str = f"Primary: {soa.get('email', 'N/A')}"
-                                else:
-                                    value_str = str(values)
-                            else:
-                                value_str = ', '.join([str(v) for v in values]) if isinstance(values, list) else str(values)
-                            
-                            records.append({
-                                'Type': record.get('type', record_type),
-                                'Values': value_str,
-                                'First Seen': record.get('first_seen', 'N/A'),
-                                'Last Seen': record.get('last_seen', 'N/A'),
-                                'Organizations': ', '.join(record.get('organizations', [])) if record.get('organizations') else 'N/A'
-                            })
-                        
-                        df = pd.DataFrame(records)
-                        st.dataframe(df, use_container_width=True)
-                        st.success(f"✅ Found {len(records)} historical {record_type} records from SecurityTrails")
-                        
-                        # Download option
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            "📥 Download CSV",
-                            csv,
-                            f"historical_dns_{domain}_{record_type}_{datetime.now().strftime('%Y%m%d')}.csv",
-                            "text/csv",
-                            use_container_width=True
-                        )
-                    else:
-                        st.info(f"ℹ️ No historical {record_type} records found on SecurityTrails")
-                        
-                elif response.status_code == 401:
-                    st.error("❌ Invalid API key. Please check your SecurityTrails API key.")
-                elif response.status_code == 429:
-                    st.error("❌ Rate limit exceeded. Free tier: 50 queries/month")
-                elif response.status_code == 404:
-                    st.warning(f"⚠️ No data found for this domain on SecurityTrails")
-                else:
-                    st.warning(f"⚠️ SecurityTrails returned status code: {response.status_code}")
-                    try:
-                        error_data = response.json()
-                        st.error(f"Error details: {error_data.get('message', 'Unknown error')}")
-                    except:
-                        pass
-                        
-            except Exception as e:
-                st.error(f"❌ Error querying SecurityTrails: {str(e)}")
+                detail = response.json().get('message', 'Unknown error')
+            except ValueError:
+                detail = 'Unknown error'
+            return rows, False, f"SecurityTrails returned status code {response.status_code}: {detail}"
+        
+        data = response.json()
+        for record in data.get('records', []):
+            values = record.get('values', [])
+            rows.append({
+                'Type': record_type,
+                'Values': ', '.join(_securitytrails_value(record_type, v) for v in values) if isinstance(values, list) else str(values),
+                'First Seen': record.get('first_seen') or 'N/A',
+                'Last Seen': record.get('last_seen') or 'N/A',
+                'Organizations': ', '.join(record.get('organizations') or []) or 'N/A'
+            })
+        pages = data.get('pages') or 1
+        page += 1
+    
+    complete = pages <= CONFIG['history_max_pages']
+    return rows, complete, None if complete else f"Stopped after {CONFIG['history_max_pages']} of {pages} pages"
+
+def fetch_virustotal_history(domain):
+    """Follow VirusTotal's passive DNS cursor to the end. Returns (rows, complete, message)."""
+    url = f"https://www.virustotal.com/ui/domains/{domain}/resolutions"
+    params = {'limit': 40}
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    rows = []
+    for _ in range(CONFIG['history_max_pages']):
+        allowed, reason = acquire_api('virustotal')
+        if not allowed:
+            return rows, False, reason
+        response = requests.get(url, headers=headers, params=params, timeout=10)
+        if response.status_code == 429:
+            mark_api_throttled('virustotal')
+        if response.status_code != 200:
+            return rows, False, f"VirusTotal returned status code: {response.status_code}"
+        
+        data = response.json()
+        for item in data.get('data', []):
+            attributes = item.get('attributes', {})
+            resolved = attributes.get('date')
+            rows.append({
+                'IP Address': attributes.get('ip_address', 'N/A'),
+                'Last Resolved': datetime.fromtimestamp(resolved, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S') if resolved else 'N/A'
+            })
+        cursor = data.get('meta', {}).get('cursor')
+        if not cursor or len(data.get('data', [])) < params['limit']:
+            return rows, True, None
+        params = {'limit': 40, 'cursor': cursor}
+    return rows, False, f"Stopped after {CONFIG['history_max_pages']} pages"
+
+def fetch_current_dns(domain):
+    """Current records of the common types, resolved concurrently through the shared DNS cache"""
+    types = ['A', 'AAAA', 'MX', 'NS', 'TXT', 'SOA']
+    answers = resolve_dns_many([(domain, t) for t in types])
+    return [
+        {'Type': t, 'Value': value, 'Status': '✅ Current'}
+        for t in types
+        for value in answers[(domain, t)][0]
+    ]
+
+def cached_history(source, domain, record_type, fetch, refresh=False):
+    """Serve a history source from the persistent cache, fetching (and storing) on a miss.
+    
+    Only complete fetches are cached; partial ones (quota ran out, errors)
+    are shown but queried again next time. Returns (rows, message, cached_at).
+    """
+    if not refresh:
+        cached = history_cache_get(source, domain, record_type)
+        if cached:
+            return cached[0], None, cached[1]
+    rows, complete, message = fetch()
+    if complete:
+        history_cache_put(source, domain, record_type, rows)
+    return rows, message, None
+
+HISTORY_SOURCES = {
+    'local': ("📚 Local Passive DNS", "local passive DNS"),
+    'securitytrails': ("🔒 SecurityTrails Historical DNS", "SecurityTrails"),
+    'virustotal': ("🦠 VirusTotal Passive DNS", "VirusTotal"),
+    'current': ("📍 Current DNS Records (For Comparison)", "current DNS")
+}
+
+def dns_observations(outcomes, record_type):
+    """Normalize every history source into one frame of (source, type, value, start, end) observations"""
+    frames = []
+    for name, (rows, _message, _cached) in outcomes.items():
+        if not rows:
+            continue
+        df = pd.DataFrame(rows)
+        if name == 'securitytrails':
+            # One row per RRset; split it into one row per value
+            df = df.assign(Value=df['Values'].str.split(', ')).explode('Value')
+            start, end = df['First Seen'], df['Last Seen']
+        elif name == 'virustotal':
+            # Point observations of A/AAAA resolutions
+            df = df.rename(columns={'IP Address': 'Value'})
+            df['Type'] = df['Value'].str.contains(':', regex=False).map({True: 'AAAA', False: 'A'})
+            start = end = df['Last Resolved']
+        elif name == 'current':
+            start = end = pd.Series(datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M'), index=df.index)
         else:
-            st.info("👆 Enter your SecurityTrails API key or add it to secrets.toml")
-        
-        st.markdown("---")
+            start, end = df['First Seen'], df['Last Seen']
+        frames.append(pd.DataFrame({
+            'source': HISTORY_SOURCES[name][1],
+            'type': df['Type'].values,
+            'value': df['Value'].astype(str).str.strip().str.rstrip('.').values,
+            'start': pd.to_datetime(start.values, errors='coerce', utc=True),
+            'end': pd.to_datetime(end.values, errors='coerce', utc=True)
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['source', 'type', 'value', 'start', 'end'])
+    obs = pd.concat(frames, ignore_index=True)
+    obs = obs[(obs['type'] == record_type) & (obs['value'] != '') & obs['start'].notna()]
+    # Open-ended rows (no last-seen date) are still live
+    obs['end'] = obs['end'].fillna(pd.Timestamp.now(tz='UTC'))
+    return obs
+
+def merge_dns_timeline(obs, tolerance=pd.Timedelta(days=1)):
+    """Merge observations into one interval per record value and derive change events.
+    
+    Everything is column-wise: a groupby collapses all sources per value, then
+    within each record type the intervals are ordered by start and compared
+    with the previous interval (shift) and the running max of earlier ends
+    (cummax) to classify each new value as a move or an overlap.
+    Returns (intervals, events).
+    """
+    if obs.empty:
+        return obs.assign(sources=''), pd.DataFrame(columns=['date', 'type', 'event', 'value', 'previous'])
+    
+    grouped = obs.groupby(['type', 'value'], sort=False)
+    intervals = grouped.agg(start=('start', 'min'), end=('end', 'max'), observations=('source', 'size')).reset_index()
+    # Source names per value via a presence matrix (bool x "name, " string dot product) instead of a per-group join
+    present = obs.groupby(['type', 'value', 'source'], sort=False).size().unstack(fill_value=0).gt(0).astype(object)
+    sources = present.dot(present.columns.astype(str) + ', ').str.rstrip(', ')
+    intervals = intervals.merge(sources.rename('sources').reset_index(), on=['type', 'value'])
+    intervals = intervals.sort_values(['type', 'start', 'end'], ignore_index=True)
+    
+    by_type = intervals.groupby('type', sort=False)
+    previous = by_type['value'].shift()
+    earlier_end = by_type['end'].cummax().groupby(intervals['type']).shift()
+    overlaps = intervals['start'] + tolerance < earlier_end
+    
+    events = pd.DataFrame({
+        'date': intervals['start'],
+        'type': intervals['type'],
+        'event': np.select(
+            [previous.isna(), overlaps],
+            ['first seen', 'added alongside'],
+            default='moved'
+        ),
+        'value': intervals['value'],
+        'previous': previous.fillna('')
+    })
+    intervals['overlap'] = overlaps | overlaps.groupby(intervals['type']).shift(-1, fill_value=False)
+    return intervals, events.sort_values('date', ascending=False, ignore_index=True)
+
+def render_dns_timeline(intervals, events, record_type, max_values=40):
+    """Compact Gantt-style timeline of record values plus a change log"""
+    st.subheader("🧭 Timeline & Changes")
+    if intervals.empty:
+        st.info(f"ℹ️ No dated {record_type} history to build a timeline from")
+        return
+    
+    moves = events[events['event'] == 'moved']
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Distinct Values", len(intervals))
+    with col2:
+        st.metric("Changes", len(moves))
+    with col3:
+        st.metric("Overlapping Values", int(intervals['overlap'].sum()))
+    
+    # Keep the chart compact: most recently active values, a minimum bar width for point observations
+    shown = intervals.nlargest(max_values, 'end').assign(
+        end=lambda d: d['end'].where(d['end'] > d['start'] + pd.Timedelta(days=1), d['start'] + pd.Timedelta(days=1))
+    )
+    chart = alt.Chart(shown).mark_bar(cornerRadius=2).encode(
+        x=alt.X('start:T', title=None),
+        x2='end:T',
+        y=alt.Y('value:N', sort=alt.EncodingSortField('start', order='ascending'), title=None),
+        color=alt.Color('sources:N', title="Seen by"),
+        tooltip=['value', 'sources', 'observations', alt.Tooltip('start:T', format='%Y-%m-%d'), alt.Tooltip('end:T', format='%Y-%m-%d')]
+    ).properties(height=min(600, 24 * len(shown) + 40))
+    st.altair_chart(chart, use_container_width=True)
+    if len(intervals) > max_values:
+        st.caption(f"Showing the {max_values} most recently seen of {len(intervals)} values")
+    
+    log = events.assign(
+        date=events['date'].dt.strftime('%Y-%m-%d'),
+        change=np.where(
+            events['event'] == 'moved',
+            record_type + " moved from " + events['previous'] + " to " + events['value'],
+            np.where(events['event'] == 'added alongside',
+                     events['value'] + " added alongside " + events['previous'],
+                     events['value'] + " first seen")
+        )
+    )
+    st.dataframe(log[['date', 'change']].rename(columns={'date': 'Date', 'change': 'Change'}), use_container_width=True, hide_index=True, height=min(400, 35 * len(log) + 38))
+
+def check_historical_dns(domain, use_virustotal=True, use_securitytrails=True, record_type="A",
+                         securitytrails_key="", refresh=False):
+    """Check historical DNS records from free sources.
+    
+    SecurityTrails, VirusTotal and the current records are fetched
+    concurrently; each section renders as soon as its source finishes.
+    """
+    domain = domain.strip().lower().rstrip('.')
+    st.markdown("---")
     
-    # VirusTotal Passive DNS
+    # Our own passive DNS answers instantly and costs no quota, so it goes first
+    sections = {'local': st.container()}
+    jobs = {'local': lambda: (passive_dns_history(domain, record_type), None, None)}
+    if use_securitytrails:
+        sections['securitytrails'] = st.container()
+        if securitytrails_key:
+            jobs['securitytrails'] = lambda: cached_history(
+                'securitytrails', domain, record_type,
+                lambda: fetch_securitytrails_history(domain, record_type, securitytrails_key), refresh
+            )
     if use_virustotal:
-        st.subheader("🦠 VirusTotal Passive DNS")
-        try:
-            url = f"https://www.virustotal.com/ui/domains/{domain}/resolutions?limit=40"
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'data' in data and len(data['data']) > 0:
-                    records = []
-                    for item in data['data']:
-                        ip = item.get('attributes', {}).get('ip_address', 'N/A')
-                        last_resolved = item.get('attributes', {}).get('date', 'N/A')
-                        if last_resolved != 'N/A':
-                            last_resolved = datetime.fromtimestamp(last_resolved).strftime('%Y-%m-%d %H:%M:%S')
-                        records.append({
-                            'IP Address': ip,
-                            'Last Resolved': last_resolved
-                        })
-                    
-                    df = pd.DataFrame(records)
-                    st.dataframe(df, use_container_width=True)
-                    st.success(f"✅ Found {len(records)} historical IP resolutions from VirusTotal")
-                    
-                    # Download option
-                    csv = df.to_csv(index=False)
+        sections['virustotal'] = st.container()
+        jobs['virustotal'] = lambda: cached_history('virustotal', domain, 'resolutions', lambda: fetch_virustotal_history(domain), refresh)
+    sections['current'] = st.container()
+    if DNS_AVAILABLE:
+        jobs['current'] = lambda: (fetch_current_dns(domain), None, None)
+    
+    def render(name, outcome):
+        rows, message, fetched = outcome
+        with sections[name]:
+            title, label = HISTORY_SOURCES[name]
+            st.subheader(title)
+            
+            if isinstance(message, Exception):
+                st.error(f"❌ Error querying {label}: {str(message)}")
+            elif message:
+                st.warning(f"⚠️ {message}")
+            
+            if rows:
+                df = pd.DataFrame(rows)
+                st.dataframe(df, use_container_width=True, hide_index=True)
+                if name != 'current':
+                    st.success(f"✅ Found {len(rows)} historical records from {label}")
                     st.download_button(
                         "📥 Download CSV",
-                        csv,
-                        f"virustotal_dns_{domain}_{datetime.now().strftime('%Y%m%d')}.csv",
+                        df.to_csv(index=False),
+                        f"{name}_dns_{domain}_{record_type}_{datetime.now().strftime('%Y%m%d')}.csv",
                         "text/csv",
-                        use_container_width=True
+                        use_container_width=True,
+                        key=f"download_{name}"
                     )
-                else:
-                    st.info("ℹ️ No historical records found on VirusTotal")
-            else:
-                st.warning(f"⚠️ VirusTotal returned status code: {response.status_code}")
-        except Exception as e:
-            st.error(f"❌ Error querying VirusTotal: {str(e)}")
-        
-        st.markdown("---")
-    
-    # Current DNS for comparison
-    st.subheader("📍 Current DNS Records (For Comparison)")
-    if DNS_AVAILABLE:
-        try:
-            resolver = dns.resolver.Resolver()
-            resolver.timeout = 5
-            resolver.lifetime = 5
-            
-            current_records = []
-            for rec_type in ['A', 'AAAA', 'MX', 'NS', 'TXT', 'SOA']:
-                try:
-                    answers = resolver.resolve(domain, rec_type)
-                    for rdata in answers:
-                        current_records.append({
-                            'Type': rec_type,
-                            'Value': str(rdata),
-                            'TTL': answers.rrset.ttl,
-                            'Status': '✅ Current'
-                        })
-                except:
-                    pass
+            elif not message:
+                st.info({
+                    'current': "ℹ️ No current DNS records found",
+                    'local': f"ℹ️ No {record_type} lookups of this domain recorded yet - history builds up as the team uses the DNS tools"
+                }.get(name, "ℹ️ No historical records found"))
             
-            if current_records:
-                df = pd.DataFrame(current_records)
-                st.dataframe(df, use_container_width=True)
-            else:
-                st.info("ℹ️ No current DNS records found")
-        except Exception as e:
-            st.error(f"❌ Error fetching current DNS: {str(e)}")
-    else:
-        st.warning("⚠️ DNS module not available for current record lookup")
+            if fetched:
+                st.caption(f"📦 Cached {datetime.fromtimestamp(fetched).strftime('%Y-%m-%d %H:%M')} · tick *Refresh* to query again")
+            if name in API_LIMITS:
+                show_api_budget(name)
+            st.markdown("---")
+    
+    if use_securitytrails and not securitytrails_key:
+        with sections['securitytrails']:
+            st.subheader(HISTORY_SOURCES['securitytrails'][0])
+            st.info("👆 Enter your SecurityTrails API key or add it to secrets.toml")
+            st.markdown("---")
+    if not DNS_AVAILABLE:
+        with sections['current']:
+            st.subheader(HISTORY_SOURCES['current'][0])
+            st.warning("⚠️ DNS module not available for current record lookup")
+    
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=len(jobs) or 1) as executor:
+        futures = {executor.submit(fn): name for name, fn in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = ([], e, None)
+            outcomes[futures[future]] = outcome
+            render(futures[future], outcome)
+    
+    # All sources merged into one interval per value, with the changes between them
+    intervals, events = merge_dns_timeline(dns_observations(outcomes, record_type))
+    render_dns_timeline(intervals, events, record_type)
     
     # Additional information
     st.markdown("---")
@@ -985,23 +1523,6 @@ def get_live_ns(domain):
         pass
     return []
 
-def search_kb(query):
-    """Search knowledge base for relevant articles"""
-    query = query.lower()
-    results = []
-   
-    for category, articles in HOSTAFRICA_KB.items():
-        for article in articles:
-            # Check if query matches title or keywords
-            if query in article['title'].lower():
-                results.append({**article, 'category': category, 'relevance': 2})
-            elif any(query in keyword for keyword in article['keywords']):
-                results.append({**article, 'category': category, 'relevance': 1})
-   
-    # Sort by relevance
-    results.sort(key=lambda x: x['relevance'], reverse=True)
-    return results[:10]
-    
 # Knowledge Base Articles Database
 HOSTAFRICA_KB = {
     'email': [
@@ -1066,92 +1587,3529 @@ HOSTAFRICA_KB = {
     ]
 } 
 
-# ============================================================================
-# SINGLE-PAGE NAVIGATION RENDERER
-# ============================================================================
-def _sanitize_key(s: str) -> str:
-    """Return a safe key fragment for Streamlit widget keys"""
-    return re.sub(r'\W+', '_', s).strip('_')
+# --- Search Index
+SEARCH_SYNONYMS = [
+    {'email', 'mail', 'e-mail', 'mailbox', 'inbox'},
+    {'nameserver', 'ns', 'nameservers'},
+    {'ssl', 'certificate', 'cert', 'tls', 'https'},
+    {'dns', 'zone', 'records', 'record'},
+    {'dnssec', 'ds', 'rrsig'},
+    {'ip', 'address', 'ipv4', 'ipv6'},
+    {'website', 'site', 'web', 'http'},
+    {'password', 'pass', 'pw', 'credentials'},
+    {'database', 'db', 'mysql'},
+    {'wordpress', 'wp'},
+    {'ticket', 'tickets', 'case'},
+    {'bounce', 'ndr', 'undeliverable', 'rejected'},
+    {'cpanel', 'whm'},
+    {'spam', 'junk'},
+    {'redirect', 'redirects', 'forwarding'},
+    {'error', 'errors', 'code'},
+]
+SEARCH_FIELD_WEIGHTS = {'name': 3.0, 'keywords': 2.0, 'category': 1.0, 'description': 0.5}
 
-def render_all_categories_and_tools():
-    """Render a single page with all categories and their tools (grid of buttons)"""
-    
-    # HEADER
-    # ---------------------------------------------------
-    st.markdown("""
-        <style>
-        .centered-header {
-            text-align: center;
-            margin: 1rem 0 2rem 0;
-            padding: 0 1rem;
-        }
-        
-        .centered-header h1 {
-            font-size: 2rem;
-            font-weight: 700;
-            color: #0F1724;
-            margin-bottom: 0.5rem;
-            letter-spacing: -0.02em;
-        }
-        
-        .centered-header h3 {
-            font-size: 1.1rem;
-            font-weight: 400;
-            color: #586069;
-            margin-bottom: 1rem;
-            margin-top: 0;
-        }
-        
-        .centered-header .tools-badge {
-            display: inline-block;
-            background: linear-gradient(90deg, #0078D4 0%, #2B88D8 100%);
-            color: white;
-            padding: 0.6rem 1.5rem;
-            border-radius: 8px;
-            font-size: 0.95rem;
-            font-weight: 700;
-            box-shadow: 0 4px 12px rgba(0, 120, 212, 0.2);
-            margin-bottom: 1.5rem;
-            transition: transform 180ms ease, box-shadow 180ms ease;
-        }
-        
-        .centered-header .tools-badge:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 6px 16px rgba(0, 120, 212, 0.25);
-        }
-        
-        .centered-header hr {
-            margin: 1.5rem auto;
-            max-width: 80%;
-            border: none;
-            border-top: 1px solid rgba(0, 0, 0, 0.08);
-        }
-        </style>
-        
-        <div class="centered-header">
-            <h1>🏠 Welcome to Support Buddy</h1>
-            <h3>Your Complete Technical Support Toolkit.</h3>
-            <div class="tools-badge">📊 36 tools available</div>
-            <hr>
-        </div>
-    """, unsafe_allow_html=True)
+# Extra terms a tool should be findable by beyond its name
+TOOL_SEARCH_KEYWORDS = {
+    "🔐 PIN Checker": "customer verification whmcs account",
+    "🔓 IP Unban": "firewall csf blocked unblock whitelist",
+    "📝 Bulk NS Updater": "nameserver change registrar domains",
+    "📋 cPanel and DA Checker": "directadmin server hosting account",
+    "🔍 AI Ticket Analysis": "screenshot gemini diagnose",
+    "📋 Batch Ticket Triage": "csv severity category bulk",
+    "🩺 Smart Symptom Checker": "troubleshoot diagnose problem",
+    "💬 AI Support Chat": "gemini assistant ask question",
+    "📧 AI Mail Error Assistant": "bounce smtp delivery",
+    "❓ Error Code Explainer": "smtp http status meaning",
+    "🏥 Domain Health Report": "overview mx spf dmarc ssl http smtp",
+    "🔍 Domain Status Check": "expiry registration registrar dnssec",
+    "🔎 DNS Analyzer": "a aaaa cname mx txt propagation lookup",
+    "📋 NS Authority Checker": "nameserver delegation soa authoritative",
+    "🌍 WHOIS Lookup": "registrar expiry owner dnssec rdap",
+    "📜 Historical DNS": "history passive timeline previous securitytrails virustotal",
+    "🔧 Web Error Troubleshooting": "500 403 404 htaccess white screen",
+    "🔒 SSL Certificate Checker": "expiry chain issuer",
+    "🔀 HTTPS Redirect Test": "force http",
+    "⚠️ Mixed Content Detector": "insecure padlock http assets",
+    "📊 HTTP Status Code Checker": "response headers 200 301 404",
+    "🔗 Redirect Checker": "chain 301 302 hops",
+    "📮 MX Record Checker": "mail exchanger routing",
+    "✉️ Email Account Tester": "imap pop3 smtp login credentials",
+    "📡 Mail Port Matrix": "25 465 587 993 995 imap smtp blocked",
+    "🔒 SPF/DKIM Check": "dmarc authentication txt spoofing",
+    "📄 Email Header Analyzer": "received hops delay spam headers",
+    "📭 Bounce Analyzer": "ndr delivery failure smtp",
+    "📊 DMARC Report Analyzer": "aggregate rua xml",
+    "📊 Database Size Calculator": "mysql storage quota",
+    "🔐 File Permission Checker": "chmod 644 755 ownership",
+    "🔍 IP Address Lookup": "geolocation isp asn reverse",
+    "🗂️ DNS Analyzer": "lookup records resolver",
+    "🧹 Flush DNS Cache": "ipconfig resolver clear",
+    "📚 Help Center": "knowledge base articles guides kb",
+    "🔑 Password Strength Meter": "entropy secure",
+    "📋 Copy-Paste Utilities": "text lines dedupe sort",
+    "📸 Screenshot Annotator": "image blur highlight",
+    "📝 Session Notes": "notepad scratch",
+    "🗑️ Clear Cache Instructions": "browser cookies hard refresh",
+}
 
-    for category_name, category_info in TOOL_CATEGORIES.items():
-        icon = category_info.get('icon', '')
-        description = category_info.get('description', '')
-        color = category_info.get('color', None)
+def search_tokens(text):
+    """Lowercase alphanumeric tokens (emoji and punctuation dropped)"""
+    return re.findall(r'[a-z0-9]+', text.lower())
 
-        # Category header
-        st.markdown(f"## {icon} {category_name}")
-        if description:
-            st.caption(description)
+def _trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
 
-        tools = category_info.get('tools', [])
-        num_cols = 4
+class SearchIndex:
+    """Inverted index over tool and KB documents with synonym and trigram fuzzy matching.
+    
+    Every document field is tokenized once at build time into weighted postings;
+    a query token expands to itself, its synonyms, vocabulary words it prefixes
+    and (for tokens of 4+ chars) trigram neighbours, so typos like
+    "sertificate" still land on "certificate". Expansions are memoized per token.
+    """
+    
+    def __init__(self, tool_categories, kb, tool_keywords):
+        self.docs = []
+        self.postings = collections.defaultdict(dict)
+        self.synonyms = {}
+        for group in SEARCH_SYNONYMS:
+            for word in group:
+                self.synonyms.setdefault(word, set()).update(group)
+        
+        seen_tools = set()
+        for category, info in tool_categories.items():
+            for tool in info['tools']:
+                if tool in seen_tools:
+                    continue
+                seen_tools.add(tool)
+                self._add({'kind': 'tool', 'tool': tool, 'category': category,
+                           'description': info['description'], 'icon': info['icon']},
+                          name=tool, keywords=tool_keywords.get(tool, ''),
+                          category=category, description=info['description'])
+        for category, articles in kb.items():
+            for article in articles:
+                self._add({'kind': 'kb', **article, 'category': category},
+                          name=article['title'], keywords=' '.join(article['keywords']),
+                          category=category)
+        
+        self.vocab = sorted(self.postings)
+        self.trigrams = collections.defaultdict(set)
+        for token in self.vocab:
+            for gram in _trigrams(token):
+                self.trigrams[gram].add(token)
+        total = len(self.docs)
+        self.idf = {token: math.log(1 + total / len(docs)) for token, docs in self.postings.items()}
+        self.expansions = {}
+    
+    def _add(self, doc, **fields):
+        doc_id = len(self.docs)
+        self.docs.append(doc)
+        for field, text in fields.items():
+            weight = SEARCH_FIELD_WEIGHTS[field]
+            for token in search_tokens(text):
+                if self.postings[token].get(doc_id, 0) < weight:
+                    self.postings[token][doc_id] = weight
+    
+    def _expand(self, token):
+        """Map a query token to {vocab token: similarity}"""
+        if token in self.expansions:
+            return self.expansions[token]
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+        if len(token) >= 2:
+            for word in self.vocab[bisect.bisect_left(self.vocab, token):]:
+                if not word.startswith(token):
+                    break
+                matches.setdefault(word, 0.9)
+        if not matches and len(token) >= 4:
+            grams = _trigrams(token)
+            counts = collections.Counter(w for g in grams for w in self.trigrams.get(g, ()))
+            for word, shared in counts.items():
+                similarity = 2 * shared / (len(grams) + len(word))
+                if similarity >= 0.5:
+                    matches[word] = similarity * 0.8
+        for word, similarity in [(token, 1.0), *matches.items()]:
+            for synonym in self.synonyms.get(word, ()):
+                if synonym in self.postings and synonym not in matches:
+                    matches[synonym] = similarity * 0.7
+        self.expansions[token] = matches
+        return matches
+    
+    def search(self, query, kind=None, limit=10):
+        """Rank documents by weighted token hits; documents matching more query tokens win"""
+        tokens = list(dict.fromkeys(search_tokens(query)))
+        if not tokens:
+            return []
+        scores = collections.defaultdict(float)
+        hits = collections.Counter()
+        for token in tokens:
+            best = {}
+            for word, similarity in self._expand(token).items():
+                boost = similarity * self.idf[word]
+                for doc_id, weight in self.postings[word].items():
+                    best[doc_id] = max(best.get(doc_id, 0), weight * boost)
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+                hits[doc_id] += 1
+        ranked = sorted(
+            ((score * hits[doc_id] / len(tokens), doc_id) for doc_id, score in scores.items()
+             if kind is None or self.docs[doc_id]['kind'] == kind),
+            reverse=True
+        )
+        return [{**self.docs[doc_id], 'relevance': round(score, 2)} for score, doc_id in ranked[:limit]]
 
-        # Render tools in rows of num_cols
-        for row_start in range(0, len(tools), num_cols):
-            cols = st.columns(num_cols)
+@st.cache_resource(ttl=CONFIG['cache_ttl'], show_spinner=False)
+def get_search_index():
+    """Tools plus every article in the Help Center index, rebuilt at most once per cache TTL"""
+    try:
+        cached_kb_sync()
+    except (OSError, sqlite3.Error):
+        pass
+    return SearchIndex(TOOL_CATEGORIES, kb_search_catalogue() or HOSTAFRICA_KB, TOOL_SEARCH_KEYWORDS)
+
+# --- Help Center Full-Text Index
+# Articles from every corpus source live in one SQLite table; an external-content
+# FTS5 table kept in sync by triggers gives persisted BM25 ranking and snippets.
+KB_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    version TEXT NOT NULL,
+    title TEXT NOT NULL,
+    url TEXT NOT NULL DEFAULT '',
+    category TEXT NOT NULL DEFAULT 'general',
+    keywords TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS articles_source ON articles (source);
+CREATE INDEX IF NOT EXISTS articles_category ON articles (category);
+CREATE VIRTUAL TABLE IF NOT EXISTS kb_fts USING fts5(
+    title, keywords, body, content='articles', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS articles_ai AFTER INSERT ON articles BEGIN
+    INSERT INTO kb_fts (rowid, title, keywords, body) VALUES (new.id, new.title, new.keywords, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_ad AFTER DELETE ON articles BEGIN
+    INSERT INTO kb_fts (kb_fts, rowid, title, keywords, body) VALUES ('delete', old.id, old.title, old.keywords, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_au AFTER UPDATE ON articles BEGIN
+    INSERT INTO kb_fts (kb_fts, rowid, title, keywords, body) VALUES ('delete', old.id, old.title, old.keywords, old.body);
+    INSERT INTO kb_fts (rowid, title, keywords, body) VALUES (new.id, new.title, new.keywords, new.body);
+END;
+"""
+KB_BM25_WEIGHTS = (10.0, 5.0, 1.0)  # title, keywords, body
+KB_ARTICLE_EXTENSIONS = ('.md', '.txt', '.html', '.htm')
+KB_CATEGORY_LABELS = {
+    'email': '📧 Email',
+    'domain': '🌐 Domain & DNS',
+    'cpanel': '🔧 cPanel',
+    'ssl': '🔒 SSL & HTTPS',
+    'wordpress': '💻 WordPress',
+    'ftp': '📁 FTP',
+    'billing': '💳 Billing',
+    'troubleshooting': '🔍 Troubleshooting'
+}
+
+def kb_category_label(category):
+    return KB_CATEGORY_LABELS.get(category, f"📂 {category.replace('_', ' ').replace('-', ' ').title()}")
+
+def _kb_digest(article):
+    return hashlib.sha1(json.dumps(article, sort_keys=True, default=str).encode()).hexdigest()
+
+def parse_kb_article(text, filename, category):
+    """Article dict from a markdown, text or HTML file.
+    
+    Markdown/text files may start with `---` front matter of `key: value`
+    lines (title, url, category, keywords); otherwise the first heading or
+    line is the title.
+    """
+    article = {'title': '', 'url': '', 'category': category, 'keywords': ''}
+    if filename.lower().endswith(('.html', '.htm')):
+        soup = BeautifulSoup(text, 'html.parser')
+        canonical = soup.find('link', rel='canonical')
+        keywords = soup.find('meta', attrs={'name': 'keywords'})
+        heading = soup.find('h1')
+        article['title'] = (heading or soup.title).get_text(strip=True) if (heading or soup.title) else ''
+        article['url'] = canonical.get('href', '') if canonical else ''
+        article['keywords'] = keywords.get('content', '') if keywords else ''
+        for tag in soup(['head', 'script', 'style', 'nav', 'header', 'footer']):
+            tag.decompose()
+        body = re.sub(r'\n\s*\n+', '\n\n', soup.get_text('\n', strip=True))
+    else:
+        body = text
+        match = re.match(r'---\s*\n(.*?)\n---\s*\n', text, re.DOTALL)
+        if match:
+            for line in match.group(1).splitlines():
+                key, _, value = line.partition(':')
+                if key.strip().lower() in article and value.strip():
+                    article[key.strip().lower()] = value.strip()
+            body = text[match.end():]
+        if not article['title']:
+            first = next((line for line in body.splitlines() if line.strip()), '')
+            article['title'] = first.lstrip('#').strip()
+    article['title'] = article['title'][:200] or os.path.splitext(os.path.basename(filename))[0]
+    article['body'] = body.strip()
+    return article
+
+def _kb_file_article(path, root):
+    rel = os.path.relpath(path, root)
+    category = rel.split(os.sep)[0] if os.sep in rel else 'general'
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return parse_kb_article(f.read(), path, category)
+
+def kb_corpus_entries(path):
+    """(key, version, load) for each article under a corpus directory or JSON/JSONL file.
+    
+    Directory entries are versioned by mtime and size so unchanged files are
+    never read; records in a JSON file are versioned by content digest.
+    """
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(KB_ARTICLE_EXTENSIONS):
+                    continue
+                full = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full)
+                except OSError:
+                    continue
+                yield (
+                    f"file:{os.path.relpath(full, path)}",
+                    f"{stat.st_mtime_ns}:{stat.st_size}",
+                    lambda full=full: _kb_file_article(full, path)
+                )
+    elif os.path.isfile(path):
+        with open(path, encoding='utf-8') as f:
+            if path.lower().endswith('.jsonl'):
+                records = [json.loads(line) for line in f if line.strip()]
+            else:
+                records = json.load(f)
+        for i, record in enumerate(records):
+            article = {
+                'title': str(record.get('title', '')).strip() or f"Article {i + 1}",
+                'url': record.get('url', ''),
+                'category': record.get('category') or 'general',
+                'keywords': record['keywords'] if isinstance(record.get('keywords'), str) else ', '.join(record.get('keywords') or []),
+                'body': record.get('body') or record.get('content') or ''
+            }
+            key = record.get('id') or article['url'] or article['title']
+            yield f"file:{key}", _kb_digest(article), lambda article=article: article
+
+def builtin_kb_entries():
+    """The curated HOSTAFRICA_KB category links"""
+    for category, articles in HOSTAFRICA_KB.items():
+        for item in articles:
+            article = {
+                'title': item['title'],
+                'url': item['url'],
+                'category': category,
+                'keywords': ', '.join(item['keywords']),
+                'body': ''
+            }
+            yield f"builtin:{category}:{item['title']}", _kb_digest(article), lambda article=article: article
+
+def kb_sources():
+    """Corpus sources by name; articles that disappear from a source are dropped from the index"""
+    path = CONFIG['kb_path'] or os.path.join(CONFIG['data_dir'], 'kb')
+    return {'builtin': builtin_kb_entries(), 'files': kb_corpus_entries(path), 'mirror': mirror_kb_entries()}
+
+def sync_kb_index(sources=None):
+    """Incrementally bring the persisted index in line with the corpus.
+    
+    Only new or changed articles are loaded and re-indexed. Returns counts of
+    added, updated, removed, unchanged and unreadable articles.
+    """
+    stats = dict.fromkeys(('added', 'updated', 'removed', 'unchanged', 'errors'), 0)
+    with closing(get_db('kb_index', KB_INDEX_SCHEMA)) as conn, conn:
+        for source, entries in (sources or kb_sources()).items():
+            known = dict(conn.execute("SELECT key, version FROM articles WHERE source = ?", (source,)))
+            seen = set()
+            try:
+                for key, version, load in entries:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if known.get(key) == version:
+                        stats['unchanged'] += 1
+                        continue
+                    try:
+                        article = load()
+                    except (OSError, ValueError):
+                        stats['errors'] += 1
+                        continue
+                    conn.execute(
+                        "INSERT INTO articles (key, source, version, title, url, category, keywords, body) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                        "source = excluded.source, version = excluded.version, title = excluded.title, url = excluded.url, "
+                        "category = excluded.category, keywords = excluded.keywords, body = excluded.body",
+                        (key, source, version, article['title'], article['url'] or '', article['category'].lower(),
+                         article['keywords'], article['body'])
+                    )
+                    stats['updated' if key in known else 'added'] += 1
+            except (OSError, ValueError):
+                # An unreadable corpus file leaves that source's articles as they were
+                stats['errors'] += 1
+                continue
+            stale = [(key,) for key in known if key not in seen]
+            conn.executemany("DELETE FROM articles WHERE key = ?", stale)
+            stats['removed'] += len(stale)
+    return stats
+
+@st.cache_data(ttl=CONFIG['cache_ttl'], show_spinner=False)
+def cached_kb_sync():
+    """Re-scan the corpus at most once per cache TTL"""
+    start = time.perf_counter()
+    stats = sync_kb_index()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def _fts_query(query, any_term=False):
+    """FTS5 MATCH expression from free text; the last word is a prefix for type-ahead"""
+    tokens = search_tokens(query)
+    if not tokens:
+        return ''
+    terms = [f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*']
+    return (' OR ' if any_term else ' ').join(terms)
+
+def _markdown_snippet(text):
+    """Escape article text for st.markdown, turning \\x02/\\x03 match markers into bold"""
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'([\\`*_{}\[\]<>()#+|!$~])', r'\\\1', text)
+    return text.replace('\x02', '**').replace('\x03', '**')
+
+def kb_search_catalogue():
+    """{category: [article]} of indexed titles, URLs and keywords (no bodies) for SearchIndex"""
+    try:
+        with closing(get_db('kb_index', KB_INDEX_SCHEMA)) as conn:
+            rows = conn.execute(
+                "SELECT id, title, url, category, keywords FROM articles ORDER BY source = 'builtin' DESC, id"
+            ).fetchall()
+    except sqlite3.Error:
+        return {}
+    catalogue = collections.defaultdict(list)
+    for doc_id, title, url, category, keywords in rows:
+        catalogue[category].append({
+            'id': doc_id, 'title': title, 'url': url,
+            'keywords': [k.strip() for k in keywords.split(',') if k.strip()]
+        })
+    return dict(catalogue)
+
+def _fuzzy_kb_search(conn, query, category, limit):
+    """Typo-tolerant fallback: trigram and synonym matches on titles and keywords"""
+    hits = [
+        hit for hit in get_search_index().search(query, kind='kb', limit=None)
+        if 'id' in hit and (not category or hit['category'] == category)
+    ][:limit]
+    if not hits:
+        return []
+    bodies = dict(conn.execute(
+        f"SELECT id, body FROM articles WHERE id IN ({','.join('?' * len(hits))})",
+        [hit['id'] for hit in hits]
+    ))
+    return [
+        {
+            'title': hit['title'],
+            'url': hit['url'],
+            'category': hit['category'],
+            'keywords': hit['keywords'],
+            'body': bodies.get(hit['id'], ''),
+            'snippet': '',
+            'relevance': hit['relevance']
+        }
+        for hit in hits
+    ]
+
+def search_kb(query, category=None, limit=10):
+    """BM25-ranked articles for a query, each with a highlighted snippet.
+    
+    All words must match; if nothing does, any word may match, and failing
+    that the fuzzy SearchIndex is asked. Ranking runs first on rowids alone
+    so snippets are only built for the returned page.
+    """
+    rank_sql = "SELECT kb_fts.rowid, bm25(kb_fts, ?, ?, ?) AS score FROM kb_fts"
+    if category:
+        rank_sql += " JOIN articles a ON a.id = kb_fts.rowid WHERE kb_fts MATCH ? AND a.category = ?"
+    else:
+        rank_sql += " WHERE kb_fts MATCH ?"
+    rank_sql += " ORDER BY score LIMIT ?"
+    try:
+        with closing(get_db('kb_index', KB_INDEX_SCHEMA)) as conn:
+            for any_term in (False, True):
+                match = _fts_query(query, any_term)
+                if not match:
+                    return []
+                ranked = conn.execute(rank_sql, [*KB_BM25_WEIGHTS, match, *([category] if category else []), limit]).fetchall()
+                if ranked:
+                    break
+            else:
+                return _fuzzy_kb_search(conn, query, category, limit)
+            scores = dict(ranked)
+            rows = conn.execute(
+                "SELECT a.id, a.title, a.url, a.category, a.keywords, a.body, "
+                "snippet(kb_fts, 2, char(2), char(3), ' … ', 24) "
+                f"FROM kb_fts JOIN articles a ON a.id = kb_fts.rowid WHERE kb_fts MATCH ? "
+                f"AND kb_fts.rowid IN ({','.join('?' * len(scores))})",
+                [match, *scores]
+            ).fetchall()
+    except sqlite3.Error:
+        return []
+    rows.sort(key=lambda row: scores[row[0]])
+    return [
+        {
+            'title': title,
+            'url': url,
+            'category': cat,
+            'keywords': [k.strip() for k in keywords.split(',') if k.strip()],
+            'body': body,
+            'snippet': _markdown_snippet(snippet) if body else '',
+            'relevance': round(-scores[doc_id], 2)
+        }
+        for doc_id, title, url, cat, keywords, body, snippet in rows
+    ]
+
+def kb_categories():
+    """(category, article count) for every category with indexed articles"""
+    try:
+        with closing(get_db('kb_index', KB_INDEX_SCHEMA)) as conn:
+            return conn.execute("SELECT category, COUNT(*) FROM articles GROUP BY category ORDER BY category").fetchall()
+    except sqlite3.Error:
+        return []
+
+def kb_articles(category, limit=50):
+    """Articles in a category, curated links first"""
+    try:
+        with closing(get_db('kb_index', KB_INDEX_SCHEMA)) as conn:
+            rows = conn.execute(
+                "SELECT title, url, keywords, body FROM articles WHERE category = ? "
+                "ORDER BY source = 'builtin' DESC, title LIMIT ?",
+                (category, limit)
+            ).fetchall()
+    except sqlite3.Error:
+        return []
+    return [
+        {'title': title, 'url': url, 'keywords': [k.strip() for k in keywords.split(',') if k.strip()], 'body': body}
+        for title, url, keywords, body in rows
+    ]
+
+# --- Help Center Mirror
+# A local copy of the help site: the sitemap is walked, pages are fetched
+# concurrently with conditional requests, and cleaned text is stored
+# zlib-compressed. The mirror is one of the Help Center corpus sources.
+KB_MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    lastmod TEXT NOT NULL DEFAULT '',
+    etag TEXT NOT NULL DEFAULT '',
+    last_modified TEXT NOT NULL DEFAULT '',
+    fetched_at INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    title TEXT NOT NULL,
+    category TEXT NOT NULL,
+    body BLOB NOT NULL
+);
+"""
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+def fetch_sitemap_urls(session, base_url, max_urls=None):
+    """{page url: lastmod} from the site's sitemap, following sitemap indexes and robots.txt hints"""
+    max_urls = max_urls or CONFIG['kb_mirror_max_pages']
+    base_url = base_url.rstrip('/')
+    host = urllib.parse.urlparse(base_url).netloc.lower()
+    # Sitemaps and pages must stay on the mirrored host
+    on_site = lambda loc: urllib.parse.urlparse(loc).netloc.lower() == host
+    pending = [f"{base_url}/sitemap.xml"]
+    try:
+        robots = session.get(f"{base_url}/robots.txt", timeout=CONFIG['request_timeout'])
+        if robots.ok:
+            pending = [loc for loc in re.findall(r'(?im)^\s*sitemap:\s*(\S+)', robots.text) if on_site(loc)] or pending
+    except requests.exceptions.RequestException:
+        pass
+    urls, visited = {}, set()
+    while pending and len(urls) < max_urls:
+        sitemap = pending.pop(0)
+        if sitemap in visited:
+            continue
+        visited.add(sitemap)
+        response = session.get(sitemap, timeout=CONFIG['request_timeout'])
+        response.raise_for_status()
+        content = gzip.decompress(response.content) if sitemap.endswith('.gz') else response.content
+        root = ET.fromstring(content)
+        for node in root:
+            loc = (node.findtext(f'{SITEMAP_NS}loc') or node.findtext('loc') or '').strip()
+            if not loc or not on_site(loc):
+                continue
+            if node.tag.endswith('sitemap'):
+                pending.append(loc)
+            elif len(urls) < max_urls:
+                urls[loc] = (node.findtext(f'{SITEMAP_NS}lastmod') or node.findtext('lastmod') or '').strip()
+    return urls
+
+def clean_kb_page(html, url):
+    """Article dict from a help page; the category comes from the breadcrumb trail, else the URL path"""
+    soup = BeautifulSoup(html, 'html.parser')
+    crumbs = soup.select('[class*="breadcrumb"] a')
+    if len(crumbs) >= 2:
+        category = crumbs[-1].get_text(strip=True)
+    else:
+        parts = [p for p in urllib.parse.urlparse(url).path.split('/') if p]
+        category = parts[-2] if len(parts) >= 2 else 'general'
+    for tag in soup.select('[class*="breadcrumb"], [class*="sidebar"], [class*="related"], form'):
+        tag.decompose()
+    article = parse_kb_article(str(soup), 'page.html', re.sub(r'[^a-z0-9]+', '-', category.lower()).strip('-') or 'general')
+    article['url'] = url
+    return article
+
+def _fetch_kb_page(session, url, known):
+    """Conditional GET and clean-up of one page; returns (url, status, headers, article, size)"""
+    headers = {}
+    if known:
+        if known['etag']:
+            headers['If-None-Match'] = known['etag']
+        if known['last_modified']:
+            headers['If-Modified-Since'] = known['last_modified']
+    response = session.get(url, headers=headers, timeout=CONFIG['request_timeout'])
+    if response.status_code == 304:
+        return url, 304, response.headers, None, 0
+    response.raise_for_status()
+    # Parse in the worker so the HTML clean-up overlaps with other downloads
+    return url, response.status_code, response.headers, clean_kb_page(response.text, url), len(response.text)
+
+def sync_kb_mirror(base_url=None, workers=None, on_progress=None):
+    """Bring the local mirror up to date with the live site.
+    
+    Pages whose sitemap lastmod is unchanged are not requested at all; the
+    rest are fetched concurrently with If-None-Match/If-Modified-Since, and
+    only pages whose cleaned text changed are rewritten. Pages that left the
+    sitemap are removed. `on_progress(done, total)` is called as pages finish.
+    """
+    base_url = base_url or CONFIG['kb_mirror_url']
+    workers = workers or CONFIG['kb_mirror_workers']
+    stats = dict.fromkeys(('pages', 'unchanged', 'not_modified', 'changed', 'added', 'removed', 'errors', 'bytes'), 0)
+    session = create_session()
+    adapter = HTTPAdapter(pool_maxsize=workers, max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504]))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    
+    sitemap = fetch_sitemap_urls(session, base_url)
+    stats['pages'] = len(sitemap)
+    with closing(get_db('kb_mirror', KB_MIRROR_SCHEMA)) as conn:
+        known = {
+            url: {'lastmod': lastmod, 'etag': etag, 'last_modified': last_modified, 'digest': digest}
+            for url, lastmod, etag, last_modified, digest
+            in conn.execute("SELECT url, lastmod, etag, last_modified, digest FROM pages")
+        }
+        to_fetch = [
+            url for url, lastmod in sitemap.items()
+            if url not in known or not lastmod or lastmod != known[url]['lastmod']
+        ]
+        stats['unchanged'] = len(sitemap) - len(to_fetch)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_fetch_kb_page, session, url, known.get(url)) for url in to_fetch]
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    url, status, headers, article, size = future.result()
+                except requests.exceptions.RequestException:
+                    stats['errors'] += 1
+                    continue
+                finally:
+                    if on_progress:
+                        on_progress(done, len(futures))
+                now = int(time.time())
+                with conn:
+                    if status == 304:
+                        stats['not_modified'] += 1
+                        conn.execute("UPDATE pages SET lastmod = ?, fetched_at = ? WHERE url = ?", (sitemap[url], now, url))
+                        continue
+                    stats['bytes'] += size
+                    digest = _kb_digest(article)
+                    previous = known.get(url)
+                    if previous and previous['digest'] == digest:
+                        stats['not_modified'] += 1
+                    else:
+                        stats['changed' if previous else 'added'] += 1
+                    conn.execute(
+                        "INSERT OR REPLACE INTO pages (url, lastmod, etag, last_modified, fetched_at, digest, title, category, body) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (url, sitemap[url], headers.get('ETag', ''), headers.get('Last-Modified', ''), now, digest,
+                         article['title'], article['category'], zlib.compress(article['body'].encode(), 9))
+                    )
+        
+        # Only prune when the sitemap came back non-empty, so a broken sitemap can't wipe the mirror
+        stale = [(url,) for url in known if url not in sitemap] if sitemap else []
+        with conn:
+            conn.executemany("DELETE FROM pages WHERE url = ?", stale)
+        stats['removed'] = len(stale)
+    return stats
+
+def mirror_kb_entries():
+    """Mirrored pages as a corpus source, versioned by their cleaned-text digest"""
+    try:
+        with closing(get_db('kb_mirror', KB_MIRROR_SCHEMA)) as conn:
+            rows = conn.execute("SELECT url, digest FROM pages").fetchall()
+    except sqlite3.Error:
+        return
+    
+    def load(url):
+        with closing(get_db('kb_mirror', KB_MIRROR_SCHEMA)) as conn:
+            title, category, body = conn.execute("SELECT title, category, body FROM pages WHERE url = ?", (url,)).fetchone()
+        return {'title': title, 'url': url, 'category': category, 'keywords': '', 'body': zlib.decompress(body).decode()}
+    
+    for url, digest in rows:
+        yield f"mirror:{url}", digest, lambda url=url: load(url)
+
+def kb_mirror_summary():
+    """(pages, compressed bytes, last fetch time) for the local mirror"""
+    try:
+        with closing(get_db('kb_mirror', KB_MIRROR_SCHEMA)) as conn:
+            return conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0), MAX(fetched_at) FROM pages").fetchone()
+    except sqlite3.Error:
+        return 0, 0, None
+
+# --- Session Notes Store
+# One current body per (agent, ticket) plus reverse deltas for older revisions:
+# revision k is rebuilt by applying the deltas for n-1 ... k to the current body.
+# Saves within `notes_revision_window` of the current revision's start amend it.
+NOTES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    agent TEXT NOT NULL,
+    ticket TEXT NOT NULL,
+    body TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1,
+    revised REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (agent, ticket)
+);
+CREATE TABLE IF NOT EXISTS note_revisions (
+    note_id INTEGER NOT NULL,
+    revision INTEGER NOT NULL,
+    saved REAL NOT NULL,
+    delta TEXT NOT NULL,
+    PRIMARY KEY (note_id, revision)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    ticket, body, content='notes', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, ticket, body) VALUES (new.id, new.ticket, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, ticket, body) VALUES ('delete', old.id, old.ticket, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE OF body ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, ticket, body) VALUES ('delete', old.id, old.ticket, old.body);
+    INSERT INTO notes_fts (rowid, ticket, body) VALUES (new.id, new.ticket, new.body);
+END;
+"""
+
+def make_text_delta(new, old):
+    """Compact line delta that rebuilds `old` from `new`: copy ranges of `new` plus inserted lines"""
+    new_lines, old_lines = new.splitlines(keepends=True), old.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, new_lines, old_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('replace', 'insert'):
+            ops.append(''.join(old_lines[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'))
+
+def apply_text_delta(new, delta):
+    new_lines = new.splitlines(keepends=True)
+    return ''.join(''.join(new_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in json.loads(delta))
+
+def _note_key(agent, ticket):
+    return agent.strip().lower(), ticket.strip().upper() or 'GENERAL'
+
+def load_note(agent, ticket):
+    """(body, revision, updated) of a note, or ('', 0, None) if it doesn't exist yet"""
+    with closing(get_db('notes', NOTES_SCHEMA)) as conn:
+        row = conn.execute(
+            "SELECT body, revision, updated FROM notes WHERE agent = ? AND ticket = ?", _note_key(agent, ticket)
+        ).fetchone()
+    return row or ('', 0, None)
+
+def save_note(agent, ticket, body):
+    """Persist a note, amending the current revision or starting a new one. Returns the revision number."""
+    agent, ticket = _note_key(agent, ticket)
+    now = time.time()
+    with closing(get_db('notes', NOTES_SCHEMA)) as conn, conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT id, body, revision, revised FROM notes WHERE agent = ? AND ticket = ?", (agent, ticket)).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO notes (agent, ticket, body, revision, revised, updated) VALUES (?, ?, ?, 1, ?, ?)",
+                (agent, ticket, body, now, now)
+            )
+            return 1
+        note_id, old_body, revision, revised = row
+        if body == old_body:
+            return revision
+        if now - revised < CONFIG['notes_revision_window']:
+            # Amend: the delta to the previous revision must now start from the new body
+            previous = conn.execute(
+                "SELECT delta FROM note_revisions WHERE note_id = ? AND revision = ?", (note_id, revision - 1)
+            ).fetchone()
+            if previous:
+                conn.execute(
+                    "UPDATE note_revisions SET delta = ? WHERE note_id = ? AND revision = ?",
+                    (make_text_delta(body, apply_text_delta(old_body, previous[0])), note_id, revision - 1)
+                )
+            conn.execute("UPDATE notes SET body = ?, updated = ? WHERE id = ?", (body, now, note_id))
+            return revision
+        conn.execute(
+            "INSERT INTO note_revisions (note_id, revision, saved, delta) VALUES (?, ?, ?, ?)",
+            (note_id, revision, revised, make_text_delta(body, old_body))
+        )
+        conn.execute(
+            "UPDATE notes SET body = ?, revision = ?, revised = ?, updated = ? WHERE id = ?",
+            (body, revision + 1, now, now, note_id)
+        )
+        return revision + 1
+
+def note_history(agent, ticket):
+    """[(revision, saved time, body)] newest first, rebuilt from the reverse deltas"""
+    agent, ticket = _note_key(agent, ticket)
+    with closing(get_db('notes', NOTES_SCHEMA)) as conn:
+        row = conn.execute("SELECT id, body, revision, revised FROM notes WHERE agent = ? AND ticket = ?", (agent, ticket)).fetchone()
+        if row is None:
+            return []
+        note_id, body, revision, revised = row
+        deltas = conn.execute(
+            "SELECT revision, saved, delta FROM note_revisions WHERE note_id = ? ORDER BY revision DESC", (note_id,)
+        ).fetchall()
+    history = [(revision, revised, body)]
+    for rev, saved, delta in deltas:
+        body = apply_text_delta(body, delta)
+        history.append((rev, saved, body))
+    return history
+
+def search_notes(query, agent=None, limit=20):
+    """Notes matching a full-text query, best first, with highlighted snippets"""
+    match = _fts_query(query)
+    if not match:
+        return []
+    sql = (
+        "SELECT n.agent, n.ticket, n.updated, snippet(notes_fts, 1, char(2), char(3), ' … ', 16) "
+        "FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid WHERE notes_fts MATCH ?"
+    )
+    params = [match]
+    if agent:
+        sql += " AND n.agent = ?"
+        params.append(_note_key(agent, '')[0])
+    sql += " ORDER BY bm25(notes_fts, 5.0, 1.0) LIMIT ?"
+    try:
+        with closing(get_db('notes', NOTES_SCHEMA)) as conn:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+    except sqlite3.Error:
+        return []
+    return [
+        {'agent': a, 'ticket': t, 'updated': updated, 'snippet': _markdown_snippet(snippet)}
+        for a, t, updated, snippet in rows
+    ]
+
+def recent_notes(agent, limit=10):
+    """(ticket, updated) of an agent's most recently edited notes"""
+    with closing(get_db('notes', NOTES_SCHEMA)) as conn:
+        return conn.execute(
+            "SELECT ticket, updated FROM notes WHERE agent = ? AND body != '' ORDER BY updated DESC LIMIT ?",
+            (_note_key(agent, '')[0], limit)
+        ).fetchall()
+
+def flush_session_notes(force=False):
+    """Debounced autosave: write the open note if it changed and the last write is old enough (or forced)"""
+    ss = st.session_state
+    owner = ss.get('notes_loaded_for')
+    if not owner or ss.session_notes == ss.notes_saved_text:
+        return False
+    if not force and time.time() - ss.notes_saved_at < CONFIG['notes_autosave_interval']:
+        return False
+    try:
+        ss.notes_revision = save_note(*owner, ss.session_notes)
+    except sqlite3.Error:
+        return False
+    ss.notes_saved_text = ss.session_notes
+    ss.notes_saved_at = time.time()
+    return True
+
+@st.fragment(run_every=CONFIG['notes_autosave_interval'])
+def notes_autosave_status():
+    """Re-runs on its own so edits are flushed even when the agent stops interacting"""
+    flush_session_notes()
+    ss = st.session_state
+    if ss.session_notes != ss.notes_saved_text:
+        st.caption("⏳ Unsaved changes - autosaving shortly")
+    elif ss.notes_revision:
+        st.caption(f"💾 Saved · revision {ss.notes_revision} · {datetime.fromtimestamp(ss.notes_saved_at).strftime('%H:%M:%S')}")
+
+# --- Screenshot Annotator
+# Uploads are decoded once per content hash into a reduced working copy;
+# annotations are (kind, x1, y1, x2, y2, color) tuples in percent of the
+# image so the same list can be drawn on the preview or the full-size export.
+ANNOTATION_KINDS = {'box': '🟥 Box', 'arrow': '➡️ Arrow', 'blur': '🫥 Blur (PII)'}
+
+def open_bounded_image(data, max_edge=None):
+    """Decode an image as RGB, at most `max_edge` px on the long side (None = full size).
+    
+    The header is checked against `annotator_max_pixels` before any pixels
+    are decoded, and JPEGs are decoded directly at reduced scale via draft().
+    Returns (image, info) or raises ValueError for oversized or unreadable files.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        info = {'format': image.format, 'mode': image.mode, 'size': image.size}
+        if image.width * image.height > CONFIG['annotator_max_pixels']:
+            raise ValueError(
+                f"{image.width} x {image.height} is over the {CONFIG['annotator_max_pixels'] / 1e6:.0f} megapixel limit"
+            )
+        if max_edge:
+            image.draft('RGB', (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        if max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Could not read image: {e}") from e
+    return image, info
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def load_screenshot(digest, _data):
+    """Working copy of an upload, decoded once per content hash"""
+    return open_bounded_image(_data, CONFIG['annotator_work_edge'])
+
+def draw_annotations(image, annotations):
+    """Copy of `image` with boxes, arrows and PII blurs drawn on it"""
+    image = image.copy()
+    draw = ImageDraw.Draw(image)
+    width = max(2, min(image.size) // 200)
+    for kind, x1, y1, x2, y2, color in annotations:
+        box = (
+            round(x1 * image.width / 100), round(y1 * image.height / 100),
+            round(x2 * image.width / 100), round(y2 * image.height / 100)
+        )
+        if kind == 'box':
+            draw.rectangle((min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])), outline=color, width=width)
+        elif kind == 'arrow':
+            draw.line(box, fill=color, width=width)
+            angle = math.atan2(box[3] - box[1], box[2] - box[0])
+            head = width * 5
+            draw.polygon([
+                (box[2], box[3]),
+                (box[2] - head * math.cos(angle - 0.45), box[3] - head * math.sin(angle - 0.45)),
+                (box[2] - head * math.cos(angle + 0.45), box[3] - head * math.sin(angle + 0.45))
+            ], fill=color)
+        elif kind == 'blur':
+            region = (min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3]))
+            if region[2] > region[0] and region[3] > region[1]:
+                patch = image.crop(region)
+                # Pixelate before blurring so the text can't be recovered by sharpening
+                small = patch.resize((max(1, patch.width // 12), max(1, patch.height // 12)), Image.BILINEAR)
+                patch = small.resize(patch.size, Image.NEAREST).filter(ImageFilter.GaussianBlur(width * 2))
+                image.paste(patch, region[:2])
+    return image
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def annotated_preview(digest, annotations, _image):
+    """Preview render for one (upload, annotation list) pair"""
+    return draw_annotations(_image, annotations)
+
+def export_annotated(image, annotations):
+    """Encode an annotated screenshot as PNG"""
+    out = io.BytesIO()
+    draw_annotations(image, annotations).save(out, format='PNG', optimize=False)
+    return out.getvalue()
+
+# --- Entity Extraction
+# One combined pattern finds every candidate in a single scan; alternatives are
+# ordered so URLs and emails win over the hostnames inside them.
+ENTITY_PATTERN = re.compile(
+    r'(?P<url>\bhttps?://[^\s<>"\'`]+)'
+    r'|(?P<email>\b[A-Za-z0-9._%+-]+@(?:[A-Za-z0-9-]+\.)+[A-Za-z][A-Za-z0-9-]{1,62}\b)'
+    r'|(?P<ipv6>(?<![\w:.])(?:[0-9A-Fa-f]{0,4}:){2,7}(?:(?:\d{1,3}\.){3}\d{1,3}|[0-9A-Fa-f]{1,4})?(?![\w:.]))'
+    r'|(?P<ipv4>(?<![\w.])(?:\d{1,3}\.){3}\d{1,3}(?![\w.]|\.\d))'
+    r'|(?P<domain>(?<![\w@.-])(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+(?:[A-Za-z][A-Za-z0-9-]{0,62}|xn--[a-z0-9-]+)(?![\w-]))'
+)
+ENTITY_KINDS = {'domains': '🌐 Domains', 'ipv4': '🔢 IPv4', 'ipv6': '🔢 IPv6', 'emails': '📧 Emails', 'urls': '🔗 URLs'}
+PSL_URL = 'https://publicsuffix.org/list/public_suffix_list.dat'
+PSL_MAX_AGE = 30 * 24 * 3600
+# Used only when the Public Suffix List can't be downloaded
+FALLBACK_PUBLIC_SUFFIXES = (
+    'com net org info biz io co me app dev cloud online site store tech xyz africa '
+    'za co.za org.za net.za web.za ng com.ng org.ng gov.ng ke co.ke or.ke gh com.gh '
+    'ug co.ug tz co.tz rw zm zw co.zw bw mu na com.na eg com.eg ma uk co.uk org.uk '
+    'de fr nl eu us ca au com.au in co.in'
+).split()
+
+@st.cache_resource(ttl=24 * 3600, show_spinner=False)
+def load_public_suffixes():
+    """(rules, wildcards, exceptions, source) from the Public Suffix List, refreshed monthly in the data dir"""
+    path = os.path.join(CONFIG['data_dir'], 'public_suffix_list.dat')
+    text = None
+    try:
+        if time.time() - os.path.getmtime(path) < PSL_MAX_AGE:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+    except OSError:
+        pass
+    if text is None:
+        success, response = safe_request(PSL_URL)
+        if success and response.status_code == 200 and '// ===BEGIN ICANN DOMAINS===' in response.text:
+            text = response.text
+            try:
+                os.makedirs(CONFIG['data_dir'], exist_ok=True)
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+            except OSError:
+                pass
+        elif os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+    if text is None:
+        return set(FALLBACK_PUBLIC_SUFFIXES), set(), set(), 'built-in list'
+    rules, wildcards, exceptions = set(), set(), set()
+    for line in text.splitlines():
+        rule = line.split(None, 1)[0].lower() if line.strip() else ''
+        if not rule or rule.startswith('//'):
+            continue
+        if not rule.isascii():
+            try:
+                rule = rule.encode('idna').decode('ascii')
+            except UnicodeError:
+                continue
+        if rule.startswith('!'):
+            exceptions.add(rule[1:])
+        elif rule.startswith('*.'):
+            wildcards.add(rule[2:])
+        else:
+            rules.add(rule)
+    return rules, wildcards, exceptions, 'Public Suffix List'
+
+def registrable_domain(host, psl):
+    """eTLD+1 of a hostname (e.g. shop.example.co.za -> example.co.za), or None if the suffix is unknown"""
+    rules, wildcards, exceptions, _ = psl
+    labels = host.lower().rstrip('.').split('.')
+    for i in range(len(labels)):
+        candidate = '.'.join(labels[i:])
+        if candidate in exceptions:
+            suffix_len = len(labels) - i - 1
+            break
+        if candidate in rules or '.'.join(labels[i + 1:]) in wildcards:
+            suffix_len = len(labels) - i
+            break
+    else:
+        return None
+    if suffix_len >= len(labels):
+        return None
+    return '.'.join(labels[-suffix_len - 1:])
+
+def _classify_entity(kind, value, psl):
+    """[(kind, normalized value)] a pattern match contributes; empty if it fails validation"""
+    if kind == 'url':
+        value = value.rstrip('.,;:!?)]}\'"')
+        try:
+            host = urllib.parse.urlsplit(value).hostname
+        except ValueError:
+            return []
+        return [('urls', value), *_classify_entity('domain', host, psl)] if host else []
+    if kind == 'email':
+        local, _, host = value.rpartition('@')
+        host = host.lower()
+        return [('emails', f"{local}@{host}"), ('domains', host)] if registrable_domain(host, psl) else []
+    try:
+        ip = ipaddress.ip_address(value.strip('[]'))
+    except ValueError:
+        host = value.lower().rstrip('.')
+        if kind == 'path' and host.rsplit('.', 1)[-1] in CONFIG['entity_file_extensions']:
+            # Only path context marks a file: .md, .py, .sh etc. are real TLDs too
+            return []
+        return [('domains', host)] if kind in ('domain', 'path') and registrable_domain(host, psl) else []
+    return [('ipv4' if ip.version == 4 else 'ipv6', ip.compressed)]
+
+def extract_entities(lines, psl):
+    """Deduplicated {kind: Counter} of domains, IPs, emails and URLs found in an iterable of text lines.
+    
+    Hosts inside URLs and email addresses are counted as domains (or IPs) too;
+    domains must end in a public suffix (and not be a file name in a path) and
+    IPs must parse. Each distinct match is validated once, so repetitive logs
+    cost little more than the scan.
+    """
+    found = {kind: collections.Counter() for kind in ENTITY_KINDS}
+    memo = {}
+    for line in lines:
+        for match in ENTITY_PATTERN.finditer(line):
+            kind = match.lastgroup
+            if kind == 'domain' and match.start() and line[match.start() - 1] in '/\\':
+                kind = 'path'
+            key = (kind, match.group())
+            entities = memo.get(key)
+            if entities is None:
+                entities = memo[key] = _classify_entity(*key, psl)
+            for kind, value in entities:
+                found[kind][value] += 1
+    return found
+
+# Where each kind of extracted entity can be sent: (tool, bulk input key, button label)
+ENTITY_HANDOFFS = {
+    'domains': [("🔎 DNS Analyzer", 'bulk_dns_input', "🔎 Bulk DNS Lookup"),
+                ("🔒 SSL Certificate Checker", 'bulk_ssl_input', "🔒 Bulk SSL Check")],
+    'ipv4': [("🔍 IP Address Lookup", 'bulk_ip_input', "🔍 Bulk IP Lookup")],
+    'ipv6': [("🔍 IP Address Lookup", 'bulk_ip_input', "🔍 Bulk IP Lookup")]
+}
+
+def parse_bulk_items(text):
+    """Unique non-empty entries from a newline/comma/space separated list, capped at bulk_max_items"""
+    items = list(dict.fromkeys(item.strip().lower() for item in re.split(r'[\s,;]+', text) if item.strip()))
+    return items[:CONFIG['bulk_max_items']], len(items) > CONFIG['bulk_max_items']
+
+# --- Large Line Tools
+# File-based counterparts of the Line Tools that never hold the input as a
+# Python list: lines are streamed from the upload, membership is tracked by
+# 64-bit hashes, sorting spills sorted runs to disk and merges them, and the
+# result is written to a temp file that is previewed page by page.
+LINE_OPERATIONS = {
+    'dedupe': '🧹 Remove duplicates (keep order)',
+    'sort': '🔤 Sort A-Z',
+    'count': '🔢 Count occurrences',
+    'distinct': '📊 Count distinct (approximate, constant memory)',
+    'diff': '➖ Lines only in A (A − B)',
+    'intersect': '🔗 Lines in both A and B (A ∩ B)'
+}
+LINE_PAGE_SIZE = 100
+
+def iter_upload_lines(upload, strip=True):
+    """Non-empty lines of an uploaded file, decoded lazily"""
+    upload.seek(0)
+    text = io.TextIOWrapper(upload, encoding='utf-8', errors='replace', newline=None)
+    try:
+        for line in text:
+            line = line.strip() if strip else line.rstrip('\r\n')
+            if line:
+                yield line
+    finally:
+        # Leave the upload open so it can be read again on the next run
+        text.detach()
+
+def line_hash(line):
+    """64-bit hash used for set membership (collisions are negligible below billions of lines)"""
+    return int.from_bytes(hashlib.blake2b(line.encode(), digest_size=8).digest(), 'little')
+
+class HyperLogLog:
+    """Distinct-count estimate in 2^p bytes (about 1.04/sqrt(2^p) relative error)"""
+    
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+    
+    def add(self, h):
+        index = h >> (64 - self.p)
+        rest = (h << self.p) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - self.p + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # small-range correction
+        return int(round(estimate))
+
+@st.cache_resource
+def _line_result_dir():
+    """Per-process directory for result files, removed at exit"""
+    # Leftovers from processes that were killed before their atexit hook ran
+    for name in os.listdir(tempfile.gettempdir()):
+        path = os.path.join(tempfile.gettempdir(), name)
+        try:
+            if name.startswith('supportbuddy_lines_') and time.time() - os.path.getmtime(path) > 86400:
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        except OSError:
+            pass
+    path = tempfile.mkdtemp(prefix='supportbuddy_lines_')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+class LineResultWriter:
+    """Writes result lines to a temp file, remembering the byte offset of every page"""
+    
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(suffix='.txt', dir=_line_result_dir())
+        self.file = os.fdopen(fd, 'wb')
+        self.lines = 0
+        self.position = 0
+        self.offsets = []
+    
+    def write(self, line):
+        if self.lines % LINE_PAGE_SIZE == 0:
+            self.offsets.append(self.position)
+        data = (line + '\n').encode()
+        self.file.write(data)
+        self.position += len(data)
+        self.lines += 1
+    
+    def close(self):
+        self.file.close()
+        return {'path': self.path, 'lines': self.lines, 'offsets': self.offsets, 'bytes': self.position}
+
+def external_sort(lines, key=None, chunk_lines=None):
+    """Sort an arbitrarily long line stream: sorted runs of `chunk_lines` spill to temp files and are merged"""
+    chunk_lines = chunk_lines or CONFIG['line_sort_chunk']
+    runs, chunk = [], []
+    try:
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                chunk.sort(key=key)
+                run = tempfile.TemporaryFile(mode='w+', encoding='utf-8')
+                run.writelines(line + '\n' for line in chunk)
+                run.seek(0)
+                runs.append(run)
+                chunk = []
+        chunk.sort(key=key)
+        if not runs:
+            yield from chunk
+            return
+        streams = [(line.rstrip('\n') for line in run) for run in runs] + [iter(chunk)]
+        yield from heapq.merge(*streams, key=key)
+    finally:
+        for run in runs:
+            run.close()
+
+def run_line_operation(operation, upload_a, upload_b=None, ignore_case=False, unique=True, on_progress=None):
+    """Run a large-input line operation; returns stats plus the result file for operations that produce one"""
+    start = time.perf_counter()
+    key = str.casefold if ignore_case else None
+    normalize = key or (lambda line: line)
+    stats = {'operation': operation, 'input_lines': 0, 'top': []}
+    
+    def counted(lines):
+        for stats['input_lines'], line in enumerate(lines, 1):
+            if on_progress and stats['input_lines'] % 100_000 == 0:
+                on_progress(stats['input_lines'])
+            yield line
+    
+    lines = counted(iter_upload_lines(upload_a))
+    if operation == 'distinct':
+        hll = HyperLogLog()
+        for line in lines:
+            hll.add(line_hash(normalize(line)))
+        stats['distinct'] = hll.count()
+        stats['seconds'] = time.perf_counter() - start
+        return stats
+    
+    writer = LineResultWriter()
+    try:
+        if operation == 'dedupe':
+            seen = set()
+            for line in lines:
+                h = line_hash(normalize(line))
+                if h not in seen:
+                    seen.add(h)
+                    writer.write(line)
+        elif operation in ('sort', 'count'):
+            previous, run = None, 0
+            top = []
+            for line in itertools.chain(external_sort(lines, key=key), [None]):
+                if line is not None and previous is not None and normalize(line) == normalize(previous):
+                    run += 1
+                    if operation == 'sort' and not unique:
+                        writer.write(line)
+                    continue
+                if previous is not None and operation == 'count':
+                    writer.write(f"{run}\t{previous}")
+                    # Bounded heap of the most frequent values
+                    (heapq.heappush if len(top) < 20 else heapq.heappushpop)(top, (run, previous))
+                if line is not None and operation == 'sort':
+                    writer.write(line)
+                previous, run = line, 1
+            stats['top'] = sorted(top, reverse=True)
+        else:
+            members = {line_hash(normalize(line)) for line in iter_upload_lines(upload_b)}
+            stats['b_distinct'] = len(members)
+            keep = operation == 'intersect'
+            written = set()
+            for line in lines:
+                h = line_hash(normalize(line))
+                if (h in members) == keep and h not in written:
+                    written.add(h)
+                    writer.write(line)
+    finally:
+        stats.update(writer.close())
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+def read_line_page(result, page):
+    """Lines of one preview page from a result file"""
+    with open(result['path'], 'rb') as f:
+        f.seek(result['offsets'][page])
+        return [f.readline().decode('utf-8', errors='replace').rstrip('\n') for _ in range(LINE_PAGE_SIZE)][:result['lines'] - page * LINE_PAGE_SIZE]
+
+# --- SPF Evaluation (RFC 7208)
+SPF_TERM_RE = re.compile(r'^([+\-~?]?)([a-z][a-z0-9_.\-]*)([:=/]?)(.*)$', re.IGNORECASE)
+SPF_CIDR_RE = re.compile(r'^(.*?)((?:/\d+)?(?://\d+)?)$')
+SPF_DNS_MECHANISMS = ('include', 'a', 'mx', 'ptr', 'exists')
+SPF_QUALIFIERS = {'+': 'Pass', '-': 'Fail', '~': 'SoftFail', '?': 'Neutral'}
+
+def txt_record_value(record):
+    """Join the quoted character-strings of a TXT record into one value"""
+    parts = re.findall(r'"((?:[^"\\]|\\.)*)"', record)
+    if not parts:
+        return record
+    return ''.join(re.sub(r'\\(.)', r'\1', p) for p in parts)
+
+def _parse_spf_term(term):
+    """Split an SPF term into qualifier, name, value and CIDR suffix"""
+    match = SPF_TERM_RE.match(term)
+    if not match:
+        return None
+    qualifier, name, sep, value = match.groups()
+    name = name.lower()
+    if sep == '=':
+        return {'term': term, 'kind': 'modifier', 'name': name, 'value': value, 'qualifier': '', 'cidr': ''}
+    if sep == '/':
+        value = '/' + value
+    cidr = ''
+    if name in ('a', 'mx'):
+        value, cidr = SPF_CIDR_RE.match(value).groups()
+    return {'term': term, 'kind': 'mechanism', 'name': name, 'value': value, 'qualifier': qualifier or '+', 'cidr': cidr}
+
+def _spf_network(address, cidr):
+    """Apply an a/mx dual CIDR length to a resolved address"""
+    v4, _, v6 = cidr.lstrip('/').partition('//')
+    try:
+        ip = ipaddress.ip_address(address)
+        prefix = (v4 or '32') if ip.version == 4 else (v6 or '128')
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+    except ValueError:
+        return None
+
+def evaluate_spf(domain, max_depth=10):
+    """Expand an SPF policy tree concurrently and count DNS lookups per RFC 7208.
+    
+    Every include/redirect target of one level is fetched in a single concurrent
+    batch, followed by the a/mx/exists lookups of that level. DNS answers are
+    memoized through resolve_dns_cached, but the lookup count still charges every
+    term as the RFC requires.
+    """
+    result = {
+        'domain': domain,
+        'nodes': [],
+        'lookups': 0,
+        'void_lookups': 0,
+        'errors': [],
+        'warnings': [],
+        'all': None
+    }
+    
+    # root_chain marks the root record and its redirect targets, whose own
+    # non-pass terms and "all" decide the final result
+    root = {'domain': domain, 'path': (), 'depth': 0, 'via': '', 'root_chain': True}
+    level = [root]
+    
+    while level:
+        txt = resolve_dns_many([(node['domain'], 'TXT') for node in level])
+        next_level = []
+        address_jobs = []   # (node_row, term, query)
+        mx_jobs = []        # (node_row, term, query)
+        
+        for node in level:
+            records, error = txt[(node['domain'], 'TXT')]
+            spf_records = [
+                v for v in (txt_record_value(r) for r in records)
+                if v.lower() == 'v=spf1' or v.lower().startswith('v=spf1 ')
+            ]
+            row = {**node, 'record': spf_records[0] if spf_records else '', 'terms': []}
+            result['nodes'].append(row)
+            
+            if error:
+                result['errors'].append(f"{node['domain']}: {error} (temperror)")
+                continue
+            if not records:
+                result['void_lookups'] += 1 if node['depth'] else 0
+            if not spf_records:
+                result['errors'].append(f"{node['domain']}: no SPF record" + (" (permerror)" if node['depth'] else ""))
+                continue
+            if len(spf_records) > 1:
+                result['errors'].append(f"{node['domain']}: {len(spf_records)} SPF records published (permerror)")
+            
+            terms = [_parse_spf_term(t) for t in spf_records[0].split()[1:]]
+            has_all = any(t and t['name'] == 'all' for t in terms)
+            
+            for term in terms:
+                if term is None:
+                    result['errors'].append(f"{node['domain']}: invalid term in record (permerror)")
+                    continue
+                term['resolved'] = []
+                row['terms'].append(term)
+                name, value = term['name'], term['value']
+                target = value or node['domain']
+                
+                if term['kind'] == 'modifier':
+                    if name != 'redirect' or has_all:
+                        continue
+                    result['lookups'] += 1
+                    term['lookups'] = 1
+                elif name in SPF_DNS_MECHANISMS:
+                    result['lookups'] += 1
+                    term['lookups'] = 1
+                else:
+                    term['lookups'] = 0
+                
+                if '%{' in target:
+                    # Macros depend on the sender and cannot be expanded here
+                    continue
+                
+                if name in ('include', 'redirect'):
+                    if target.lower() in node['path'] + (node['domain'],):
+                        result['errors'].append(f"{node['domain']}: loop detected via {term['term']} (permerror)")
+                    elif node['depth'] + 1 > max_depth:
+                        result['errors'].append(f"{node['domain']}: nesting deeper than {max_depth} levels, stopped")
+                    else:
+                        next_level.append({
+                            'domain': target.lower(),
+                            'path': node['path'] + (node['domain'],),
+                            'depth': node['depth'] + 1,
+                            'via': term['term'],
+                            'root_chain': node['root_chain'] and name == 'redirect'
+                        })
+                elif name == 'all':
+                    if node['root_chain'] and result['all'] is None:
+                        result['all'] = term['qualifier']
+                elif name in ('ip4', 'ip6'):
+                    try:
+                        ipaddress.ip_network(value, strict=False)
+                    except ValueError:
+                        result['errors'].append(f"{node['domain']}: invalid {name} value {value} (permerror)")
+                elif name == 'a':
+                    for rtype in ('A', 'AAAA'):
+                        address_jobs.append((term, (target, rtype)))
+                elif name == 'mx':
+                    mx_jobs.append((term, (target, 'MX')))
+                elif name == 'ptr':
+                    result['warnings'].append(f"{node['domain']}: 'ptr' is deprecated and slow (RFC 7208 §5.5)")
+        
+        # a/mx/exists lookups of this level run as one concurrent batch
+        answers = resolve_dns_many([q for _, q in address_jobs] + [q for _, q in mx_jobs])
+        mx_address_jobs = []
+        for term, query in mx_jobs:
+            records, error = answers[query]
+            if not records and not error:
+                result['void_lookups'] += 1
+            hosts = [r.split()[-1].rstrip('.') for r in records]
+            if len(hosts) > 10:
+                result['errors'].append(f"{query[0]}: more than 10 MX hosts for 'mx' (permerror)")
+            for host in hosts[:10]:
+                for rtype in ('A', 'AAAA'):
+                    mx_address_jobs.append((term, (host, rtype)))
+        
+        answers.update(resolve_dns_many([q for _, q in mx_address_jobs]))
+        for term, query in address_jobs + mx_address_jobs:
+            records, _ = answers[query]
+            for address in records:
+                network = _spf_network(address, term['cidr'])
+                if network:
+                    term['resolved'].append(network)
+        # An 'a' term is void only when neither its A nor AAAA query answered
+        answered = {}
+        for term, query in address_jobs:
+            answered[id(term)] = answered.get(id(term), False) or bool(answers[query][0])
+        result['void_lookups'] += sum(1 for ok in answered.values() if not ok)
+        
+        level = next_level
+    
+    if result['lookups'] > CONFIG['spf_lookup_limit']:
+        result['errors'].append(
+            f"{result['lookups']} DNS lookups exceeds the limit of {CONFIG['spf_lookup_limit']} (permerror)"
+        )
+    if result['void_lookups'] > CONFIG['spf_void_limit']:
+        result['errors'].append(
+            f"{result['void_lookups']} void lookups exceeds the limit of {CONFIG['spf_void_limit']} (permerror)"
+        )
+    return result
+
+def _spf_ip_term(network, qualifier=''):
+    qualifier = '' if qualifier == '+' else qualifier
+    return f"{qualifier}ip{network.version}:{network.network_address if network.prefixlen == network.max_prefixlen else network}"
+
+def _spf_flat_terms(result):
+    """The policy's terms in evaluation order: pass networks, or verbatim terms that must stay put.
+    
+    Includes and redirects are expanded in place. Only the root record and its
+    redirect targets contribute non-pass terms, since inside an include they
+    just make that include not match. A -/~/? include in the root chain
+    becomes its networks with that qualifier, or stays verbatim if it holds
+    terms that can't be expanded.
+    """
+    children = {}
+    for row in result['nodes']:
+        if row['path']:
+            children.setdefault((row['path'], row['domain']), row)
+    
+    def expand(row, items):
+        path = row['path'] + (row['domain'],)
+        for term in row['terms']:
+            name, qualifier = term['name'], term['qualifier']
+            target = (term['value'] or row['domain']).lower()
+            if '%{' in target or name in ('exists', 'ptr'):
+                items.append(term['term'])
+            elif name in ('include', 'redirect'):
+                child = children.get((path, target))
+                if not child:
+                    continue
+                if name == 'redirect' or qualifier == '+':
+                    expand(child, items)
+                elif row['root_chain']:
+                    included = expand(child, [])
+                    if all(isinstance(n, (ipaddress.IPv4Network, ipaddress.IPv6Network)) for n in included):
+                        items.extend(_spf_ip_term(n, qualifier) for n in included)
+                    else:
+                        items.append(term['term'])
+            elif name in ('ip4', 'ip6', 'a', 'mx'):
+                try:
+                    networks = [ipaddress.ip_network(n, strict=False) for n in ([term['value']] if name in ('ip4', 'ip6') else term['resolved'])]
+                except ValueError:
+                    continue
+                if qualifier == '+':
+                    items.extend(networks)
+                elif row['root_chain']:
+                    items.extend(_spf_ip_term(n, qualifier) for n in networks)
+        return items
+    
+    root = next((row for row in result['nodes'] if not row['path']), None)
+    return expand(root, []) if root else []
+
+def flatten_spf(result, max_length=450):
+    """Build a flattened SPF record (split into include chunks if too long for one TXT).
+    
+    The original term order is kept: each run of consecutive pass networks is
+    collapsed, while non-pass and unexpandable terms stay where they were.
+    """
+    segments = []  # (is_network_run, terms)
+    run = []
+    for item in _spf_flat_terms(result) + [None]:
+        if isinstance(item, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            run.append(item)
+            continue
+        if run:
+            segments.append((True, [
+                _spf_ip_term(n) for version in (4, 6)
+                for n in ipaddress.collapse_addresses(x for x in run if x.version == version)
+            ]))
+            run = []
+        if item is not None:
+            segments.append((False, [item]))
+    
+    # A repeated term can never match first, so only its first occurrence is kept
+    seen = set()
+    for is_run, terms in segments:
+        terms[:] = [t for t in dict.fromkeys(terms) if t not in seen]
+        seen.update(terms)
+    all_term = [f"{result['all']}all"] if result['all'] else []
+    
+    single = ' '.join(['v=spf1'] + [t for _, terms in segments for t in terms] + all_term)
+    if len(single) <= max_length:
+        return {'_root': single}
+    
+    # Too long for one record: move each run of pass networks into _spfN
+    # sub-records, included at the same position so the order still holds
+    records, root_terms = {}, []
+    for is_run, terms in segments:
+        if not is_run:
+            root_terms.extend(terms)
+            continue
+        current = []
+        for term in terms + [None]:
+            if current and (term is None or len(' '.join(['v=spf1'] + current + [term])) > max_length):
+                name = f"_spf{len(records) + 1}.{result['domain']}"
+                records[name] = ' '.join(['v=spf1'] + current)
+                root_terms.append(f"include:{name}")
+                current = []
+            if term is not None:
+                current.append(term)
+    records['_root'] = ' '.join(['v=spf1'] + root_terms + all_term)
+    return records
+
+# --- DKIM Selector Discovery
+# Known selectors by provider; generic numbered variants are added below
+DKIM_PROVIDER_SELECTORS = {
+    'cPanel / DirectAdmin / Generic': [
+        'default', 'dkim', 'mail', 'email', 'x', 'selector', 'domainkey', 'key', 'smtp',
+        'mx', 'dk', 'primary', 'main', 'private', 'public', 'server', 'host', 'web',
+        'newsletter', 'news', 'marketing', 'bulk', 'mta', 'mta1', 'mta2', 'relay', 'out',
+        'outbound', 'postfix', 'exim', 'opendkim', 'rspamd', 'mailserver', 'dkimkey', 'test'
+    ],
+    'Google Workspace': ['google', 'google2048', 'googleapps', '20161025', '20210112', '20221208', '20230601'],
+    'Microsoft 365': ['selector1', 'selector2', 'selector1-azurecomm-prod-net'],
+    'Zoho Mail': ['zoho', 'zmail', 'zohomail', 'zm1', 'zm2', 'zcampaign', 'zcsend'],
+    'Mailchimp / Mandrill': ['k1', 'k2', 'k3', 'mandrill', 'mte1', 'mte2', 'mcdkim', 'mcsv'],
+    'SendGrid': ['s1', 's2', 'smtpapi', 'sendgrid', 'sg', 'em', 'm1'],
+    'Amazon SES': ['amazonses', 'ses', 'aws', 'awsdkim'],
+    'Mailgun': ['mailo', 'krs', 'pic', 'mg', 'mailgun', 'email', 'k1'],
+    'Postmark': ['pm', 'pm1', 'pm2', 'postmark', '20210406pm'],
+    'SparkPost': ['scph0120', 'scph1020', 'scph0316', 'scph0518', 'sparkpost', 'spk'],
+    'Mailjet': ['mailjet', 'mj', 'mj1'],
+    'Brevo (Sendinblue)': ['sib', 'mail', 'brevo1', 'brevo2', 'sendinblue'],
+    'Zendesk': ['zendesk1', 'zendesk2', 'zendesk'],
+    'Salesforce': ['sf1', 'sf2', 'salesforce', 'sfdc', 'et', 'et1', 'et2', '200608'],
+    'HubSpot': ['hs1', 'hs2', 'hubspot', 'hs1-hubspot', 'hs2-hubspot'],
+    'Constant Contact': ['ctct1', 'ctct2', 'constantcontact'],
+    'Campaign Monitor': ['cm', 'cs', 'createsend', 'createsend1', 'createsend2'],
+    'Klaviyo': ['kl', 'kl2', 'klaviyo', 'klaviyo2'],
+    'ActiveCampaign': ['dk', 'acdkim1', 'activecampaign'],
+    'Freshdesk / Freshworks': ['fd', 'fd2', 'freshdesk', 'freshworks', 'fw1', 'fw2'],
+    'Intercom': ['intercom', 'ic', 'intercom1'],
+    'Yahoo / AOL': ['s1024', 's2048', 'yahoo', 'aol', 'a1', 'a2'],
+    'Fastmail': ['fm1', 'fm2', 'fm3', 'mesmtp'],
+    'Proton Mail': ['protonmail', 'protonmail2', 'protonmail3'],
+    'iCloud': ['sig1', 'sig2'],
+    'Mimecast': ['mimecast', 'mimecast20190104', 'mimecast20200101', 'mimecast20210101'],
+    'Titan / GoDaddy': ['titan1', 'titan2', 'godaddy', 'gd', 'secureserver'],
+    'Hostinger': ['hostingermail1', 'hostingermail2', 'hostingermail3', 'hostinger'],
+    'Rackspace': ['rsdkim', 'rackspace', 'emailsrvr'],
+    'Yandex / Mail.ru': ['yandex', 'mailru', 'mail'],
+    'Elastic Email': ['api', 'elasticemail'],
+    'SMTP2GO': ['smtp2go', 's768', 's1', 'em1'],
+    'Mailerlite': ['ml', 'ml2', 'litesrv', 'mailerlite'],
+    'GetResponse': ['getresponse', 'gr', 'gr1', 'gr2'],
+    'Everlytic': ['everlytic', 'ev1', 'ev2'],
+    'Moosend / Omnisend': ['moosend', 'omnisend', 'os1'],
+    'Shopify': ['shopify', 'shopify2', 'shopify3'],
+    'Atlassian': ['atlassian', 's1-atlassian', 's2-atlassian'],
+    'Squarespace / Wix': ['squarespace', 'wix', 'wixmail'],
+    'Mailchannels': ['mailchannels', 'mcdkim', 'mc'],
+    'Barracuda / Proofpoint': ['barracuda', 'proofpoint', 'pps', 'ppemail'],
+    'Zimbra / Kerio': ['zimbra', 'kerio', 'kerio1'],
+    'Office / Exchange on-prem': ['exchange', 'exch', 'owa', 'ex1', 'ex2'],
+    'Odoo / Helpdesks': ['odoo', 'helpscout', 'hsdkim', 'groove', 'gorgias', 'front', 'frontapp']
+}
+
+def _build_dkim_selector_index():
+    """Flatten the provider dictionary plus common numbered/dated variants"""
+    index = {}
+    for provider, selectors in DKIM_PROVIDER_SELECTORS.items():
+        for selector in selectors:
+            index.setdefault(selector, provider)
+    for base in ('s', 'k', 'key', 'dkim', 'sel', 'selector', 'mail', 'm', 'default', 'sig', 'dk', 'smtp', 'email'):
+        for n in range(1, 6):
+            index.setdefault(f"{base}{n}", 'Generic')
+    for year in range(2015, datetime.now().year + 2):
+        for fmt in ('{y}', 'dkim{y}', 's{y}', 'key{y}', 'mail{y}'):
+            index.setdefault(fmt.format(y=year), 'Generic (dated)')
+    return index
+
+DKIM_SELECTORS = _build_dkim_selector_index()
+
+def _der_read(data, pos):
+    """Read one DER TLV; returns (tag, value_start, value_end)"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        count = length & 0x7F
+        length = int.from_bytes(data[pos:pos + count], 'big')
+        pos += count
+    return tag, pos, pos + length
+
+def _der_first_integer(data, pos=0, end=None):
+    """Find the first INTEGER inside nested SEQUENCE/BIT STRING structures"""
+    end = len(data) if end is None else end
+    while pos < end:
+        tag, start, stop = _der_read(data, pos)
+        if tag == 0x02:
+            return data[start:stop]
+        if tag == 0x30:
+            found = _der_first_integer(data, start, stop)
+            if found is not None:
+                return found
+        elif tag == 0x03:
+            # BIT STRING: skip the unused-bits byte and descend
+            found = _der_first_integer(data, start + 1, stop)
+            if found is not None:
+                return found
+        pos = stop
+    return None
+
+def parse_dkim_record(record):
+    """Parse DKIM tags and determine the public key type and size"""
+    value = txt_record_value(record)
+    tags = {}
+    for part in value.split(';'):
+        if '=' in part:
+            k, v = part.split('=', 1)
+            tags[k.strip().lower()] = ''.join(v.split())
+    
+    key_type = tags.get('k', 'rsa').lower()
+    info = {
+        'tags': tags,
+        'key_type': key_type,
+        'key_bits': None,
+        'testing': 'y' in tags.get('t', '').split(':'),
+        'revoked': 'p' in tags and not tags['p'],
+        'error': ''
+    }
+    
+    if info['revoked'] or 'p' not in tags:
+        if 'p' not in tags:
+            info['error'] = "No public key (p=) tag"
+        return info
+    
+    try:
+        key = base64.b64decode(tags['p'] + '=' * (-len(tags['p']) % 4))
+        if key_type == 'ed25519':
+            info['key_bits'] = len(key) * 8
+        else:
+            modulus = _der_first_integer(key)
+            if modulus is None:
+                raise ValueError("no modulus found")
+            modulus = modulus.lstrip(b'\x00')
+            info['key_bits'] = (len(modulus) - 1) * 8 + modulus[0].bit_length()
+    except (ValueError, IndexError, TypeError) as e:
+        info['error'] = f"Could not decode key: {e}"
+    return info
+
+def dkim_probe_selectors(extra_selectors=()):
+    """{selector: provider} actually queried: the known selectors plus new custom ones"""
+    selectors = dict(DKIM_SELECTORS)
+    for selector in extra_selectors:
+        # DNS names are case-insensitive, so "Default" is the known "default"
+        selectors.setdefault(selector.lower(), 'Custom')
+    return selectors
+
+def discover_dkim_selectors(domain, extra_selectors=()):
+    """Probe every known selector concurrently; returns found selectors with parsed keys"""
+    selectors = dkim_probe_selectors(extra_selectors)
+    
+    queries = [(f"{s}._domainkey.{domain}", 'TXT') for s in selectors]
+    answers = resolve_dns_many(queries, max_workers=CONFIG['dkim_workers'])
+    
+    found = []
+    for selector, provider in selectors.items():
+        records, _ = answers[(f"{selector}._domainkey.{domain}", 'TXT')]
+        for record in records:
+            value = txt_record_value(record)
+            if 'v=DKIM1' in value or 'p=' in value:
+                found.append({'selector': selector, 'provider': provider, 'record': value, **parse_dkim_record(record)})
+    return found
+
+# --- DMARC Aggregate Reports
+def _xml_tag(elem):
+    """Local tag name without any XML namespace"""
+    return elem.tag.rsplit('}', 1)[-1]
+
+def iter_dmarc_report_streams(uploaded_file):
+    """Yield (name, file object) for each XML report in an upload (.xml, .gz or .zip)"""
+    name = uploaded_file.name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(uploaded_file) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                with archive.open(member) as fh:
+                    if member.filename.lower().endswith('.gz'):
+                        yield member.filename, gzip.GzipFile(fileobj=fh)
+                    else:
+                        yield member.filename, fh
+    elif name.endswith('.gz'):
+        yield uploaded_file.name, gzip.GzipFile(fileobj=uploaded_file)
+    else:
+        yield uploaded_file.name, uploaded_file
+
+def iter_dmarc_records(fh, meta=None):
+    """Stream <record> rows out of one aggregate report without building the DOM.
+    
+    `meta` (org, report_id, policy_domain, policy) is filled in place from
+    <report_metadata> and <policy_published>, so it is available even for a
+    report without records.
+    """
+    meta = {} if meta is None else meta
+    meta.update(org='', report_id='', policy_domain='', policy='')
+    context = ET.iterparse(fh, events=('start', 'end'))
+    _, root = next(context)
+    
+    for event, elem in context:
+        if event != 'end':
+            continue
+        tag = _xml_tag(elem)
+        
+        if tag == 'report_metadata':
+            for child in elem:
+                if _xml_tag(child) == 'org_name':
+                    meta['org'] = (child.text or '').strip()
+                elif _xml_tag(child) == 'report_id':
+                    meta['report_id'] = (child.text or '').strip()
+            root.clear()
+        elif tag == 'policy_published':
+            for child in elem:
+                if _xml_tag(child) == 'domain':
+                    meta['policy_domain'] = (child.text or '').strip().lower()
+                elif _xml_tag(child) == 'p':
+                    meta['policy'] = (child.text or '').strip()
+            root.clear()
+        elif tag == 'record':
+            row = {
+                'source_ip': '', 'count': 0, 'disposition': '', 'dkim': '', 'spf': '',
+                'header_from': '', 'dkim_domain': '', 'dkim_result': '', 'spf_domain': '', 'spf_result': ''
+            }
+            for node in elem.iter():
+                name = _xml_tag(node)
+                text = (node.text or '').strip()
+                if name == 'source_ip':
+                    row['source_ip'] = text
+                elif name == 'count':
+                    row['count'] = int(text or 0)
+                elif name in ('disposition', 'header_from') and not row[name]:
+                    row[name] = text.lower()
+                elif name in ('dkim', 'spf') and not list(node):
+                    # policy_evaluated results (leaf elements)
+                    row[name] = text.lower()
+                elif name in ('dkim', 'spf'):
+                    # auth_results: keep the first domain/result pair
+                    for child in node:
+                        field = f"{name}_{_xml_tag(child)}"
+                        if field in row and not row[field]:
+                            row[field] = (child.text or '').strip().lower()
+            yield {**meta, **row}
+            # Drop the finished record so memory stays flat for large reports
+            root.clear()
+
+def aggregate_dmarc_reports(uploaded_files, progress=None):
+    """Aggregate DMARC pass/fail per source IP and header-from domain across many reports"""
+    totals = {}
+    seen_reports = set()
+    stats = {'reports': 0, 'duplicates': 0, 'records': 0, 'empty': [], 'errors': []}
+    
+    for i, uploaded_file in enumerate(uploaded_files, 1):
+        try:
+            for name, fh in iter_dmarc_report_streams(uploaded_file):
+                try:
+                    meta = {}
+                    records = iter_dmarc_records(fh, meta)
+                    # <report_metadata> precedes the records, so the key is known after the first one
+                    first = next(records, None)
+                    report_key = (meta['org'], meta['report_id'])
+                    if meta['report_id'] and report_key in seen_reports:
+                        stats['duplicates'] += 1
+                        continue
+                    seen_reports.add(report_key)
+                    stats['reports'] += 1
+                    if first is None:
+                        stats['empty'].append(name)
+                        continue
+                    
+                    for record in itertools.chain([first], records):
+                        stats['records'] += 1
+                        key = (record['source_ip'], record['header_from'] or record['policy_domain'])
+                        entry = totals.get(key)
+                        if entry is None:
+                            entry = totals[key] = {
+                                'messages': 0, 'dkim_pass': 0, 'spf_pass': 0, 'dmarc_pass': 0,
+                                'rejected': 0, 'quarantined': 0, 'orgs': set(),
+                                'dkim_domain': record['dkim_domain'], 'spf_domain': record['spf_domain']
+                            }
+                        count = record['count']
+                        entry['messages'] += count
+                        entry['dkim_pass'] += count if record['dkim'] == 'pass' else 0
+                        entry['spf_pass'] += count if record['spf'] == 'pass' else 0
+                        entry['dmarc_pass'] += count if 'pass' in (record['dkim'], record['spf']) else 0
+                        entry['rejected'] += count if record['disposition'] == 'reject' else 0
+                        entry['quarantined'] += count if record['disposition'] == 'quarantine' else 0
+                        entry['orgs'].add(record['org'])
+                except (ET.ParseError, OSError, EOFError, ValueError) as e:
+                    stats['errors'].append(f"{name}: {e}")
+        except (zipfile.BadZipFile, OSError) as e:
+            stats['errors'].append(f"{uploaded_file.name}: {e}")
+        if progress:
+            progress(i / len(uploaded_files))
+    
+    rows = [
+        {
+            'Source IP': ip,
+            'Header From': header_from,
+            'Messages': e['messages'],
+            'DMARC Pass': e['dmarc_pass'],
+            'DKIM Pass': e['dkim_pass'],
+            'SPF Pass': e['spf_pass'],
+            'Rejected': e['rejected'],
+            'Quarantined': e['quarantined'],
+            'DKIM Domain': e['dkim_domain'],
+            'SPF Domain': e['spf_domain'],
+            'Reporters': ', '.join(sorted(o for o in e['orgs'] if o))
+        }
+        for (ip, header_from), e in totals.items()
+    ]
+    df = pd.DataFrame(rows, columns=[
+        'Source IP', 'Header From', 'Messages', 'DMARC Pass', 'DKIM Pass', 'SPF Pass',
+        'Rejected', 'Quarantined', 'DKIM Domain', 'SPF Domain', 'Reporters'
+    ])
+    if not df.empty:
+        df['Fail'] = df['Messages'] - df['DMARC Pass']
+        df['Pass %'] = (df['DMARC Pass'] / df['Messages'].where(df['Messages'] > 0) * 100).round(1)
+    return df, stats
+
+def reverse_dns_many(ips):
+    """PTR-resolve many IPs concurrently; returns {ip: hostname}"""
+    if not DNS_AVAILABLE:
+        return {}
+    names = {}
+    for ip in ips:
+        try:
+            names[ip] = dns.reversename.from_address(ip).to_text()
+        except (dns.exception.SyntaxError, ValueError):
+            continue
+    answers = resolve_dns_many([(name, 'PTR') for name in names.values()])
+    return {
+        ip: answers[(name, 'PTR')][0][0].rstrip('.') if answers[(name, 'PTR')][0] else ''
+        for ip, name in names.items()
+    }
+
+# --- Mail Port Matrix
+# (port, service, protocol, mode the port is normally used with)
+MAIL_PORTS = [
+    (25, 'SMTP', 'smtp', 'STARTTLS'),
+    (465, 'SMTPS', 'smtp', 'Implicit TLS'),
+    (587, 'Submission', 'smtp', 'STARTTLS'),
+    (110, 'POP3', 'pop3', 'STARTTLS'),
+    (995, 'POP3S', 'pop3', 'Implicit TLS'),
+    (143, 'IMAP', 'imap', 'STARTTLS'),
+    (993, 'IMAPS', 'imap', 'Implicit TLS')
+]
+
+def _remaining(deadline):
+    """Seconds left before the deadline (never below a small floor)"""
+    return max(0.2, deadline - time.monotonic())
+
+def _read_mail_reply(sock, protocol, deadline, tag=None):
+    """Read one complete server reply for the given mail protocol"""
+    if protocol == 'smtp':
+        complete = re.compile(rb'(?:^|\n)\d{3} [^\n]*\n$')
+    elif tag:
+        complete = re.compile(rb'(?:^|\n)' + tag + rb' [^\n]*\n$')
+    else:
+        complete = re.compile(rb'\n$')
+    
+    data = b''
+    while not complete.search(data) and len(data) < 16384:
+        sock.settimeout(_remaining(deadline))
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode(errors='replace').strip()
+
+def _starttls_upgrade(sock, protocol, deadline):
+    """Speak the plaintext protocol up to the point where TLS can start"""
+    banner = _read_mail_reply(sock, protocol, deadline)
+    
+    if protocol == 'smtp':
+        if not banner.startswith('220'):
+            return False, banner or "No SMTP greeting"
+        sock.sendall(b'EHLO supportbuddy.local\r\n')
+        ehlo = _read_mail_reply(sock, protocol, deadline)
+        if 'STARTTLS' not in ehlo.upper():
+            return False, "STARTTLS not offered"
+        sock.sendall(b'STARTTLS\r\n')
+        reply = _read_mail_reply(sock, protocol, deadline)
+        return reply.startswith('220'), banner if reply.startswith('220') else reply
+    
+    if protocol == 'imap':
+        if not banner.startswith('* OK'):
+            return False, banner or "No IMAP greeting"
+        sock.sendall(b'a1 STARTTLS\r\n')
+        reply = _read_mail_reply(sock, protocol, deadline, tag=b'a1')
+        ok = reply.splitlines()[-1].startswith('a1 OK') if reply else False
+        return ok, banner if ok else reply or "STARTTLS refused"
+    
+    # pop3
+    if not banner.startswith('+OK'):
+        return False, banner or "No POP3 greeting"
+    sock.sendall(b'STLS\r\n')
+    reply = _read_mail_reply(sock, protocol, deadline)
+    return reply.startswith('+OK'), banner if reply.startswith('+OK') else reply or "STLS refused"
+
+def probe_mail_port(host, port, service, protocol, mode, deadline):
+    """Probe one mail port in one TLS mode and report timings and certificate status"""
+    row = {
+        'Port': port,
+        'Service': service,
+        'Mode': mode,
+        'Reachable': '❌',
+        'Connect (ms)': None,
+        'Handshake (ms)': None,
+        'TLS': '—',
+        'Cert Name Match': '—',
+        'Detail': ''
+    }
+    
+    sock = None
+    try:
+        start = time.perf_counter()
+        sock = socket.create_connection((host, port), timeout=_remaining(deadline))
+        row['Connect (ms)'] = round((time.perf_counter() - start) * 1000)
+        row['Reachable'] = '✅'
+        
+        if mode == 'STARTTLS':
+            ok, detail = _starttls_upgrade(sock, protocol, deadline)
+            row['Detail'] = detail[:120]
+            if not ok:
+                return row
+        
+        context = ssl.create_default_context()
+        sock.settimeout(_remaining(deadline))
+        start = time.perf_counter()
+        try:
+            tls_sock = context.wrap_socket(sock, server_hostname=host)
+            sock = tls_sock
+            row['Handshake (ms)'] = round((time.perf_counter() - start) * 1000)
+            row['TLS'] = tls_sock.version()
+            row['Cert Name Match'] = '✅'
+            if mode == 'Implicit TLS':
+                row['Detail'] = _read_mail_reply(tls_sock, protocol, deadline)[:120]
+        except ssl.SSLCertVerificationError as e:
+            # The handshake got as far as the certificate, so TLS itself works
+            row['Handshake (ms)'] = round((time.perf_counter() - start) * 1000)
+            row['TLS'] = '⚠️ Untrusted'
+            # 62 = X509_V_ERR_HOSTNAME_MISMATCH
+            row['Cert Name Match'] = '❌' if e.verify_code == 62 else '⚠️'
+            row['Detail'] = e.verify_message or str(e)
+    except ssl.SSLError as e:
+        row['TLS'] = '❌'
+        row['Detail'] = f"TLS error: {e.reason or e}"
+    except socket.timeout:
+        row['Detail'] = "Timed out"
+    except socket.gaierror:
+        row['Detail'] = "Could not resolve host"
+    except ConnectionRefusedError:
+        row['Detail'] = "Connection refused"
+    except Exception as e:
+        row['Detail'] = str(e)
+    finally:
+        if sock:
+            try:
+                sock.close()
+            except Exception:
+                pass
+    
+    return row
+
+def run_mail_port_matrix(host, timeout=None):
+    """Probe every mail port in both TLS modes concurrently within one overall timeout"""
+    timeout = timeout or CONFIG['mail_probe_timeout']
+    deadline = time.monotonic() + timeout
+    jobs = [
+        (port, service, protocol, mode)
+        for port, service, protocol, _ in MAIL_PORTS
+        for mode in ('STARTTLS', 'Implicit TLS')
+    ]
+    
+    executor = ThreadPoolExecutor(max_workers=len(jobs))
+    futures = {
+        executor.submit(probe_mail_port, host, port, service, protocol, mode, deadline): (port, service, mode)
+        for port, service, protocol, mode in jobs
+    }
+    wait(futures, timeout=timeout + 1)
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    rows = []
+    for future, (port, service, mode) in futures.items():
+        if future.done() and not future.cancelled():
+            rows.append(future.result())
+        else:
+            rows.append({
+                'Port': port, 'Service': service, 'Mode': mode, 'Reachable': '❌',
+                'Connect (ms)': None, 'Handshake (ms)': None, 'TLS': '—',
+                'Cert Name Match': '—', 'Detail': "Timed out"
+            })
+    return rows
+
+def summarize_mail_matrix_cell(row):
+    """Render a single matrix cell for the port/mode grid"""
+    if row['Reachable'] != '✅':
+        return f"❌ {row['Detail']}" if row['Detail'] else "❌"
+    if row['Handshake (ms)'] is None:
+        return f"🔌 open · {row['Detail'][:40]}" if row['Detail'] else "🔌 open, no TLS"
+    return f"{row['Cert Name Match']} {row['TLS']} · {row['Handshake (ms)']} ms"
+
+# --- Domain Health Report
+def run_check_graph(checks, on_done=None, max_workers=None):
+    """Run a dependency graph of checks, each node as soon as its dependencies finish.
+    
+    `checks` maps name -> (fn, deps); fn receives {dep_name: dep_result}.
+    Independent nodes run concurrently. `on_done(name, result)` is called from
+    the calling thread as each node completes, so it may update Streamlit
+    elements. A node that raises yields a 'fail' result instead of stopping
+    the graph.
+    """
+    results = {}
+    remaining = dict(checks)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or CONFIG['max_workers']) as executor:
+        while remaining or running:
+            for name, (fn, deps) in list(remaining.items()):
+                if all(dep in results for dep in deps):
+                    del remaining[name]
+                    running[executor.submit(_timed_check, fn, {dep: results[dep] for dep in deps})] = name
+            if not running:
+                raise ValueError(f"Unresolvable check dependencies: {', '.join(remaining)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                if on_done:
+                    on_done(name, results[name])
+    return results
+
+def _timed_check(fn, deps):
+    start = time.perf_counter()
+    try:
+        result = fn(deps)
+    except Exception as e:
+        result = {'status': 'fail', 'summary': f"Check failed: {str(e)}"}
+    result['ms'] = round((time.perf_counter() - start) * 1000)
+    return result
+
+def _skipped(reason):
+    return {'status': 'skip', 'summary': reason}
+
+def check_ssl_certificate(domain):
+    """Fetch and verify a domain's certificate on port 443.
+    
+    Returns (True, {'issuer', 'subject', 'expires', 'days', 'version'}) or (False, reason).
+    """
+    context = ssl.create_default_context()
+    try:
+        with socket.create_connection((domain, 443), timeout=CONFIG['request_timeout']) as sock:
+            with context.wrap_socket(sock, server_hostname=domain) as ssock:
+                cert = ssock.getpeercert()
+                version = ssock.version()
+    except ssl.SSLCertVerificationError as e:
+        return False, f"Invalid certificate: {e.verify_message}"
+    except (OSError, ssl.SSLError) as e:
+        return False, f"No HTTPS on port 443: {str(e)}"
+    expires = datetime.fromtimestamp(ssl.cert_time_to_seconds(cert['notAfter']), tz=timezone.utc)
+    return True, {
+        'issuer': dict(x[0] for x in cert['issuer']).get('organizationName', 'Unknown issuer'),
+        'subject': dict(x[0] for x in cert['subject']).get('commonName', domain),
+        'expires': expires,
+        'days': (expires - datetime.now(timezone.utc)).days,
+        'version': version
+    }
+
+def build_domain_health_checks(domain):
+    """Declare the health report checks for a domain as a dependency graph.
+    
+    NS gates everything; addresses gate SSL and HTTP, MX gates the SMTP probe.
+    All DNS goes through resolve_dns_cached, so SPF/DMARC/MX lookups shared
+    between nodes are only queried once.
+    """
+    def check_ns(deps):
+        records, error = resolve_dns_cached(domain, 'NS')
+        if error:
+            return {'status': 'fail', 'summary': error}
+        if not records:
+            # Subdomains have no NS of their own; fall back to whether the name exists at all
+            if resolve_dns_cached(domain, 'SOA')[0] or resolve_dns_cached(domain, 'A')[0]:
+                return {'status': 'ok', 'summary': "Delegated by the parent zone", 'records': []}
+            return {'status': 'fail', 'summary': "Domain does not resolve (no NS records)"}
+        servers = sorted(r.rstrip('.') for r in records)
+        status = 'ok' if len(servers) >= 2 else 'warn'
+        return {'status': status, 'summary': f"{len(servers)} nameserver(s): {', '.join(servers[:3])}", 'records': servers}
+    
+    def check_addresses(deps):
+        if deps['ns']['status'] == 'fail':
+            return _skipped("Skipped - no nameservers")
+        answers = resolve_dns_many([(domain, 'A'), (domain, 'AAAA'), (f"www.{domain}", 'A')])
+        ipv4, error = answers[(domain, 'A')]
+        ipv6, _ = answers[(domain, 'AAAA')]
+        www, _ = answers[(f"www.{domain}", 'A')]
+        if not ipv4 and not ipv6:
+            return {'status': 'fail', 'summary': error or "No A/AAAA records", 'ipv4': [], 'ipv6': []}
+        summary = f"A: {', '.join(ipv4) or 'none'}" + (f" · AAAA: {len(ipv6)}" if ipv6 else "")
+        status = 'ok' if www else 'warn'
+        if not www:
+            summary += " · www has no A record"
+        return {'status': status, 'summary': summary, 'ipv4': ipv4, 'ipv6': ipv6}
+    
+    def check_ssl(deps):
+        if deps['addresses']['status'] in ('fail', 'skip'):
+            return _skipped("Skipped - domain has no address")
+        success, cert = check_ssl_certificate(domain)
+        if not success:
+            return {'status': 'fail', 'summary': cert}
+        status = 'ok' if cert['days'] > 14 else 'warn'
+        return {'status': status, 'summary': f"{cert['issuer']} · {cert['version']} · expires in {cert['days']} days ({cert['expires']:%Y-%m-%d})"}
+    
+    def check_http(deps):
+        if deps['addresses']['status'] in ('fail', 'skip'):
+            return _skipped("Skipped - domain has no address")
+        start = time.perf_counter()
+        success, response = safe_request(f"http://{domain}")
+        elapsed = time.perf_counter() - start
+        if not success:
+            return {'status': 'fail', 'summary': response}
+        hops = len(response.history)
+        summary = f"{response.status_code} in {elapsed:.1f}s · {hops} redirect(s) → {response.url}"
+        if response.status_code >= 400:
+            return {'status': 'fail', 'summary': summary}
+        if not response.url.startswith('https://'):
+            return {'status': 'warn', 'summary': summary + " · no HTTPS redirect"}
+        return {'status': 'ok', 'summary': summary}
+    
+    def check_mx(deps):
+        if deps['ns']['status'] == 'fail':
+            return _skipped("Skipped - no nameservers")
+        records, error = resolve_dns_cached(domain, 'MX')
+        if error:
+            return {'status': 'fail', 'summary': error, 'hosts': []}
+        if not records:
+            return {'status': 'warn', 'summary': "No MX records - domain cannot receive mail", 'hosts': []}
+        hosts = [h.rstrip('.') for _, h in sorted((int(p), h) for p, h in (r.split() for r in records))]
+        return {'status': 'ok', 'summary': f"{len(hosts)} MX: {', '.join(hosts[:3])}", 'hosts': hosts}
+    
+    def check_smtp(deps):
+        hosts = deps['mx'].get('hosts') or []
+        if not hosts:
+            return _skipped("Skipped - no MX hosts")
+        deadline = time.monotonic() + CONFIG['mail_probe_timeout']
+        row = probe_mail_port(hosts[0], 25, 'SMTP', 'smtp', 'STARTTLS', deadline)
+        if row['Reachable'] != '✅':
+            return {'status': 'fail', 'summary': f"{hosts[0]}:25 unreachable · {row['Detail']}"}
+        summary = f"{hosts[0]}:25 connect {row['Connect (ms)']} ms · TLS {row['TLS']}"
+        status = 'ok' if row['TLS'] != '—' and row['Cert Name Match'] == '✅' else 'warn'
+        if status == 'warn':
+            summary += f" · {row['Detail'] or 'STARTTLS/certificate issue'}"
+        return {'status': status, 'summary': summary}
+    
+    def check_spf(deps):
+        if deps['ns']['status'] == 'fail':
+            return _skipped("Skipped - no nameservers")
+        spf = evaluate_spf(domain)
+        if not spf['nodes'] or not spf['nodes'][0]['record']:
+            return {'status': 'fail', 'summary': "No SPF record"}
+        summary = f"{spf['lookups']}/{CONFIG['spf_lookup_limit']} lookups · {SPF_QUALIFIERS.get(spf['all'], 'no')} all"
+        if spf['errors']:
+            return {'status': 'fail', 'summary': f"{summary} · {spf['errors'][0]}"}
+        if spf['warnings'] or spf['all'] in ('+', '?', None):
+            return {'status': 'warn', 'summary': f"{summary}" + (f" · {spf['warnings'][0]}" if spf['warnings'] else "")}
+        return {'status': 'ok', 'summary': summary}
+    
+    def check_dmarc(deps):
+        if deps['ns']['status'] == 'fail':
+            return _skipped("Skipped - no nameservers")
+        records, error = resolve_dns_cached(f"_dmarc.{domain}", 'TXT')
+        policies = [txt_record_value(r) for r in records if txt_record_value(r).lower().startswith('v=dmarc1')]
+        if error:
+            return {'status': 'fail', 'summary': error}
+        if not policies:
+            return {'status': 'warn', 'summary': "No DMARC record"}
+        policy = re.search(r'\bp=(\w+)', policies[0])
+        policy = policy.group(1).lower() if policy else 'none'
+        return {'status': 'ok' if policy in ('quarantine', 'reject') else 'warn', 'summary': f"p={policy} · {policies[0][:80]}"}
+    
+    return {
+        'ns': (check_ns, ()),
+        'addresses': (check_addresses, ('ns',)),
+        'ssl': (check_ssl, ('addresses',)),
+        'http': (check_http, ('addresses',)),
+        'mx': (check_mx, ('ns',)),
+        'smtp': (check_smtp, ('mx',)),
+        'spf': (check_spf, ('ns',)),
+        'dmarc': (check_dmarc, ('ns',))
+    }
+
+HEALTH_CHECK_LABELS = {
+    'ns': "🖥️ Nameservers",
+    'addresses': "📍 A / AAAA",
+    'ssl': "🔒 SSL Certificate",
+    'http': "🌐 HTTP / Redirects",
+    'mx': "📮 MX Records",
+    'smtp': "📡 SMTP (port 25)",
+    'spf': "🛡️ SPF",
+    'dmarc': "📊 DMARC"
+}
+HEALTH_STATUS_ICONS = {'ok': '✅', 'warn': '⚠️', 'fail': '❌', 'skip': '⏭️'}
+
+# --- Email Header Parsing
+RECEIVED_FROM_RE = re.compile(r'\bfrom\s+(\S+)', re.IGNORECASE)
+RECEIVED_BY_RE = re.compile(r'\bby\s+(\S+)', re.IGNORECASE)
+RECEIVED_WITH_RE = re.compile(r'\bwith\s+(\S+)', re.IGNORECASE)
+RECEIVED_IP_RE = re.compile(r'\[(?:IPv6:)?([0-9a-fA-F:.]+)\]')
+
+def read_header_block(fp):
+    """Read only the header block of a message file, leaving the body unread"""
+    lines = []
+    for line in iter(fp.readline, b''):
+        if line in (b'\r\n', b'\n'):
+            break
+        lines.append(line)
+    return b''.join(lines)
+
+def parse_email_headers(raw):
+    """Parse raw header text/bytes into an email Message (headers only, repeats preserved)"""
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8', errors='replace')
+    # Pasted headers often use bare newlines and leading blank lines
+    raw = raw.lstrip(b'\r\n')
+    return BytesParser(policy=policy.default).parsebytes(raw, headersonly=True)
+
+def _header_str(value):
+    """Flatten a header value into a single line of text"""
+    return ' '.join(str(value).split())
+
+def _is_valid_ip(ip):
+    """True if the string parses as an IPv4 or IPv6 address"""
+    try:
+        ipaddress.ip_address(ip)
+        return True
+    except ValueError:
+        return False
+
+def _is_public_ip(ip):
+    """True if the IP is routable on the public internet"""
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+def parse_received_hops(msg):
+    """Extract every Received hop in chronological order with per-hop delays"""
+    received = msg.get_all('Received') or []
+    hops = []
+    
+    # Received headers are prepended, so the oldest hop is at the bottom
+    for raw in reversed(received):
+        value = _header_str(raw)
+        route, _, stamp = value.rpartition(';')
+        if not route:
+            route, stamp = value, ''
+        
+        from_part = re.split(r'\bby\s', route, maxsplit=1, flags=re.IGNORECASE)[0]
+        ips = [ip for ip in RECEIVED_IP_RE.findall(from_part) if _is_valid_ip(ip)]
+        
+        timestamp = None
+        try:
+            timestamp = email.utils.parsedate_to_datetime(stamp.strip())
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError, IndexError):
+            pass
+        
+        from_match = RECEIVED_FROM_RE.search(route)
+        by_match = RECEIVED_BY_RE.search(route)
+        with_match = RECEIVED_WITH_RE.search(route)
+        hops.append({
+            'from': from_match.group(1) if from_match else '',
+            'by': by_match.group(1) if by_match else '',
+            'with': with_match.group(1) if with_match else '',
+            'ip': ips[0] if ips else '',
+            'timestamp': timestamp,
+            'raw': value
+        })
+    
+    # Delay for the first hop is measured from the Date header
+    previous = None
+    try:
+        date_header = msg['Date']
+        previous = date_header.datetime if date_header is not None else None
+    except (AttributeError, TypeError, ValueError):
+        previous = None
+    
+    for hop in hops:
+        if hop['timestamp'] and previous and previous.tzinfo:
+            hop['delay'] = (hop['timestamp'] - previous).total_seconds()
+        else:
+            hop['delay'] = None
+        if hop['timestamp']:
+            previous = hop['timestamp']
+    
+    return hops
+
+@st.cache_data(ttl=CONFIG['cache_ttl'])
+def batch_lookup_ips(ips):
+    """Geolocate many IPs in one request using the ip-api.com batch endpoint"""
+    results = {}
+    ips = [ip for ip in dict.fromkeys(ips) if _is_public_ip(ip)]
+    
+    # The batch endpoint accepts up to 100 queries per request
+    for i in range(0, len(ips), 100):
+        payload = [
+            {'query': ip, 'fields': 'status,message,country,city,isp,org,as,query'}
+            for ip in ips[i:i + 100]
+        ]
+        if not acquire_api('ip-api.com/batch')[0]:
+            # Out of budget: leave the remaining IPs without geolocation
+            break
+        success, response = safe_request('http://ip-api.com/batch', method='post', json=payload)
+        if success and response.status_code == 429:
+            mark_api_throttled('ip-api.com/batch')
+        if not success or response.status_code != 200:
+            continue
+        try:
+            for item in response.json():
+                if item.get('status') == 'success':
+                    results[item['query']] = item
+        except ValueError:
+            continue
+    
+    return results
+
+def format_delay(seconds):
+    """Human readable hop delay"""
+    if seconds is None:
+        return 'N/A'
+    sign = '-' if seconds < 0 else ''
+    seconds = abs(int(seconds))
+    if seconds < 60:
+        return f"{sign}{seconds}s"
+    if seconds < 3600:
+        return f"{sign}{seconds // 60}m {seconds % 60}s"
+    return f"{sign}{seconds // 3600}h {(seconds % 3600) // 60}m"
+
+# --- Bulk Bounce Analysis
+# Envelope lines look like "From sender@host Tue Oct 14 10:00:00 2025"
+MBOX_FROM_RE = re.compile(rb'^From \S+ +\w{3} \w{3} [ \d]\d \d\d:\d\d:\d\d \d{4}', re.MULTILINE)
+HEADER_END_RE = re.compile(rb'\r?\n\r?\n')
+DSN_PART_RE = re.compile(rb'message/delivery-status', re.IGNORECASE)
+MIME_BOUNDARY_RE = re.compile(rb'\r?\n--')
+BOUNCE_SUBJECT_RE = re.compile(r'undeliver|delivery (status|failure)|returned mail|failure notice|mail delivery failed', re.IGNORECASE)
+BOUNCE_SENDER_RE = re.compile(r'mailer-daemon|postmaster', re.IGNORECASE)
+ENHANCED_STATUS_RE = re.compile(rb'\b([245]\.\d{1,3}\.\d{1,3})\b')
+BOUNCE_RECIPIENT_RE = re.compile(rb'<([^<>@\s]+@[^<>\s]+)>')
+
+# RFC 3463 subject codes (the middle digit of an enhanced status code)
+ENHANCED_STATUS_SUBJECTS = {
+    '0': 'Other/undefined',
+    '1': 'Addressing',
+    '2': 'Mailbox',
+    '3': 'Mail system',
+    '4': 'Network/routing',
+    '5': 'Mail delivery protocol',
+    '6': 'Message content',
+    '7': 'Security/policy'
+}
+
+def iter_mbox_messages(buf):
+    """Yield (start, end) byte offsets of each message in an mbox buffer"""
+    starts = [m.start() for m in MBOX_FROM_RE.finditer(buf)]
+    if not starts:
+        # Not an mbox - treat the whole buffer as one message
+        starts = [0]
+    for i, start in enumerate(starts):
+        yield start, starts[i + 1] if i + 1 < len(starts) else len(buf)
+
+def _dsn_value(value):
+    """Strip the address-type prefix from DSN fields (rfc822;user@host, dns;mx.host)"""
+    value = _header_str(value)
+    return value.split(';', 1)[1].strip() if ';' in value else value
+
+def parse_bounce(buf, start, end):
+    """Parse one message slice and return bounce records, or [] if it is not a bounce"""
+    match = HEADER_END_RE.search(buf, start, end)
+    header_end = match.start() if match else end
+    body_start = match.end() if match else end
+    
+    header_bytes = bytes(buf[start:header_end])
+    if header_bytes.startswith(b'From '):
+        header_bytes = header_bytes.split(b'\n', 1)[1] if b'\n' in header_bytes else b''
+    msg = parse_email_headers(header_bytes)
+    
+    content_type = str(msg.get('Content-Type', '')).lower()
+    is_report = 'multipart/report' in content_type
+    if not (is_report
+            or BOUNCE_SENDER_RE.search(str(msg.get('From', '')))
+            or BOUNCE_SUBJECT_RE.search(str(msg.get('Subject', '')))):
+        return []
+    
+    try:
+        date = msg['Date'].datetime if msg['Date'] is not None else None
+    except (AttributeError, TypeError, ValueError):
+        date = None
+    
+    records = []
+    dsn = DSN_PART_RE.search(buf, body_start, end)
+    if dsn:
+        # Skip the part headers, then read up to the next MIME boundary
+        part = HEADER_END_RE.search(buf, dsn.end(), end)
+        if part:
+            boundary = MIME_BOUNDARY_RE.search(buf, part.end(), end)
+            block = bytes(buf[part.end():boundary.start() if boundary else end])
+            groups = [g for g in re.split(rb'\r?\n\s*\r?\n', block) if g.strip()]
+            per_message = parse_email_headers(groups[0]) if groups else None
+            reporting_mta = _dsn_value(per_message.get('Reporting-MTA', '')) if per_message else ''
+            
+            for group in groups[1:]:
+                fields = parse_email_headers(group)
+                recipient = _dsn_value(fields.get('Final-Recipient') or fields.get('Original-Recipient') or '')
+                if not recipient:
+                    continue
+                records.append({
+                    'recipient': recipient.lower(),
+                    'action': _header_str(fields.get('Action', '')).lower(),
+                    'status': _header_str(fields.get('Status', '')),
+                    'remote_mta': _dsn_value(fields.get('Remote-MTA', '')) or reporting_mta,
+                    'diagnostic': _dsn_value(fields.get('Diagnostic-Code', ''))[:200],
+                    'date': date
+                })
+    
+    if not records:
+        # Non-DSN bounce (qmail/older Exim): scan the start of the body for clues
+        window_end = min(end, body_start + 65536)
+        status = ENHANCED_STATUS_RE.search(buf, body_start, window_end)
+        recipient = BOUNCE_RECIPIENT_RE.search(buf, body_start, window_end)
+        if recipient:
+            records.append({
+                'recipient': recipient.group(1).decode(errors='replace').lower(),
+                'action': 'failed',
+                'status': status.group(1).decode() if status else '',
+                'remote_mta': '',
+                'diagnostic': '',
+                'date': date
+            })
+    
+    for record in records:
+        record['domain'] = record['recipient'].rsplit('@', 1)[-1] if '@' in record['recipient'] else ''
+        code = record['status']
+        record['category'] = ENHANCED_STATUS_SUBJECTS.get(code.split('.')[1], '') if code.count('.') == 2 else ''
+    return records
+
+def analyze_mailbox_buffer(buf, progress=None):
+    """Scan an mbox (or single message) buffer and return (message count, bounce records)"""
+    records = []
+    count = 0
+    size = len(buf) or 1
+    for start, end in iter_mbox_messages(buf):
+        count += 1
+        records.extend(parse_bounce(buf, start, end))
+        if progress and count % 500 == 0:
+            progress(min(end / size, 1.0))
+    return count, records
+
+def resolve_mailbox_path(path):
+    """Return the real path if it lies under a configured mailbox root, else None"""
+    real = os.path.realpath(path)
+    for root in CONFIG['mailbox_roots']:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root.rstrip(os.sep) + os.sep):
+            return real
+    return None
+
+def analyze_mailbox_path(path, progress=None):
+    """Memory-map an mbox file, or every message file of a Maildir, and collect bounces"""
+    path = resolve_mailbox_path(path)
+    if path is None:
+        raise ValueError("path is outside the configured mailbox roots")
+    if os.path.isdir(path):
+        files = []
+        for sub in ('cur', 'new'):
+            folder = os.path.join(path, sub)
+            if os.path.isdir(folder):
+                files.extend(os.path.join(folder, f) for f in os.listdir(folder))
+        if not files:
+            files = [os.path.join(path, f) for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+    else:
+        files = [path]
+    
+    total, records = 0, []
+    for i, file_path in enumerate(files, 1):
+        if os.path.getsize(file_path) == 0:
+            continue
+        with open(file_path, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count, found = analyze_mailbox_buffer(mm, progress if len(files) == 1 else None)
+            total += count
+            records.extend(found)
+        if progress and len(files) > 1 and i % 200 == 0:
+            progress(i / len(files))
+    return total, records
+
+# --- Error Code Knowledge Base
+# (kind, codes, title, aliases, meaning, causes, fix)
+ERROR_CODE_DB = [
+    # HTTP
+    ('HTTP', ['301'], 'Moved Permanently', 'permanent redirect',
+     'The URL has permanently moved to the address in the Location header.',
+     'Intentional redirect in .htaccess, HTTPS/www canonicalization, CMS site URL change.',
+     'Check the redirect chain with the HTTP Status Checker; look for loops between http/https or www/non-www.'),
+    ('HTTP', ['302'], 'Found (Temporary Redirect)', 'temporary redirect',
+     'The resource is temporarily served from another URL.',
+     'Login redirects, maintenance pages, plugin or .htaccess rules.',
+     'Follow the chain with the Redirect Checker and confirm the target is expected.'),
+    ('HTTP', ['304'], 'Not Modified', 'cached',
+     'The browser cache is still valid; no body was sent.',
+     'Normal behaviour for conditional requests (ETag / If-Modified-Since).',
+     'Nothing to fix. Hard-refresh or clear the cache if a change is not showing.'),
+    ('HTTP', ['400'], 'Bad Request', 'malformed request request header too large',
+     'The server could not understand the request.',
+     'Oversized or corrupt cookies, malformed URLs, invalid headers.',
+     'Clear cookies for the site, retry in a private window, check for very long query strings.'),
+    ('HTTP', ['401'], 'Unauthorized', 'authentication required password protected directory',
+     'The request needs valid credentials.',
+     'Password-protected directory (.htpasswd), wrong API credentials, expired session.',
+     'Check Directory Privacy in cPanel and the .htaccess AuthType/AuthUserFile lines.'),
+    ('HTTP', ['403'], 'Forbidden', 'access denied permission denied you don\'t have permission',
+     'The server understood the request but refuses to serve it.',
+     'Wrong file/folder permissions or ownership, deny rules in .htaccess, ModSecurity, IP blocks, missing index file with Indexes disabled.',
+     'Files 644 and folders 755, check .htaccess deny/require rules, review the ModSecurity and Apache error logs, check cPanel IP Blocker.'),
+    ('HTTP', ['404'], 'Not Found', 'page not found file not found',
+     'Nothing exists at the requested path.',
+     'Wrong document root, missing file, broken permalinks/rewrite rules, case-sensitive filenames.',
+     'Confirm the file exists under the domain\'s document root; for WordPress re-save Permalinks to regenerate .htaccess.'),
+    ('HTTP', ['405'], 'Method Not Allowed', 'method not allowed',
+     'The HTTP method (e.g. POST) is not allowed for this URL.',
+     'Posting to a static file, server or WAF rules restricting methods.',
+     'Check the form action URL and any Limit/LimitExcept rules in .htaccess.'),
+    ('HTTP', ['408'], 'Request Timeout', 'request timeout',
+     'The client took too long to send the request.',
+     'Slow or unstable client connection, large uploads on poor links.',
+     'Retry on a stable connection; for uploads try FTP/SFTP instead of the browser.'),
+    ('HTTP', ['413'], 'Payload Too Large', 'request entity too large upload too large',
+     'The request body exceeds the server limit.',
+     'Upload larger than LimitRequestBody, upload_max_filesize or post_max_size.',
+     'Raise upload_max_filesize and post_max_size in MultiPHP INI Editor, or upload via FTP.'),
+    ('HTTP', ['414'], 'URI Too Long', 'request uri too long',
+     'The URL is longer than the server accepts.',
+     'Redirect loops appending parameters, huge GET forms.',
+     'Look for loops with the Redirect Checker; switch large forms to POST.'),
+    ('HTTP', ['429'], 'Too Many Requests', 'rate limited rate limit',
+     'The client is being rate limited.',
+     'Bots or scripts hammering the site, API quotas, WAF rate rules.',
+     'Check access logs for the source IP; back off and retry later.'),
+    ('HTTP', ['500'], 'Internal Server Error', 'internal server error',
+     'The server hit an error it could not handle.',
+     'Syntax errors or unsupported directives in .htaccess, PHP fatal errors, wrong permissions on scripts, exhausted PHP memory.',
+     'Check the Apache/PHP error log in cPanel (Errors / error_log), rename .htaccess to test, fix permissions to 644/755.'),
+    ('HTTP', ['502'], 'Bad Gateway', 'bad gateway proxy error',
+     'A proxy or gateway received an invalid response from the upstream server.',
+     'PHP-FPM or backend crashed or restarted, CDN cannot reach origin, upstream timeouts.',
+     'Check PHP-FPM status and resource usage; bypass the CDN to test the origin directly.'),
+    ('HTTP', ['503'], 'Service Unavailable', 'service unavailable temporarily unavailable',
+     'The server is temporarily unable to handle the request.',
+     'Resource limits (entry processes) reached, maintenance mode, overloaded server.',
+     'Check Resource Usage in cPanel for EP/CPU/memory faults; remove a stale .maintenance file for WordPress.'),
+    ('HTTP', ['504'], 'Gateway Timeout', 'gateway timeout',
+     'The upstream server did not respond in time.',
+     'Long-running PHP scripts, slow database queries, CDN to origin timeouts.',
+     'Profile slow scripts and queries; check max_execution_time and the MySQL slow log.'),
+    ('HTTP', ['508'], 'Resource Limit Is Reached', 'resource limit reached entry processes',
+     'CloudLinux LVE limits were hit for the account.',
+     'Too many concurrent PHP processes, traffic spikes, bots, heavy plugins.',
+     'Review Resource Usage in cPanel, enable caching, block abusive bots, consider a plan upgrade.'),
+    ('HTTP', ['520', '521', '522', '523', '524', '525', '526'], 'Cloudflare Origin Error', 'cloudflare origin unreachable web server is down connection timed out',
+     'Cloudflare could not get a valid response from the origin server.',
+     '521: origin refusing connections; 522: connection timed out; 524: origin too slow; 525/526: SSL handshake or invalid origin certificate.',
+     'Confirm the origin IP in Cloudflare DNS, whitelist Cloudflare IPs in the firewall, and install a valid SSL certificate on the origin.'),
+    # SMTP reply codes
+    ('SMTP', ['421'], 'Service Not Available', 'service not available closing transmission channel too many connections',
+     'The receiving server is temporarily refusing connections.',
+     'Rate limiting, greylisting, overloaded or restarting server.',
+     'Temporary: the sending server will retry. Check the sending IP reputation if it persists.'),
+    ('SMTP', ['450'], 'Mailbox Unavailable (Temporary)', 'mailbox busy greylisted try again later',
+     'The action was not taken; the mailbox is temporarily unavailable.',
+     'Greylisting, mailbox locked, temporary policy block.',
+     'Wait for the retry; persistent failures usually mean greylisting or a reputation issue.'),
+    ('SMTP', ['451'], 'Local Error in Processing', 'local error in processing temporary failure',
+     'The server aborted the action due to a local error.',
+     'DNS lookup failures, spam scanner timeouts, disk issues on the receiver.',
+     'Temporary; check MX/SPF DNS for the sender domain if it repeats.'),
+    ('SMTP', ['452'], 'Insufficient System Storage', 'insufficient storage too many recipients',
+     'The server cannot store the message right now.',
+     'Receiver disk full, too many recipients in one transaction.',
+     'Retry later or split the recipient list.'),
+    ('SMTP', ['530'], 'Authentication Required', 'authentication required must authenticate',
+     'The server requires SMTP authentication before sending.',
+     'Mail client set to send without SMTP authentication.',
+     'Enable "My outgoing server requires authentication" with the full email address as username.'),
+    ('SMTP', ['535'], 'Authentication Failed', 'authentication credentials invalid incorrect authentication data',
+     'The SMTP username or password was rejected.',
+     'Wrong password, username not the full email address, account suspended or locked by brute-force protection (cPHulk).',
+     'Reset the mailbox password in cPanel, use the full address as username, check cPHulk for blocked IPs.'),
+    ('SMTP', ['550'], 'Mailbox Unavailable', 'user unknown no such user recipient rejected relay denied',
+     'The action was not taken; the mailbox is unavailable or the message was refused by policy.',
+     'Recipient does not exist, relaying not permitted, sender blocked by SPF/DMARC or a blacklist.',
+     'Verify the recipient address, authenticate before sending, check SPF/DKIM/DMARC and the sending IP on blacklists.'),
+    ('SMTP', ['551'], 'User Not Local', 'user not local',
+     'The recipient is not local to this server.',
+     'Stale forwarding, wrong MX for the recipient domain.',
+     'Check MX records for the recipient domain.'),
+    ('SMTP', ['552'], 'Exceeded Storage Allocation', 'mailbox full quota exceeded message too large',
+     'The recipient mailbox is full or the message is too large.',
+     'Mailbox quota reached, attachment size above the receiver limit.',
+     'Increase the mailbox quota or clean up old mail; send large files via a link.'),
+    ('SMTP', ['553'], 'Mailbox Name Not Allowed', 'mailbox name not allowed sender address rejected',
+     'The mailbox name is invalid or the sender is not allowed.',
+     'Malformed address, sender not authorized to use this From address.',
+     'Check the address syntax and that the From address belongs to the authenticated account.'),
+    ('SMTP', ['554'], 'Transaction Failed', 'transaction failed message rejected spam blocked',
+     'The transaction failed; usually a permanent policy or spam rejection.',
+     'Content flagged as spam, sending IP or domain on a blacklist, DMARC rejection.',
+     'Check the sending IP with the Blacklist Checker and review SPF/DKIM/DMARC alignment.'),
+    # Enhanced status codes (RFC 3463)
+    ('SMTP', ['5.1.1'], 'Bad Destination Mailbox Address', 'user unknown mailbox does not exist',
+     'The recipient mailbox does not exist.',
+     'Typo in the address, deleted mailbox, wrong domain.',
+     'Verify the address with the recipient; check the mailbox exists in cPanel if it is local.'),
+    ('SMTP', ['5.1.2'], 'Bad Destination System Address', 'host unknown domain not found',
+     'The recipient domain does not exist or has no mail server.',
+     'Typo in the domain, expired domain, missing MX/A records.',
+     'Check the domain with the MX Record Checker and Domain Status Check.'),
+    ('SMTP', ['5.1.8'], 'Bad Sender\'s System Address', 'sender domain does not exist',
+     'The sender\'s domain could not be verified.',
+     'Sender domain has no valid DNS (MX/A) records.',
+     'Add proper MX and A records for the sending domain.'),
+    ('SMTP', ['5.2.1'], 'Mailbox Disabled', 'mailbox disabled not accepting messages',
+     'The mailbox exists but is not accepting mail.',
+     'Suspended or disabled account on the receiver.',
+     'Contact the recipient via another channel.'),
+    ('SMTP', ['4.2.2', '5.2.2'], 'Mailbox Full', 'over quota mailbox full',
+     'The recipient mailbox is over its quota.',
+     'Quota exhausted on the receiving mailbox.',
+     'Increase the quota or delete old mail (cPanel > Email Accounts > Manage).'),
+    ('SMTP', ['5.2.3'], 'Message Length Exceeds Limit', 'message too large size limit',
+     'The message is larger than the receiver accepts.',
+     'Large attachments.',
+     'Compress attachments or share a download link.'),
+    ('SMTP', ['4.4.1', '4.4.2'], 'Connection Timed Out', 'no answer from host connection dropped',
+     'The sending server could not connect to or lost the connection to the receiver.',
+     'Receiver down, firewall blocking port 25, network issues.',
+     'Temporary; check the recipient MX is reachable with the Mail Port Matrix.'),
+    ('SMTP', ['5.4.4'], 'Unable to Route', 'unrouteable address no mx',
+     'No valid route to the recipient domain.',
+     'Missing or broken MX records for the recipient domain.',
+     'Check the recipient domain\'s MX records.'),
+    ('SMTP', ['4.4.7', '5.4.7'], 'Delivery Time Expired', 'message expired retry timeout',
+     'The message could not be delivered before the retry period ran out.',
+     'Receiver unreachable for days, persistent temporary failures.',
+     'Check earlier deferral reasons in the mail queue or bounce.'),
+    ('SMTP', ['5.5.0', '5.5.1', '5.5.2'], 'Protocol Error', 'syntax error command not recognized',
+     'The SMTP conversation broke protocol.',
+     'Misbehaving client or script, pipelining issues.',
+     'Use a standard mail library or client; check the script\'s SMTP settings.'),
+    ('SMTP', ['5.7.0', '5.7.1'], 'Delivery Not Authorized', 'relay access denied message refused policy',
+     'The message was rejected by security policy.',
+     'Relaying without authentication, sender blocked, SPF/DMARC failure, blacklisted IP.',
+     'Authenticate before sending, then check SPF/DKIM/DMARC and blacklists.'),
+    ('SMTP', ['5.7.8'], 'Authentication Credentials Invalid', 'authentication failed invalid credentials',
+     'SMTP authentication failed.',
+     'Wrong password or username.',
+     'Reset the mailbox password and use the full email address as the username.'),
+    ('SMTP', ['5.7.23'], 'SPF Validation Failed', 'spf fail not permitted sender',
+     'The sending IP is not authorized by the domain\'s SPF record.',
+     'SPF record missing the sending server or third-party service.',
+     'Add the sending server/service to the SPF record (see SPF/DKIM Check).'),
+    ('SMTP', ['5.7.25'], 'Reverse DNS Validation Failed', 'ptr missing reverse dns',
+     'The sending IP has no valid PTR record.',
+     'Missing or mismatched reverse DNS for the sending IP.',
+     'Ask the IP owner to set a PTR matching the server hostname.'),
+    ('SMTP', ['5.7.26'], 'Multiple Authentication Checks Failed', 'dmarc fail unauthenticated email',
+     'The message failed DMARC (SPF and DKIM not aligned).',
+     'Missing DKIM signing, SPF not including the sender, From domain mismatch.',
+     'Enable DKIM in cPanel Email Deliverability and fix SPF alignment.'),
+    # cPanel / PHP / server
+    ('PHP', [], 'Allowed Memory Size Exhausted', 'allowed memory size of bytes exhausted fatal error memory_limit',
+     'A PHP script used more memory than memory_limit allows.',
+     'Heavy plugins/themes, large imports, memory leaks.',
+     'Raise memory_limit in MultiPHP INI Editor (e.g. 256M) or WP_MEMORY_LIMIT; find the plugin responsible.'),
+    ('PHP', [], 'Maximum Execution Time Exceeded', 'maximum execution time of seconds exceeded max_execution_time',
+     'A PHP script ran longer than max_execution_time.',
+     'Slow external calls, large imports, heavy queries.',
+     'Raise max_execution_time in MultiPHP INI Editor or run the task via cron/CLI.'),
+    ('PHP', [], 'Call to Undefined Function', 'call to undefined function fatal error',
+     'PHP code calls a function that does not exist in this environment.',
+     'Missing PHP extension (mysqli, gd, intl), wrong PHP version.',
+     'Enable the extension in Select PHP Version or switch to the PHP version the app supports.'),
+    ('PHP', [], 'Headers Already Sent', 'cannot modify header information headers already sent',
+     'Output was sent before PHP tried to set headers.',
+     'Whitespace or BOM before <?php, echo before header()/setcookie().',
+     'Remove whitespace/BOM at the top of the file named in the warning.'),
+    ('PHP', [], 'Error Establishing a Database Connection', 'error establishing database connection mysql connect',
+     'The application cannot connect to MySQL.',
+     'Wrong DB name/user/password/host in the config, user not assigned to the database, MySQL down.',
+     'Check wp-config.php (or equivalent) against cPanel MySQL Databases and that the user has privileges.'),
+    ('PHP', [], 'Access Denied for User', 'access denied for user using password sqlstate 1045',
+     'MySQL rejected the username or password.',
+     'Wrong password, user not added to the database, wrong prefix on the username.',
+     'Reset the DB user password and re-add the user to the database with All Privileges.'),
+    ('PHP', [], 'Too Many Connections', 'too many connections sqlstate 1040 max_user_connections',
+     'MySQL connection limit reached.',
+     'Traffic spikes, persistent connections, slow queries holding connections.',
+     'Enable caching, optimise slow queries, avoid persistent connections.'),
+    ('PHP', [], 'Premature End of Script Headers', 'premature end of script headers end of script output before headers',
+     'A CGI/PHP script exited before sending headers.',
+     'Script crash, wrong permissions (group/world writable), resource limits, wrong line endings.',
+     'Set scripts to 644 (CGI 755), check the error log and resource usage.'),
+    ('cPanel', [], 'Disk Quota Exceeded', 'disk quota exceeded no space left on device',
+     'The account has used all its disk space.',
+     'Large backups, logs, mailboxes or cache folders.',
+     'Use Disk Usage in cPanel to find large folders; remove old backups and trim mailboxes.'),
+    ('cPanel', [], 'Inode Limit Reached', 'inode limit file count exceeded',
+     'The account has reached its file count limit.',
+     'Cache folders, session files, mail with many small messages.',
+     'Clear cache and session directories and old mail.'),
+    ('cPanel', [], 'Account Suspended', 'this account has been suspended',
+     'The hosting account is suspended.',
+     'Overdue invoice, abuse report, policy violation.',
+     'Check billing status and abuse notes before unsuspending.'),
+    ('cPanel', [], 'Index of /', 'directory listing index of',
+     'The server is showing a directory listing instead of the site.',
+     'Missing index.php/index.html in the document root.',
+     'Upload the site files to public_html or add an index file; disable Indexes in .htaccess.'),
+    ('cPanel', [], 'SSL Certificate Error', 'your connection is not private net err cert common name invalid certificate expired',
+     'The browser does not trust the certificate served for the domain.',
+     'Expired AutoSSL certificate, certificate not covering www/subdomain, DNS pointing elsewhere so AutoSSL validation fails.',
+     'Run AutoSSL in cPanel SSL/TLS Status and confirm DNS points to this server (SSL Certificate Check).'),
+    ('cPanel', [], 'Too Many Redirects', 'err too many redirects redirected you too many times',
+     'The browser detected a redirect loop.',
+     'Conflicting HTTPS redirects between .htaccess, the CMS and Cloudflare Flexible SSL.',
+     'Trace the loop with the Redirect Checker; use Cloudflare Full SSL or remove duplicate rules.'),
+    ('cPanel', [], 'DNS Probe Finished NXDOMAIN', 'dns_probe_finished_nxdomain server ip address could not be found',
+     'The domain does not resolve.',
+     'Expired domain, wrong nameservers, missing A record, propagation in progress.',
+     'Check with Domain Status Check and DNS Propagation Checker.')
+]
+
+def _error_tokens(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def _build_error_code_index():
+    """Exact code map, inverted token index with IDF weights, and first-letter vocabulary buckets"""
+    codes = {}
+    postings = {}
+    entry_tokens = []
+    for i, (kind, entry_codes, title, aliases, *_rest) in enumerate(ERROR_CODE_DB):
+        for code in entry_codes:
+            codes.setdefault(code, []).append(i)
+        tokens = {t for t in _error_tokens(f"{title} {aliases}") if len(t) > 2 or t.isdigit()}
+        entry_tokens.append(tokens)
+        for token in tokens:
+            postings.setdefault(token, set()).add(i)
+
+    idf = {token: 1.0 + len(ERROR_CODE_DB) / len(ids) for token, ids in postings.items()}
+    weights = [sum(idf[t] for t in tokens) or 1.0 for tokens in entry_tokens]
+    vocab = {}
+    for token in postings:
+        vocab.setdefault(token[0], []).append(token)
+    return codes, postings, idf, weights, vocab
+
+# Built once at import; lookups only touch dicts
+_ERROR_CODE_INDEX = _build_error_code_index()
+
+def _error_code_entry(i, match):
+    kind, codes, title, _aliases, meaning, causes, fix = ERROR_CODE_DB[i]
+    return {'kind': kind, 'codes': codes, 'title': title, 'meaning': meaning,
+            'causes': causes, 'fix': fix, 'match': match}
+
+def lookup_error_code(query, limit=3, min_score=0.55):
+    """Match a query against the local error-code database.
+
+    Exact codes (404, 550, 5.7.1) win; otherwise phrases are scored by the
+    IDF-weighted overlap between query and entry keywords, with
+    close-spelling matches for unknown words. Unlisted enhanced codes fall
+    back to their RFC 3463 class and subject.
+    """
+    codes, postings, idf, weights, vocab = _ERROR_CODE_INDEX
+
+    results = []
+    seen = set()
+    for code in re.findall(r'(?<![\d.])([245]\.\d{1,3}\.\d{1,3}|[1-5]\d\d)(?!\d|\.\d)', query):
+        for i in codes.get(code, []):
+            if i not in seen:
+                seen.add(i)
+                results.append(_error_code_entry(i, f"code {code}"))
+        if code not in codes and '.' in code:
+            klass, subject, _detail = code.split('.')
+            results.append({
+                'kind': 'SMTP', 'codes': [code],
+                'title': f"{'Permanent failure' if klass == '5' else 'Temporary failure' if klass == '4' else 'Success'}: "
+                         f"{ENHANCED_STATUS_SUBJECTS.get(subject, 'Unknown')} status",
+                'meaning': f"Enhanced status code class {klass} (subject {subject}); the detail code is not in the local database.",
+                'causes': '', 'fix': '', 'match': f"class of {code}"
+            })
+    if results:
+        return results[:limit]
+
+    scores = {}
+    query_weight = 0.0
+    for token in set(_error_tokens(query)):
+        if token not in postings and len(token) >= 5:
+            close = difflib.get_close_matches(token, vocab.get(token[0], []), n=1, cutoff=0.85)
+            token = close[0] if close else token
+        if token not in postings:
+            continue
+        query_weight += idf[token]
+        for i in postings[token]:
+            scores[i] = scores.get(i, 0.0) + idf[token]
+
+    # Average of how much of the query is explained and how much of the entry is covered
+    ranked = sorted(((score / query_weight + score / weights[i]) / 2, i) for i, score in scores.items())[::-1]
+    return [_error_code_entry(i, f"{score:.0%} keyword match") for score, i in ranked[:limit] if score >= min_score]
+
+# --- AI Helpers
+class AIGatewayBusy(RuntimeError):
+    """Raised when the AI service can't take a request now (every slot stayed busy past the queue timeout)"""
+
+class AIQuotaExceeded(AIGatewayBusy):
+    """Raised when the shared Gemini API budget refuses a request; retrying won't help"""
+
+def _is_transient_ai_error(e):
+    """429s, 5xx, timeouts and a full gateway queue are worth retrying; bad requests, safety blocks and an exhausted API budget are not"""
+    return type(e).__name__ in (
+        'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+        'DeadlineExceeded', 'Timeout', 'ReadTimeout', 'ConnectionError', 'AIGatewayBusy'
+    )
+
+class AIGateway:
+    """Single entry point for Gemini calls, shared by every session in the process.
+    
+    Holds one model client per configuration, caps concurrent requests (extra
+    callers queue up to `queue_timeout`), applies a per-request timeout,
+    retries transient errors with jittered backoff before switching to the
+    fallback model, and records per-tool latency, token and error metrics.
+    """
+    
+    def __init__(self, model_name, fallback_model, max_concurrency, queue_timeout, request_timeout, max_retries):
+        self.model_name = model_name
+        self.fallback_model = fallback_model
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.models = {}
+        self.metrics = {}
+        self.active = 0
+        self.queued = 0
+    
+    def _model(self, name, system_instruction=None, json_output=False):
+        key = (name, system_instruction, json_output)
+        with self.lock:
+            if key not in self.models:
+                self.models[key] = genai.GenerativeModel(
+                    name,
+                    system_instruction=system_instruction,
+                    generation_config={'response_mime_type': 'application/json'} if json_output else None
+                )
+            return self.models[key]
+    
+    def _acquire(self):
+        with self.lock:
+            self.queued += 1
+        acquired = self.slots.acquire(timeout=self.queue_timeout)
+        with self.lock:
+            self.queued -= 1
+            self.active += acquired
+        if not acquired:
+            raise AIGatewayBusy(f"AI service is busy ({self.queued} requests waiting) - please try again shortly")
+    
+    def _release(self):
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+    
+    def _record(self, tool, seconds=None, usage=None, error=False, retried=False, fallback=False):
+        with self.lock:
+            m = self.metrics.setdefault(tool, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'fallbacks': 0,
+                'prompt_tokens': 0, 'output_tokens': 0, 'latencies': collections.deque(maxlen=200)
+            })
+            if retried:
+                m['retries'] += 1
+                return
+            m['calls'] += 1
+            m['errors'] += error
+            m['fallbacks'] += fallback
+            if seconds is not None:
+                m['latencies'].append(seconds)
+            if usage is not None:
+                m['prompt_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+                m['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+    
+    def generate(self, tool, contents, system_instruction=None, history=None, json_output=False,
+                 on_text=None, throttle=None):
+        """Run one request and return (text, time_to_first_token, total_time, model_name).
+        
+        With `history` the request is sent as the next turn of a chat session.
+        `on_text` streams: it is called with the accumulated text per chunk
+        (from the caller's thread). `throttle` is called before every attempt,
+        e.g. a rate limiter's wait(). The shared API quota is charged once per
+        call, not per attempt. `model_name` is the model that answered, which
+        differs from the primary one after a fallback.
+        """
+        start = time.perf_counter()
+        attempts = [self.model_name] * self.max_retries + ([self.fallback_model] if self.fallback_model else [])
+        quota_taken = False
+        for attempt, model_name in enumerate(attempts):
+            if throttle:
+                throttle()
+            text = ""
+            first_token = None
+            acquired = False
+            try:
+                self._acquire()
+                acquired = True
+                if not quota_taken:
+                    allowed, reason = acquire_api('gemini')
+                    if not allowed:
+                        raise AIQuotaExceeded(reason)
+                    quota_taken = True
+                model = self._model(model_name, system_instruction, json_output)
+                options = {'stream': on_text is not None, 'request_options': {'timeout': self.request_timeout}}
+                if history is not None:
+                    response = model.start_chat(history=history).send_message(contents, **options)
+                else:
+                    response = model.generate_content(contents, **options)
+                
+                if on_text is None:
+                    text = response.text
+                else:
+                    for chunk in response:
+                        try:
+                            piece = chunk.text
+                        except ValueError:
+                            # Chunks without text (e.g. safety metadata) raise on .text
+                            continue
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        text += piece
+                        on_text(text)
+                
+                total = time.perf_counter() - start
+                self._record(tool, total, getattr(response, 'usage_metadata', None), fallback=model_name != self.model_name)
+                return text, first_token, total, model_name
+            except Exception as e:
+                # Retry only before anything reached the user; a half-streamed answer can't be replayed
+                if text or not _is_transient_ai_error(e) or attempt == len(attempts) - 1:
+                    self._record(tool, error=True)
+                    raise
+                self._record(tool, retried=True)
+                busy = isinstance(e, AIGatewayBusy)
+            finally:
+                if acquired:
+                    self._release()
+            if busy or attempts[attempt + 1] == model_name:
+                time.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.5))
+    
+    def snapshot(self):
+        """Per-tool metrics rows for display"""
+        with self.lock:
+            rows = []
+            for tool, m in sorted(self.metrics.items()):
+                latencies = sorted(m['latencies'])
+                rows.append({
+                    'Tool': tool,
+                    'Calls': m['calls'],
+                    'Error Rate': f"{m['errors'] / m['calls']:.0%}" if m['calls'] else "-",
+                    'Retries': m['retries'],
+                    'Fallbacks': m['fallbacks'],
+                    'p50 (s)': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                    'p95 (s)': round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None,
+                    'Prompt Tokens': m['prompt_tokens'],
+                    'Output Tokens': m['output_tokens']
+                })
+            return rows, self.active, self.queued
+
+@st.cache_resource
+def get_ai_gateway():
+    """Process-wide gateway; cache_resource keeps it across reruns and sessions"""
+    return AIGateway(
+        CONFIG['ai_model'],
+        CONFIG['ai_fallback_model'],
+        CONFIG['ai_max_concurrency'],
+        CONFIG['ai_queue_timeout'],
+        CONFIG['ai_timeout'],
+        CONFIG['ai_max_retries']
+    )
+
+# Tools whose pages show the gateway metrics expander
+AI_TOOLS = {
+    "💬 AI Support Chat", "📧 AI Mail Error Assistant", "❓ Error Code Explainer",
+    "🔍 AI Ticket Analysis", "📋 Batch Ticket Triage", "🩺 Smart Symptom Checker"
+}
+
+def render_ai_metrics():
+    """Expander with the shared gateway's load and per-tool metrics"""
+    rows, active, queued = get_ai_gateway().snapshot()
+    with st.expander("📈 AI Gateway Metrics"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("In Flight", f"{active}/{CONFIG['ai_max_concurrency']}")
+        col2.metric("Queued", queued)
+        col3.metric("Requests", sum(r['Calls'] for r in rows))
+        show_api_budget('gemini')
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No AI requests in this process yet")
+
+def stream_ai_response(contents, tool, placeholder=None, wrap=None, **kwargs):
+    """Stream a Gemini response through the gateway into a placeholder as tokens arrive.
+    
+    Returns (text, time_to_first_token, total_time, model_name). `wrap` optionally turns
+    the partial text into HTML (e.g. the chat bubbles); other keyword
+    arguments go to AIGateway.generate.
+    """
+    placeholder = placeholder or st.empty()
+    render = (lambda t: placeholder.markdown(wrap(t), unsafe_allow_html=True)) if wrap else placeholder.markdown
+    render("🤖 _Thinking..._")
+    
+    text, first_token, total, model_name = get_ai_gateway().generate(tool, contents, on_text=lambda t: render(t + "▌"), **kwargs)
+    render(text)
+    return text, first_token, total, model_name
+
+def prepare_screenshot(data, max_edge=None, quality=None):
+    """Shrink an uploaded screenshot before it is sent to Gemini.
+    
+    JPEGs are decoded straight at reduced scale via draft(), uniform borders
+    are cropped, the image is downscaled to `max_edge` and re-encoded as JPEG
+    (or PNG for PNG sources, whichever is smaller). Returns a
+    ({'mime_type', 'data'} blob, stats) pair.
+    """
+    max_edge = max_edge or CONFIG['screenshot_max_edge']
+    quality = quality or CONFIG['screenshot_quality']
+    start = time.perf_counter()
+    
+    image = Image.open(io.BytesIO(data))
+    original_format = image.format
+    original_size = image.size
+    # Only decodes the scale needed (1/2, 1/4, 1/8) - a no-op for PNG
+    image.draft('RGB', (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image)
+    
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    # Crop solid borders matching the top-left pixel (tolerates JPEG noise)
+    gray = image.convert('L')
+    diff = ImageChops.difference(gray, Image.new('L', gray.size, gray.getpixel((0, 0))))
+    bbox = diff.point(lambda p: 255 if p > 16 else 0).getbbox()
+    if bbox and (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) < 0.95 * image.width * image.height:
+        image = image.crop(bbox)
+    
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    
+    candidates = []
+    # Flat UI screenshots often stay smaller as PNG; photos as JPEG
+    for fmt, options in (('JPEG', {'quality': quality, 'optimize': True}), ('PNG', {})):
+        if fmt == 'PNG' and original_format != 'PNG':
+            continue
+        out = io.BytesIO()
+        image.save(out, format=fmt, **options)
+        candidates.append({'mime_type': Image.MIME[fmt], 'data': out.getvalue()})
+    blob = min(candidates, key=lambda c: len(c['data']))
+    if image.size == original_size and len(data) <= len(blob['data']):
+        # Nothing was resized or cropped and re-encoding did not help
+        blob = {'mime_type': Image.MIME.get(original_format, 'image/png'), 'data': data}
+    
+    stats = {
+        'original_bytes': len(data),
+        'bytes': len(blob['data']),
+        'original_size': original_size,
+        'size': image.size,
+        'seconds': time.perf_counter() - start
+    }
+    return blob, stats
+
+def show_ai_timing(first_token, total, cached=False):
+    """Caption with time-to-first-token and total generation time (or a cached badge)"""
+    if cached:
+        st.caption("📦 Cached answer · tick *Bypass cache* for a fresh one")
+    elif first_token is not None:
+        st.caption(f"⚡ First token in {first_token:.2f}s · complete in {total:.1f}s")
+
+AI_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ai_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    tool TEXT,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_ai_cache_last_used ON ai_cache(last_used);
+"""
+
+def ai_cache_key(model_name, parts):
+    """Hash the model name plus normalized prompt text; bytes (images) are hashed by content"""
+    digest = hashlib.sha256(model_name.encode())
+    for part in parts if isinstance(parts, (list, tuple)) else [parts]:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            digest.update(b'\x00img\x00' + hashlib.sha256(part).digest())
+        else:
+            digest.update(b'\x00txt\x00' + ' '.join(str(part).casefold().split()).encode())
+    return digest.hexdigest()
+
+def ai_cache_get(key):
+    """Return a cached response (and bump its LRU position), or None"""
+    now = time.time()
+    try:
+        with closing(get_db('ai_cache', AI_CACHE_SCHEMA)) as conn, conn:
+            row = conn.execute("SELECT response, expires FROM ai_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE ai_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            return row[0]
+    except sqlite3.Error:
+        return None
+
+def ai_cache_put(key, model_name, tool, response, ttl=None):
+    """Store a response, then drop expired rows and evict least-recently-used ones over the cap"""
+    now = time.time()
+    try:
+        with closing(get_db('ai_cache', AI_CACHE_SCHEMA)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, model, tool, response, created, expires, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, model_name, tool, response, now, now + (ttl or CONFIG['ai_cache_ttl']), now)
+            )
+            conn.execute("DELETE FROM ai_cache WHERE expires < ?", (now,))
+            conn.execute(
+                "DELETE FROM ai_cache WHERE key IN (SELECT key FROM ai_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (CONFIG['ai_cache_max_entries'],)
+            )
+    except sqlite3.Error:
+        pass
+
+def ai_generate(contents, tool, cache_parts=None, bypass_cache=False, placeholder=None, wrap=None):
+    """Answer from the persistent cache when possible, otherwise stream from Gemini and store.
+    
+    `cache_parts` replaces `contents` for keying, e.g. raw upload bytes instead of
+    a resized screenshot; `contents` may then be a callable that builds the
+    request only on a cache miss. Returns (text, cached, time_to_first_token, total_time).
+    Answers from the fallback model are not cached, since lookups are keyed by
+    the primary model.
+    """
+    model_name = CONFIG['ai_model']
+    key = ai_cache_key(model_name, contents if cache_parts is None else cache_parts)
+    if not bypass_cache:
+        cached = ai_cache_get(key)
+        if cached is not None:
+            placeholder = placeholder or st.empty()
+            placeholder.markdown(wrap(cached) if wrap else cached, unsafe_allow_html=bool(wrap))
+            return cached, True, None, 0.0
+    
+    if callable(contents):
+        contents = contents()
+    text, first_token, total, answered_by = stream_ai_response(contents, tool, placeholder, wrap)
+    if text and answered_by == model_name:
+        ai_cache_put(key, model_name, tool, text)
+    return text, False, first_token, total
+
+CHAT_SYSTEM_INSTRUCTION = """You are a technical support assistant for a web hosting company. 
+Provide clear, helpful, step-by-step answers about:
+- cPanel and web hosting
+- DNS configuration and troubleshooting
+- Email setup and issues
+- Domain management
+- SSL certificates
+- Website errors (500, 403, 404, etc.)
+- Database connections
+- FTP access
+
+Always be specific, provide commands when relevant, and explain technical terms."""
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) without an API round trip"""
+    return len(text) // 4 + 1
+
+def build_chat_history(messages, summary, budget=None):
+    """Convert stored messages to Gemini chat history, newest first until the token budget is spent.
+    
+    The running summary (if any) leads the history as a user/model exchange so
+    older context survives without resending every turn.
+    """
+    budget = budget or CONFIG['chat_token_budget']
+    history = []
+    used = estimate_tokens(summary) if summary else 0
+    for msg in reversed(messages):
+        used += estimate_tokens(msg['content'])
+        if used > budget and history:
+            break
+        history.append({'role': 'user' if msg['role'] == 'user' else 'model', 'parts': [msg['content']]})
+    history.reverse()
+    # Gemini expects the history to open with a user turn
+    while history and history[0]['role'] != 'user':
+        history.pop(0)
+    if summary:
+        history[:0] = [
+            {'role': 'user', 'parts': [f"Summary of our conversation so far:\n{summary}"]},
+            {'role': 'model', 'parts': ["Got it, I'll keep that context in mind."]}
+        ]
+    return history
+
+def fold_chat_history(messages, summary, start, budget=None):
+    """Fold the oldest unsummarized turns into the running summary once they exceed the budget.
+    
+    Folds down to half the budget so summarization runs every few turns rather
+    than on each one. Returns (summary, new_start); unchanged if no fold is due
+    or the summary call fails.
+    """
+    budget = budget or CONFIG['chat_token_budget']
+    pending = messages[start:]
+    total = sum(estimate_tokens(m['content']) for m in pending)
+    if total <= budget:
+        return summary, start
+    
+    cut = 0
+    keep = CONFIG['chat_keep_messages']
+    while total > budget // 2 and len(pending) - cut > keep:
+        total -= estimate_tokens(pending[cut]['content'])
+        cut += 1
+    # Fold whole exchanges so the kept history still opens with a user turn
+    while cut < len(pending) and pending[cut]['role'] != 'user':
+        cut += 1
+    if cut == 0:
+        return summary, start
+    
+    transcript = "\n".join(
+        f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in pending[:cut]
+    )
+    prompt = f"""Update the running summary of a hosting support conversation.
+Keep it under 200 words. Preserve domains, error messages, commands already tried and decisions made.
+
+Current summary:
+{summary or "(none)"}
+
+New turns:
+{transcript}
+
+Updated summary:"""
+    try:
+        text, _, _, _ = get_ai_gateway().generate("💬 AI Support Chat", prompt)
+        return text.strip(), start + cut
+    except Exception:
+        return summary, start
+
+# --- Batch Ticket Triage
+TRIAGE_SEVERITIES = ['Critical', 'High', 'Medium', 'Low']
+TRIAGE_CATEGORIES = ['Email', 'Domain & DNS', 'Website', 'SSL', 'Database', 'FTP', 'Billing', 'Account', 'Other']
+TRIAGE_TEXT_COLUMNS = ('subject', 'title', 'description', 'body', 'message', 'content', 'ticket', 'text')
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly to stay under a per-minute rate"""
+    
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(0.0, slot - now))
+
+def triage_ticket(text, limiter=None):
+    """Classify one ticket with Gemini; returns a dict with category, severity, summary and tools.
+    
+    Results are stored in the persistent AI cache, so re-running a batch only
+    calls Gemini for tickets it has not seen. Fallback-model answers are not cached.
+    """
+    tool_names = sorted({t for info in TOOL_CATEGORIES.values() for t in info['tools']})
+    prompt = f"""Triage this web hosting support ticket. Reply with JSON only:
+{{"category": one of {json.dumps(TRIAGE_CATEGORIES)},
+ "severity": one of {json.dumps(TRIAGE_SEVERITIES)},
+ "summary": one sentence,
+ "tools": up to 3 names from {json.dumps(tool_names, ensure_ascii=False)}}}
+
+Ticket:
+{text}"""
+    
+    key = ai_cache_key(CONFIG['ai_model'], prompt)
+    raw = ai_cache_get(key)
+    answered_by = None
+    if raw is None:
+        raw, _, _, answered_by = get_ai_gateway().generate(
+            "📋 Batch Ticket Triage", prompt, json_output=True,
+            throttle=limiter.wait if limiter else None
+        )
+    
+    result = json.loads(raw)
+    if answered_by == CONFIG['ai_model']:
+        ai_cache_put(key, answered_by, "📋 Batch Ticket Triage", raw)
+    return {
+        'category': result.get('category') if result.get('category') in TRIAGE_CATEGORIES else 'Other',
+        'severity': result.get('severity') if result.get('severity') in TRIAGE_SEVERITIES else 'Medium',
+        'summary': str(result.get('summary', '')).strip(),
+        'tools': ", ".join(t for t in result.get('tools', []) if t in tool_names)
+    }
+
+def unique_ticket_ids(ids):
+    """Make ticket ids usable as keys: blanks become "row N", repeats get a " (2)", " (3)" suffix"""
+    used, unique = set(), []
+    for row, tid in enumerate(ids, 1):
+        base = str(tid).strip() or f"row {row}"
+        candidate, n = base, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{base} ({n})"
+        used.add(candidate)
+        unique.append(candidate)
+    return unique
+
+def run_ticket_triage(tickets, results, on_result=None, workers=None, per_minute=None):
+    """Triage {ticket_id: text} concurrently, skipping ids already triaged successfully.
+    
+    `results` (e.g. a session_state dict) is filled in place as tickets
+    finish, so an interrupted run resumes where it stopped and failed tickets
+    are retried. `on_result` is called from the calling thread after each
+    completion.
+    """
+    pending = {tid: text for tid, text in tickets.items() if results.get(tid, {}).get('status') != '✅'}
+    if not pending:
+        return
+    limiter = RateLimiter(per_minute or CONFIG['triage_per_minute'])
+    
+    with ThreadPoolExecutor(max_workers=workers or CONFIG['triage_workers']) as executor:
+        futures = {executor.submit(triage_ticket, text, limiter): tid for tid, text in pending.items()}
+        try:
+            for future in as_completed(futures):
+                tid = futures[future]
+                try:
+                    results[tid] = {**future.result(), 'status': '✅'}
+                except Exception as e:
+                    results[tid] = {'category': '', 'severity': '', 'summary': str(e)[:200], 'tools': '', 'status': '❌'}
+                if on_result:
+                    on_result(tid)
+        finally:
+            # Script rerun (StopException) or error: drop queued tickets, keep finished ones
+            for future in futures:
+                future.cancel()
+
+
+# ============================================================================
+# SINGLE-PAGE NAVIGATION RENDERER
+# ============================================================================
+def _sanitize_key(s: str) -> str:
+    """Return a safe key fragment for Streamlit widget keys"""
+    return re.sub(r'\W+', '_', s).strip('_')
+
+def render_all_categories_and_tools():
+    """Render a single page with all categories and their tools (grid of buttons)"""
+    tool_count = len({t for info in TOOL_CATEGORIES.values() for t in info['tools']})
+    
+    # HEADER
+    # ---------------------------------------------------
+    st.markdown(f"""
+        <style>
+        .centered-header {{
+            text-align: center;
+            margin: 1rem 0 2rem 0;
+            padding: 0 1rem;
+        }}
+        
+        .centered-header h1 {{
+            font-size: 2rem;
+            font-weight: 700;
+            color: #0F1724;
+            margin-bottom: 0.5rem;
+            letter-spacing: -0.02em;
+        }}
+        
+        .centered-header h3 {{
+            font-size: 1.1rem;
+            font-weight: 400;
+            color: #586069;
+            margin-bottom: 1rem;
+            margin-top: 0;
+        }}
+        
+        .centered-header .tools-badge {{
+            display: inline-block;
+            background: linear-gradient(90deg, #0078D4 0%, #2B88D8 100%);
+            color: white;
+            padding: 0.6rem 1.5rem;
+            border-radius: 8px;
+            font-size: 0.95rem;
+            font-weight: 700;
+            box-shadow: 0 4px 12px rgba(0, 120, 212, 0.2);
+            margin-bottom: 1.5rem;
+            transition: transform 180ms ease, box-shadow 180ms ease;
+        }}
+        
+        .centered-header .tools-badge:hover {{
+            transform: translateY(-2px);
+            box-shadow: 0 6px 16px rgba(0, 120, 212, 0.25);
+        }}
+        
+        .centered-header hr {{
+            margin: 1.5rem auto;
+            max-width: 80%;
+            border: none;
+            border-top: 1px solid rgba(0, 0, 0, 0.08);
+        }}
+        </style>
+        
+        <div class="centered-header">
+            <h1>🏠 Welcome to Support Buddy</h1>
+            <h3>Your Complete Technical Support Toolkit.</h3>
+            <div class="tools-badge">📊 {tool_count} tools available</div>
+            <hr>
+        </div>
+    """, unsafe_allow_html=True)
+
+    query = st.text_input(
+        "🔎 Jump to a tool or help article",
+        placeholder="e.g., dnssec, bounce, sertificate, ns change",
+        key="home_search"
+    )
+    if query.strip():
+        start = time.perf_counter()
+        results = get_search_index().search(query, limit=8)
+        elapsed = (time.perf_counter() - start) * 1000
+        if results:
+            st.caption(f"{len(results)} match(es) in {elapsed:.2f} ms")
+            cols = st.columns(4)
+            for i, result in enumerate(results):
+                with cols[i % 4]:
+                    if result['kind'] == 'tool':
+                        if st.button(result['tool'], key=f"search_hit_{i}", help=result['category'], use_container_width=True):
+                            st.session_state.selected_tool = result['tool']
+                            st.rerun()
+                    elif result['url']:
+                        st.link_button(f"📖 {result['title']}", result['url'], use_container_width=True)
+                    elif st.button(f"📖 {result['title']}", key=f"search_hit_{i}", use_container_width=True):
+                        # Local articles have no page of their own; open them in the Help Center
+                        st.session_state.kb_search = result['title']
+                        st.session_state.selected_tool = "📚 Help Center"
+                        st.rerun()
+        else:
+            st.info("💡 No matching tools or articles - browse the categories below.")
+        st.markdown("---")
+
+    for category_name, category_info in TOOL_CATEGORIES.items():
+        icon = category_info.get('icon', '')
+        description = category_info.get('description', '')
+        color = category_info.get('color', None)
+
+        # Category header
+        st.markdown(f"## {icon} {category_name}")
+        if description:
+            st.caption(description)
+
+        tools = category_info.get('tools', [])
+        num_cols = 4
+
+        # Render tools in rows of num_cols
+        for row_start in range(0, len(tools), num_cols):
+            cols = st.columns(num_cols)
             for i in range(num_cols):
                 tool_idx = row_start + i
                 if tool_idx < len(tools):
@@ -1169,6 +5127,10 @@ def render_all_categories_and_tools():
 # ============================================================================
 # MAIN APP ROUTING (SINGLE-STATE: selected_tool only)
 # ============================================================================
+# Persist pending note edits once the agent leaves the notes page
+if st.session_state.selected_tool != "📝 Session Notes":
+    flush_session_notes(force=True)
+
 if st.session_state.selected_tool is None:
     # Show all categories with their tools on a single page
     render_all_categories_and_tools()
@@ -1300,13 +5262,12 @@ else:
         else:
             uploaded_file = st.file_uploader("Upload Screenshot:", type=['png', 'jpg', 'jpeg'])
             ticket_text = st.text_area("Or paste ticket text:", height=200, placeholder="Customer is experiencing...")
+            bypass_cache = st.checkbox("🔄 Bypass cache", help="Ask Gemini again even if this ticket was analyzed before")
             
             if st.button("🔍 Analyze Ticket", type="primary"):
                 if uploaded_file or ticket_text:
-                    with st.spinner("🤖 Analyzing ticket..."):
-                        try:
-                            model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                            prompt = """Analyze this support ticket and provide:
+                    try:
+                        prompt = """Analyze this support ticket and provide:
                             
 1. **Issue Summary**: Brief description of the problem
 2. **Category**: Type of issue (Email, Domain, Website, etc.)
@@ -1319,21 +5280,138 @@ else:
 9. **Potential Solutions**: Likely fixes
 
 Be specific and actionable."""
+                        
+                        cache_parts = None
+                        prepared = {}
+                        if uploaded_file:
+                            raw = uploaded_file.getvalue()
                             
-                            if uploaded_file:
-                                image = Image.open(uploaded_file)
-                                response = model.generate_content([prompt, image])
-                            else:
-                                response = model.generate_content(f"{prompt}\n\nTicket Content:\n{ticket_text}")
-                            
-                            st.markdown("### 🤖 AI Analysis:")
-                            st.markdown(response.text)
-                            
-                        except Exception as e:
-                            st.error(f"❌ Analysis failed: {str(e)}")
+                            def contents():
+                                # Only resize when the cache misses
+                                blob, prepared['shot'] = prepare_screenshot(raw)
+                                return [prompt, blob]
+                            # Screenshots are cached by the uploaded file's hash, not the resized copy
+                            cache_parts = [prompt, raw]
+                        else:
+                            contents = f"{prompt}\n\nTicket Content:\n{ticket_text}"
+                        
+                        st.markdown("### 🤖 AI Analysis:")
+                        _, cached, first_token, total = ai_generate(contents, tool, cache_parts, bypass_cache)
+                        show_ai_timing(first_token, total, cached)
+                        shot = prepared.get('shot')
+                        if shot:
+                            change = (shot['bytes'] - shot['original_bytes']) / shot['original_bytes']
+                            st.caption(
+                                f"🖼️ Screenshot {shot['original_size'][0]}×{shot['original_size'][1]} → {shot['size'][0]}×{shot['size'][1]}, "
+                                f"{shot['original_bytes'] / 1024:.0f} KB → {shot['bytes'] / 1024:.0f} KB "
+                                f"({change:+.0%}) · prepared in {shot['seconds'] * 1000:.0f} ms · "
+                                f"end-to-end {shot['seconds'] + total:.1f}s"
+                            )
+                        
+                    except Exception as e:
+                        st.error(f"❌ Analysis failed: {str(e)}")
                 else:
                     st.warning("⚠️ Please provide either a screenshot or ticket text")
  
+    elif tool == "📋 Batch Ticket Triage":
+        st.title("📋 Batch Ticket Triage")
+        st.markdown("Classify a CSV export of tickets by category and severity with suggested tools")
+        
+        if not GEMINI_AVAILABLE:
+            st.error("⚠️ AI features require Gemini API key configuration")
+            st.info("Contact your administrator to enable AI features")
+        else:
+            uploaded_file = st.file_uploader("Upload tickets CSV:", type=['csv'])
+            
+            if uploaded_file:
+                try:
+                    tickets_df = pd.read_csv(uploaded_file, dtype=str).fillna("")
+                except Exception as e:
+                    st.error(f"❌ Could not read CSV: {str(e)}")
+                    tickets_df = None
+                
+                if tickets_df is not None and not tickets_df.empty:
+                    columns = list(tickets_df.columns)
+                    default_text = [c for c in columns if c.strip().lower() in TRIAGE_TEXT_COLUMNS] or columns[-1:]
+                    id_guess = next((c for c in columns if c.strip().lower() in ('id', 'ticket id', 'ticket_id', 'ticket #', 'number')), None)
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        text_columns = st.multiselect("Ticket text columns:", columns, default=default_text)
+                    with col2:
+                        id_column = st.selectbox("Ticket ID column:", ["(row number)"] + columns, index=columns.index(id_guess) + 1 if id_guess else 0)
+                    
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        workers = st.slider("Concurrent requests:", 1, 16, CONFIG['triage_workers'])
+                    with col2:
+                        per_minute = st.slider("Rate limit (requests/min):", 5, 300, CONFIG['triage_per_minute'], step=5)
+                    
+                    if len(tickets_df) > CONFIG['triage_max_rows']:
+                        st.warning(f"⚠️ Only the first {CONFIG['triage_max_rows']} of {len(tickets_df)} tickets will be triaged")
+                        tickets_df = tickets_df.head(CONFIG['triage_max_rows'])
+                    
+                    ids = unique_ticket_ids(tickets_df[id_column] if id_column != "(row number)" else range(1, len(tickets_df) + 1))
+                    tickets = {
+                        tid: "\n".join(f"{c}: {row[c]}" for c in text_columns if row[c])
+                        for tid, (_, row) in zip(ids, tickets_df.iterrows())
+                    }
+                    tickets = {tid: text for tid, text in tickets.items() if text}
+                    
+                    # Results survive reruns; a new file starts a new batch
+                    batch_key = hashlib.sha256(uploaded_file.getvalue()).hexdigest() + "|" + ",".join(text_columns) + "|" + id_column
+                    if st.session_state.get('triage_batch') != batch_key:
+                        st.session_state.triage_batch = batch_key
+                        st.session_state.triage_results = {}
+                    results = st.session_state.triage_results
+                    
+                    remaining = sum(1 for tid in tickets if results.get(tid, {}).get('status') != '✅')
+                    label = "📋 Triage Tickets" if not results else f"▶️ Resume ({remaining} remaining)"
+                    run = st.button(label, type="primary", disabled=not text_columns or remaining == 0)
+                    
+                    progress_bar = st.progress(0.0)
+                    table = st.empty()
+                    
+                    def render_results():
+                        rows = [{'Ticket': tid, **{k.title(): v for k, v in results[tid].items()}} for tid in tickets if tid in results]
+                        if not rows:
+                            return None
+                        df = pd.DataFrame(rows)[['Ticket', 'Status', 'Severity', 'Category', 'Summary', 'Tools']]
+                        df['Severity'] = pd.Categorical(df['Severity'], categories=TRIAGE_SEVERITIES + [''], ordered=True)
+                        df = df.sort_values(['Severity', 'Category'], kind='stable')
+                        table.dataframe(df, use_container_width=True, hide_index=True)
+                        progress_bar.progress(len(rows) / len(tickets), text=f"{len(rows)}/{len(tickets)} tickets triaged")
+                        return df
+                    
+                    df = render_results()
+                    
+                    if run:
+                        last_render = [0.0]
+                        def on_result(_tid):
+                            # Redrawing a large table on every completion is the bottleneck; cap at ~4/s
+                            if time.monotonic() - last_render[0] > 0.25:
+                                last_render[0] = time.monotonic()
+                                render_results()
+                        
+                        start = time.perf_counter()
+                        run_ticket_triage(tickets, results, on_result, workers, per_minute)
+                        df = render_results()
+                        st.success(f"✅ Triaged {len(tickets)} tickets in {time.perf_counter() - start:.1f}s")
+                    
+                    if df is not None:
+                        counts = df['Severity'].value_counts()
+                        cols = st.columns(len(TRIAGE_SEVERITIES))
+                        for col, severity in zip(cols, TRIAGE_SEVERITIES):
+                            col.metric(severity, int(counts.get(severity, 0)))
+                        st.download_button(
+                            "📥 Download Results (CSV)",
+                            df.to_csv(index=False),
+                            file_name="ticket_triage.csv",
+                            mime="text/csv"
+                        )
+                elif tickets_df is not None:
+                    st.warning("⚠️ The CSV has no rows")
+
     elif tool == "🩺 Smart Symptom Checker":
         st.title("🩺 Smart Symptom Checker")
         st.markdown("Diagnose issues based on symptoms")
@@ -1349,13 +5427,12 @@ Be specific and actionable."""
                 service = st.selectbox("Service Type:", ["Website", "Email", "Domain", "Database", "FTP", "SSL", "DNS", "Other"])
             with col2:
                 when = st.selectbox("When started:", ["Just now", "Today", "Yesterday", "This week", "Over a week ago", "Unknown"])
+            bypass_cache = st.checkbox("🔄 Bypass cache", help="Ask Gemini again even if this was diagnosed before")
             
             if st.button("🩺 Diagnose Issue", type="primary"):
                 if symptom:
-                    with st.spinner("🤖 Diagnosing..."):
-                        try:
-                            model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                            prompt = f"""Diagnose this technical support issue:
+                    try:
+                        prompt = f"""Diagnose this technical support issue:
 
 **Symptoms**: {symptom}
 **Service Type**: {service}
@@ -1372,14 +5449,13 @@ Provide a comprehensive diagnosis with:
 7. **Expected Resolution Time**
 
 Be specific, technical, and actionable."""
-                            
-                            response = model.generate_content(prompt)
-                            
-                            st.markdown("### 🩺 Diagnosis Results:")
-                            st.markdown(response.text)
-                            
-                        except Exception as e:
-                            st.error(f"❌ Diagnosis failed: {str(e)}")
+                        
+                        st.markdown("### 🩺 Diagnosis Results:")
+                        _, cached, first_token, total = ai_generate(prompt, tool, bypass_cache=bypass_cache)
+                        show_ai_timing(first_token, total, cached)
+                        
+                    except Exception as e:
+                        st.error(f"❌ Diagnosis failed: {str(e)}")
                 else:
                     st.warning("⚠️ Please describe the symptoms")
 
@@ -1392,55 +5468,66 @@ Be specific, technical, and actionable."""
             st.error("⚠️ AI features require Gemini API key configuration")
             st.info("Contact your administrator to enable AI features")
         else:
-            # Display chat history
-            for msg in st.session_state.chat_history:
-                if msg['role'] == 'user':
-                    st.markdown(f'<div class="info-box">👤 **You:** {msg["content"]}</div>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<div class="success-box">🤖 **Assistant:** {msg["content"]}</div>', unsafe_allow_html=True)
+            # Display chat history; new turns are appended to this container in place
+            history_box = st.container()
+            with history_box:
+                for msg in st.session_state.chat_history:
+                    if msg['role'] == 'user':
+                        st.markdown(f'<div class="info-box">👤 **You:** {msg["content"]}</div>', unsafe_allow_html=True)
+                    else:
+                        st.markdown(f'<div class="success-box">🤖 **Assistant:** {msg["content"]}</div>', unsafe_allow_html=True)
             
             # Chat input
             user_input = st.text_area("Ask a question:", placeholder="How do I check if DNS is propagated?", key="chat_input")
             
             col1, col2 = st.columns([1, 4])
             with col1:
-                if st.button("💬 Send", type="primary"):
-                    if user_input:
-                        st.session_state.chat_history.append({'role': 'user', 'content': user_input})
-                        
-                        with st.spinner("🤖 Thinking..."):
-                            try:
-                                model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                                
-                                context = """You are a technical support assistant for a web hosting company. 
-                                Provide clear, helpful, step-by-step answers about:
-                                - cPanel and web hosting
-                                - DNS configuration and troubleshooting
-                                - Email setup and issues
-                                - Domain management
-                                - SSL certificates
-                                - Website errors (500, 403, 404, etc.)
-                                - Database connections
-                                - FTP access
-                                
-                                Always be specific, provide commands when relevant, and explain technical terms."""
-                                
-                                conversation = context + "\n\n" + "\n".join([
-                                    f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" 
-                                    for m in st.session_state.chat_history[-10:]
-                                ])
-                                
-                                response = model.generate_content(conversation)
-                                st.session_state.chat_history.append({'role': 'assistant', 'content': response.text})
-                                st.rerun()
-                                
-                            except Exception as e:
-                                st.error(f"❌ Error: {str(e)}")
+                send = st.button("💬 Send", type="primary")
             
             with col2:
                 if st.button("🗑️ Clear Chat"):
                     st.session_state.chat_history = []
+                    st.session_state.chat_summary = ""
+                    st.session_state.chat_summarized = 0
                     st.rerun()
+            
+            if send and user_input:
+                st.session_state.chat_history.append({'role': 'user', 'content': user_input})
+                
+                try:
+                    # Prior turns go in as native chat history; the new message is sent on its own
+                    history = build_chat_history(
+                        st.session_state.chat_history[st.session_state.chat_summarized:-1],
+                        st.session_state.chat_summary
+                    )
+                    
+                    with history_box:
+                        st.markdown(f'<div class="info-box">👤 **You:** {user_input}</div>', unsafe_allow_html=True)
+                        answer, first_token, total, _ = stream_ai_response(
+                            user_input,
+                            tool,
+                            wrap=lambda t: f'<div class="success-box">🤖 **Assistant:** {t}</div>',
+                            system_instruction=CHAT_SYSTEM_INSTRUCTION,
+                            history=history
+                        )
+                        show_ai_timing(first_token, total)
+                    st.session_state.chat_history.append({'role': 'assistant', 'content': answer})
+                    
+                    st.session_state.chat_summary, st.session_state.chat_summarized = fold_chat_history(
+                        st.session_state.chat_history,
+                        st.session_state.chat_summary,
+                        st.session_state.chat_summarized
+                    )
+                    
+                except Exception as e:
+                    # Drop the unanswered turn so the stored history keeps alternating user/model
+                    if st.session_state.chat_history[-1]['role'] == 'user':
+                        st.session_state.chat_history.pop()
+                    st.error(f"❌ Error: {str(e)}")
+            
+            if st.session_state.chat_summary:
+                with st.expander(f"🧠 Conversation memory ({st.session_state.chat_summarized} earlier messages summarized)"):
+                    st.markdown(st.session_state.chat_summary)
 
     elif tool == "📧 AI Mail Error Assistant":
         st.title("📧 AI Mail Error Assistant")
@@ -1451,13 +5538,12 @@ Be specific, technical, and actionable."""
             st.info("Contact your administrator to enable AI features")
         else:
             error_msg = st.text_area("Email Error Message:", height=200, placeholder="550 5.1.1 User unknown...")
+            bypass_cache = st.checkbox("🔄 Bypass cache", help="Ask Gemini again even if this error was analyzed before")
             
             if st.button("🔍 Analyze Error", type="primary"):
                 if error_msg:
-                    with st.spinner("🤖 Analyzing error..."):
-                        try:
-                            model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                            prompt = f"""Analyze this email error message:
+                    try:
+                        prompt = f"""Analyze this email error message:
 
 {error_msg}
 
@@ -1471,14 +5557,13 @@ Provide:
 6. **Related Tools**: Which Support Buddy tools can help diagnose/fix this
 
 Be specific about server settings, DNS records, and authentication methods."""
-                            
-                            response = model.generate_content(prompt)
-                            
-                            st.markdown("### 🤖 Error Analysis:")
-                            st.markdown(response.text)
-                            
-                        except Exception as e:
-                            st.error(f"❌ Analysis failed: {str(e)}")
+                        
+                        st.markdown("### 🤖 Error Analysis:")
+                        _, cached, first_token, total = ai_generate(prompt, tool, bypass_cache=bypass_cache)
+                        show_ai_timing(first_token, total, cached)
+                        
+                    except Exception as e:
+                        st.error(f"❌ Analysis failed: {str(e)}")
                 else:
                     st.warning("⚠️ Please paste an error message")
 
@@ -1486,18 +5571,38 @@ Be specific about server settings, DNS records, and authentication methods."""
         st.title("❓ Error Code Explainer")
         st.markdown("Get detailed explanations for error codes")
         
-        if not GEMINI_AVAILABLE:
-            st.error("⚠️ AI features require Gemini API key configuration")
-            st.info("Contact your administrator to enable AI features")
-        else:
-            error_code = st.text_input("Error Code:", placeholder="500 Internal Server Error")
-            context = st.text_area("Context (optional):", height=100, placeholder="User was uploading a file...")
-            
-            if st.button("🔍 Explain Error", type="primary"):
-                if error_code:
-                    with st.spinner("🤖 Looking up error..."):
+        error_code = st.text_input("Error Code:", placeholder="500 Internal Server Error")
+        context = st.text_area("Context (optional):", height=100, placeholder="User was uploading a file...")
+        col1, col2 = st.columns(2)
+        with col1:
+            more_detail = st.checkbox("🤖 Ask AI for more detail", help="Also get a full AI explanation when the local knowledge base has a match")
+        with col2:
+            bypass_cache = st.checkbox("🔄 Bypass cache", help="Ask Gemini again even if this code was explained before")
+        
+        if st.button("🔍 Explain Error", type="primary"):
+            if error_code:
+                start = time.perf_counter()
+                matches = lookup_error_code(error_code)
+                elapsed = (time.perf_counter() - start) * 1000
+                
+                if matches:
+                    st.markdown("### 📚 Knowledge Base:")
+                    for entry in matches:
+                        codes = ", ".join(entry['codes'])
+                        st.markdown(f'<div class="info-box"><strong>{entry["kind"]}{" " + codes if codes else ""} — {entry["title"]}</strong><br>{entry["meaning"]}</div>', unsafe_allow_html=True)
+                        if entry['causes']:
+                            st.markdown(f"**Common Causes:** {entry['causes']}")
+                        if entry['fix']:
+                            st.markdown(f"**How to Fix:** {entry['fix']}")
+                    st.caption(f"⚡ Local match ({matches[0]['match']}) in {elapsed:.2f} ms")
+                
+                if not matches or more_detail:
+                    if not GEMINI_AVAILABLE:
+                        if not matches:
+                            st.warning("⚠️ No match in the local knowledge base")
+                        st.info("💡 AI explanations require Gemini API key configuration")
+                    else:
                         try:
-                            model = genai.GenerativeModel('gemini-2.5-flash-lite')
                             prompt = f"""Explain this error code: {error_code}
 {f"Context: {context}" if context else ""}
 
@@ -1512,17 +5617,71 @@ Provide:
 
 Be specific about web hosting environments, cPanel, and common server configurations."""
                             
-                            response = model.generate_content(prompt)
-                            
                             st.markdown("### 🤖 Error Explanation:")
-                            st.markdown(response.text)
+                            _, cached, first_token, total = ai_generate(prompt, tool, bypass_cache=bypass_cache)
+                            show_ai_timing(first_token, total, cached)
                             
                         except Exception as e:
                             st.error(f"❌ Lookup failed: {str(e)}")
+            else:
+                st.warning("⚠️ Please enter an error code")
+
+    # DOMAIN & DNS TOOLS
+    elif tool == "🏥 Domain Health Report":
+        st.title("🏥 Domain Health Report")
+        st.markdown("One-click DNS, web, SSL and mail health overview")
+        
+        domain = st.text_input("Domain:", placeholder="example.com")
+        
+        if st.button("🏥 Run Health Check", type="primary"):
+            if not domain:
+                st.warning("⚠️ Please enter a domain name")
+            else:
+                valid, result = validate_domain(domain)
+                if not valid:
+                    st.error(f"❌ {result}")
+                elif not DNS_AVAILABLE:
+                    show_missing_dependency("Domain Health Report", "dnspython")
                 else:
-                    st.warning("⚠️ Please enter an error code")
+                    domain = result.lower()
+                    checks = build_domain_health_checks(domain)
+                    
+                    # One row per check, filled in as the graph completes
+                    rows = {}
+                    for name in checks:
+                        rows[name] = st.empty()
+                        rows[name].markdown(f"⏳ **{HEALTH_CHECK_LABELS[name]}** — checking...")
+                    
+                    def show_check(name, check):
+                        rows[name].markdown(
+                            f"{HEALTH_STATUS_ICONS[check['status']]} **{HEALTH_CHECK_LABELS[name]}** — "
+                            f"{check['summary']} `{check['ms']} ms`"
+                        )
+                    
+                    start = time.perf_counter()
+                    results = run_check_graph(checks, show_check)
+                    elapsed = time.perf_counter() - start
+                    
+                    st.markdown("---")
+                    counts = {status: sum(1 for r in results.values() if r['status'] == status) for status in HEALTH_STATUS_ICONS}
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("Passed", counts['ok'])
+                    with col2:
+                        st.metric("Warnings", counts['warn'])
+                    with col3:
+                        st.metric("Failed", counts['fail'])
+                    with col4:
+                        st.metric("Total Time", f"{elapsed:.1f}s")
+                    
+                    if counts['fail']:
+                        st.error(f"❌ {counts['fail']} check(s) failed - see the rows above")
+                    elif counts['warn']:
+                        st.warning(f"⚠️ Healthy with {counts['warn']} warning(s)")
+                    else:
+                        st.success("✅ All checks passed")
+                    st.caption(f"⚡ Sum of check times {sum(r['ms'] for r in results.values()) / 1000:.1f}s, completed in {elapsed:.1f}s by running independent checks in parallel")
 
-    # DOMAIN & DNS TOOLS
     elif tool == "🔍 Domain Status Check":
         st.title("🔍 Domain Status Check")
         st.markdown("Check domain registration status and key DNS records")
@@ -1671,6 +5830,44 @@ Be specific about web hosting environments, cPanel, and common server configurat
                                 else:
                                     st.error(f"❌ {result['data']}")
                                 st.markdown("---")
+        
+        st.markdown("---")
+        st.markdown("### 📋 Bulk Lookup")
+        bulk_text = st.text_area(
+            "Domains (one per line):",
+            height=150,
+            key="bulk_dns_input",
+            placeholder="example.com\nexample.org"
+        )
+        
+        if st.button("🔍 Look Up All", key="bulk_dns_run"):
+            domains, truncated = parse_bulk_items(bulk_text)
+            checked = [validate_domain(d) for d in domains]
+            invalid = [d for d, (valid, _) in zip(domains, checked) if not valid]
+            domains = [result for valid, result in checked if valid]
+            if not domains:
+                st.warning("⚠️ Please enter at least one valid domain")
+            elif not DNS_AVAILABLE:
+                show_missing_dependency("DNS Analysis", "dnspython")
+            else:
+                if truncated:
+                    st.warning(f"⚠️ Only the first {CONFIG['bulk_max_items']} entries are checked")
+                if invalid:
+                    st.warning(f"⚠️ Skipped invalid entries: {', '.join(invalid[:10])}")
+                with st.spinner(f"Resolving {len(domains)} domains..."):
+                    answers = resolve_dns_many([(d, t) for d in domains for t in record_types])
+                rows = [
+                    {'Domain': d, **{t: ', '.join(answers[(d, t)][0]) or answers[(d, t)][1] or '—' for t in record_types}}
+                    for d in domains
+                ]
+                df = pd.DataFrame(rows)
+                st.dataframe(df, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📥 Download CSV",
+                    df.to_csv(index=False),
+                    f"bulk_dns_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    "text/csv"
+                )
 
     elif tool == "📋 NS Authority Checker":
         st.title("📋 NS Authority Checker")
@@ -1942,11 +6139,71 @@ Be specific about web hosting environments, cPanel, and common server configurat
                         except Exception as e:
                             st.error(f"❌ Connection failed: {str(e)}")
 
+    elif tool == "📡 Mail Port Matrix":
+        st.title("📡 Mail Port Matrix")
+        st.markdown("Probe every mail port with STARTTLS and implicit TLS at once")
+        
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            mail_host = st.text_input("Mail Server:", placeholder="mail.example.com")
+        with col2:
+            probe_timeout = st.number_input("Timeout (s):", value=CONFIG['mail_probe_timeout'], min_value=2, max_value=30)
+        
+        if st.button("📡 Probe Ports", type="primary"):
+            if not mail_host:
+                st.warning("⚠️ Please enter a mail server hostname")
+            else:
+                valid, result = validate_domain(mail_host)
+                if not valid:
+                    st.error(f"❌ {result}")
+                else:
+                    mail_host = result
+                    
+                    with st.spinner(f"Probing {len(MAIL_PORTS) * 2} port/mode combinations on {mail_host}..."):
+                        start = time.perf_counter()
+                        rows = run_mail_port_matrix(mail_host, probe_timeout)
+                        elapsed = time.perf_counter() - start
+                    
+                    df = pd.DataFrame(rows).sort_values(['Port', 'Mode'])
+                    df['Cell'] = df.apply(summarize_mail_matrix_cell, axis=1)
+                    grid = df.pivot(index=['Port', 'Service'], columns='Mode', values='Cell').reset_index()
+                    grid = grid.set_index('Port').loc[[p[0] for p in MAIL_PORTS]].reset_index()
+                    
+                    working = df[(df['Cert Name Match'] == '✅')]
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Ports Reachable", f"{df[df['Reachable'] == '✅']['Port'].nunique()}/{len(MAIL_PORTS)}")
+                    with col2:
+                        st.metric("Working TLS Combos", len(working))
+                    with col3:
+                        st.metric("Total Time", f"{elapsed:.1f}s")
+                    
+                    st.markdown("### 🔢 Port / TLS Matrix")
+                    st.dataframe(grid, use_container_width=True, hide_index=True)
+                    st.caption("✅ trusted certificate matching the hostname · ❌ hostname mismatch · ⚠️ untrusted chain · 🔌 port open but no TLS in this mode")
+                    
+                    st.markdown("### 💡 Recommended Client Settings")
+                    for protocol, label in [('imap', 'IMAP'), ('pop3', 'POP3'), ('smtp', 'SMTP')]:
+                        ports = [p[0] for p in MAIL_PORTS if p[2] == protocol]
+                        best = working[working['Port'].isin(ports)]
+                        if protocol == 'smtp':
+                            # Port 25 is for server-to-server relay, not client submission
+                            best = best[best['Port'] != 25]
+                        if not best.empty:
+                            pick = best.sort_values('Handshake (ms)').iloc[0]
+                            st.success(f"✅ **{label}:** port {pick['Port']} with {pick['Mode']} ({pick['TLS']})")
+                        else:
+                            st.warning(f"⚠️ **{label}:** no port with a trusted, matching certificate")
+                    
+                    with st.expander("📋 Full Probe Details"):
+                        st.dataframe(df.drop(columns=['Cell']), use_container_width=True, hide_index=True)
+
     elif tool == "🔒 SPF/DKIM Check":
         st.title("🔒 SPF/DKIM/DMARC Check")
         st.markdown("Verify email authentication records")
         
         domain = st.text_input("Domain:", placeholder="example.com")
+        custom_selectors = st.text_input("Extra DKIM selectors (optional):", placeholder="mykey, s2024", help="Comma-separated selectors to probe in addition to the built-in dictionary")
         
         if st.button("🔍 Check Email Authentication", type="primary"):
             if not domain:
@@ -1963,25 +6220,58 @@ Be specific about web hosting environments, cPanel, and common server configurat
                     else:
                         with st.spinner(f"Checking email authentication for {domain}..."):
                             st.markdown("### 🛡️ SPF (Sender Policy Framework)")
-                            success, txt_records = lookup_dns_record(domain, 'TXT')
+                            spf = evaluate_spf(domain)
+                            spf_record = spf['nodes'][0]['record'] if spf['nodes'] else ''
+                            spf_found = bool(spf_record)
                             
-                            spf_found = False
-                            if success:
-                                for record in txt_records:
-                                    if 'v=spf1' in record.lower():
-                                        spf_found = True
-                                        st.success("✅ SPF record found")
-                                        st.code(record)
-                                        
-                                        if 'all' in record:
-                                            if '-all' in record:
-                                                st.success("✅ Hard fail (-all) - strict policy")
-                                            elif '~all' in record:
-                                                st.info("ℹ️ Soft fail (~all) - lenient policy")
-                                            elif '?all' in record:
-                                                st.warning("⚠️ Neutral (?all) - no policy")
-                                            elif '+all' in record:
-                                                st.error("❌ Pass all (+all) - insecure!")
+                            if spf_found:
+                                st.success("✅ SPF record found")
+                                st.code(spf_record)
+                                
+                                if spf['all'] == '-':
+                                    st.success("✅ Hard fail (-all) - strict policy")
+                                elif spf['all'] == '~':
+                                    st.info("ℹ️ Soft fail (~all) - lenient policy")
+                                elif spf['all'] == '?':
+                                    st.warning("⚠️ Neutral (?all) - no policy")
+                                elif spf['all'] == '+':
+                                    st.error("❌ Pass all (+all) - insecure!")
+                                
+                                col1, col2, col3 = st.columns(3)
+                                with col1:
+                                    st.metric("DNS Lookups", f"{spf['lookups']}/{CONFIG['spf_lookup_limit']}")
+                                with col2:
+                                    st.metric("Void Lookups", f"{spf['void_lookups']}/{CONFIG['spf_void_limit']}")
+                                with col3:
+                                    st.metric("Records Expanded", len(spf['nodes']))
+                                
+                                for error in spf['errors']:
+                                    st.error(f"❌ {error}")
+                                for warning in spf['warnings']:
+                                    st.warning(f"⚠️ {warning}")
+                                if not spf['errors']:
+                                    st.success("✅ SPF policy evaluates without errors")
+                                
+                                with st.expander("🌳 SPF Include Tree", expanded=bool(spf['errors'])):
+                                    tree_rows = []
+                                    for node in spf['nodes']:
+                                        tree_rows.append({
+                                            'Record': ('↳ ' * node['depth']) + node['domain'],
+                                            'Via': node['via'] or '(root)',
+                                            'Lookups': sum(t['lookups'] for t in node['terms']),
+                                            'SPF': node['record'] or '❌ missing'
+                                        })
+                                    st.dataframe(pd.DataFrame(tree_rows), use_container_width=True, hide_index=True)
+                                
+                                flattened = flatten_spf(spf)
+                                with st.expander("🧩 Flattened Record"):
+                                    st.caption("A snapshot of all authorized IPs - re-generate it whenever an included provider changes its ranges")
+                                    st.markdown(f"**{domain}**")
+                                    st.code(flattened['_root'])
+                                    for name, value in flattened.items():
+                                        if name != '_root':
+                                            st.markdown(f"**{name}**")
+                                            st.code(value)
                             
                             if not spf_found:
                                 st.error("❌ No SPF record found")
@@ -1990,22 +6280,43 @@ Be specific about web hosting environments, cPanel, and common server configurat
                             st.markdown("---")
                             
                             st.markdown("### 🔑 DKIM (DomainKeys Identified Mail)")
-                            common_selectors = ['default', 'google', 'k1', 'selector1', 'selector2', 'dkim', 'mail']
-                            dkim_found = False
+                            extra = [s.strip() for s in custom_selectors.split(',') if s.strip()]
+                            dkim_keys = discover_dkim_selectors(domain, extra)
+                            dkim_found = bool(dkim_keys)
+                            st.caption(f"Probed {len(dkim_probe_selectors(extra))} known selectors")
                             
-                            for selector in common_selectors:
-                                dkim_domain = f"{selector}._domainkey.{domain}"
-                                success, dkim_records = lookup_dns_record(dkim_domain, 'TXT')
-                                if success:
-                                    for record in dkim_records:
-                                        if 'v=DKIM1' in record or 'p=' in record:
-                                            dkim_found = True
-                                            st.success(f"✅ DKIM record found (selector: {selector})")
-                                            st.code(record[:100] + "..." if len(record) > 100 else record)
+                            if dkim_found:
+                                st.success(f"✅ {len(dkim_keys)} DKIM key(s) found")
+                                dkim_rows = []
+                                for key in dkim_keys:
+                                    if key['revoked']:
+                                        status = "🚫 Revoked (empty p=)"
+                                    elif key['error']:
+                                        status = f"❌ {key['error']}"
+                                    elif key['key_type'] == 'ed25519' or (key['key_bits'] or 0) >= 2048:
+                                        status = "✅ Strong"
+                                    elif (key['key_bits'] or 0) >= 1024:
+                                        status = "⚠️ 1024-bit - upgrade to 2048"
+                                    else:
+                                        status = "❌ Weak key"
+                                    dkim_rows.append({
+                                        'Selector': key['selector'],
+                                        'Likely Provider': key['provider'],
+                                        'Key Type': key['key_type'].upper(),
+                                        'Key Size': f"{key['key_bits']} bits" if key['key_bits'] else 'N/A',
+                                        'Testing Mode': '⚠️ t=y' if key['testing'] else 'No',
+                                        'Status': status
+                                    })
+                                st.dataframe(pd.DataFrame(dkim_rows), use_container_width=True, hide_index=True)
+                                
+                                with st.expander("📜 Raw DKIM Records"):
+                                    for key in dkim_keys:
+                                        st.markdown(f"**{key['selector']}._domainkey.{domain}**")
+                                        st.code(key['record'])
                             
                             if not dkim_found:
-                                st.warning("⚠️ No DKIM records found with common selectors")
-                                st.info("💡 Try checking your email provider's documentation for the correct selector")
+                                st.warning("⚠️ No DKIM records found with known selectors")
+                                st.info("💡 Find the selector in the s= tag of a DKIM-Signature header and add it above")
                             
                             st.markdown("---")
                             
@@ -2059,64 +6370,265 @@ Be specific about web hosting environments, cPanel, and common server configurat
         st.markdown("Analyze email headers to troubleshoot delivery issues")
         
         headers = st.text_area("Paste Email Headers:", height=300, placeholder="Received: from...\nFrom:...\nTo:...")
+        eml_file = st.file_uploader("Or upload a message (.eml):", type=['eml', 'txt'])
+        lookup_hops = st.checkbox("🌍 Look up hop IP locations", value=True)
         
         if st.button("🔍 Analyze Headers", type="primary"):
-            if not headers:
-                st.warning("⚠️ Please paste email headers")
+            if not headers and not eml_file:
+                st.warning("⚠️ Please paste email headers or upload a message")
+            elif not IMAPLIB_AVAILABLE:
+                show_missing_dependency("Email Header Analysis", "built-in (should be available)")
             else:
                 with st.spinner("Analyzing headers..."):
-                    lines = headers.split('\n')
-                    
-                    parsed_headers = {}
-                    current_key = None
-                    current_value = []
-                    
-                    for line in lines:
-                        if ':' in line and not line.startswith((' ', '\t')):
-                            if current_key:
-                                parsed_headers[current_key] = '\n'.join(current_value)
-                            parts = line.split(':', 1)
-                            current_key = parts[0].strip()
-                            current_value = [parts[1].strip()] if len(parts) > 1 else []
-                        elif current_key and line.strip():
-                            current_value.append(line.strip())
+                    # Only the header block is read from uploads; the body is never loaded
+                    raw = read_header_block(eml_file) if eml_file else headers
+                    msg = parse_email_headers(raw)
+                    all_headers = [(k, _header_str(v)) for k, v in msg.items()]
+                    hops = parse_received_hops(msg)
                     
-                    if current_key:
-                        parsed_headers[current_key] = '\n'.join(current_value)
+                    geo = {}
+                    if lookup_hops and hops:
+                        geo = batch_lookup_ips(tuple(h['ip'] for h in hops if h['ip']))
                     
-                    st.success(f"✅ Parsed {len(parsed_headers)} header fields")
+                    st.success(f"✅ Parsed {len(all_headers)} header fields")
                     
                     tab1, tab2, tab3 = st.tabs(["📬 Basic Info", "🔀 Routing", "🔍 All Headers"])
                     
                     with tab1:
                         st.markdown("### Basic Information")
-                        key_headers = ['From', 'To', 'Subject', 'Date', 'Message-ID']
+                        key_headers = ['From', 'To', 'Subject', 'Date', 'Message-ID', 'Return-Path', 'Reply-To']
                         for header in key_headers:
-                            if header in parsed_headers:
-                                st.info(f"**{header}:** {parsed_headers[header]}")
+                            value = msg.get(header)
+                            if value is not None:
+                                st.info(f"**{header}:** {_header_str(value)}")
                     
                     with tab2:
                         st.markdown("### Email Route")
-                        received_headers = [v for k, v in parsed_headers.items() if k.lower() == 'received']
-                        if received_headers:
-                            st.info(f"📍 {len(received_headers)} hop(s) detected")
-                            for i, received in enumerate(reversed(received_headers), 1):
-                                with st.expander(f"Hop {i}"):
-                                    st.code(received)
+                        if hops:
+                            delays = [h['delay'] for h in hops if h['delay'] is not None]
+                            total = sum(d for d in delays if d > 0)
+                            slowest = max(hops, key=lambda h: h['delay'] if h['delay'] is not None else float('-inf'))
+                            
+                            col1, col2, col3 = st.columns(3)
+                            with col1:
+                                st.metric("Hops", len(hops))
+                            with col2:
+                                st.metric("Total Transit", format_delay(total) if delays else "N/A")
+                            with col3:
+                                st.metric("Slowest Hop", format_delay(slowest['delay']) if slowest['delay'] is not None else "N/A")
+                            
+                            timeline = []
+                            for i, hop in enumerate(hops, 1):
+                                info = geo.get(hop['ip'], {})
+                                timeline.append({
+                                    'Hop': i,
+                                    'From': hop['from'],
+                                    'By': hop['by'],
+                                    'IP': hop['ip'],
+                                    'Location': ', '.join(x for x in [info.get('city'), info.get('country')] if x),
+                                    'Network': info.get('isp', ''),
+                                    'With': hop['with'],
+                                    'Time (UTC)': hop['timestamp'].astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S') if hop['timestamp'] else 'N/A',
+                                    'Delay': format_delay(hop['delay'])
+                                })
+                            st.dataframe(pd.DataFrame(timeline), use_container_width=True, hide_index=True)
+                            
+                            if slowest['delay'] is not None and slowest['delay'] > 60:
+                                st.warning(f"⚠️ Largest delay ({format_delay(slowest['delay'])}) at hop {hops.index(slowest) + 1}: {slowest['from']} → {slowest['by']}")
+                            if any(d < 0 for d in delays):
+                                st.info("ℹ️ Negative delays usually mean a server clock is wrong, not that mail travelled back in time")
+                            
+                            if delays:
+                                chart = pd.DataFrame({
+                                    'Hop': [f"{i}. {h['by'] or h['from']}" for i, h in enumerate(hops, 1) if h['delay'] is not None],
+                                    'Delay (s)': [max(0, d) for d in delays]
+                                }).set_index('Hop')
+                                st.bar_chart(chart)
+                            
+                            with st.expander("📜 Raw Received Headers"):
+                                for i, hop in enumerate(hops, 1):
+                                    st.code(f"Hop {i}: {hop['raw']}")
                         else:
                             st.warning("No Received headers found")
                         
-                        auth_headers = ['Authentication-Results', 'Received-SPF', 'DKIM-Signature']
+                        auth_headers = ['Authentication-Results', 'Received-SPF', 'DKIM-Signature', 'ARC-Authentication-Results']
                         st.markdown("### Authentication Results")
                         for header in auth_headers:
-                            if header in parsed_headers:
-                                st.code(f"{header}: {parsed_headers[header]}")
+                            for value in msg.get_all(header) or []:
+                                st.code(f"{header}: {_header_str(value)}")
                     
                     with tab3:
                         st.markdown("### All Headers")
-                        for key, value in parsed_headers.items():
-                            with st.expander(f"📋 {key}"):
-                                st.code(value)
+                        st.dataframe(
+                            pd.DataFrame(all_headers, columns=['Header', 'Value']),
+                            use_container_width=True,
+                            hide_index=True
+                        )
+
+    elif tool == "📭 Bounce Analyzer":
+        st.title("📭 Bounce Analyzer")
+        st.markdown("Aggregate bounces from mailbox exports (mbox or Maildir)")
+        st.info("💡 Only headers and delivery-status parts are parsed - message bodies are never loaded")
+        
+        sources = ["Upload mbox file"]
+        if CONFIG['mailbox_roots']:
+            sources.append("Server path (mbox file or Maildir folder)")
+        source = st.radio("Source:", sources, horizontal=True)
+        
+        mbox_file = None
+        mailbox_path = ""
+        if source == "Upload mbox file":
+            mbox_file = st.file_uploader("Upload mbox export:", type=['mbox', 'mbx', 'txt', 'eml'])
+        else:
+            mailbox_path = st.text_input("Path on server:", placeholder=os.path.join(CONFIG['mailbox_roots'][0], "example.com", "info"))
+            st.caption(f"Allowed roots: {', '.join(CONFIG['mailbox_roots'])}")
+        
+        include_delayed = st.checkbox("Include delayed (4.x.x) notifications", value=False)
+        
+        if st.button("📭 Analyze Bounces", type="primary"):
+            if not mbox_file and not mailbox_path:
+                st.warning("⚠️ Please upload a file or enter a path")
+            elif mailbox_path and resolve_mailbox_path(mailbox_path) is None:
+                st.error("❌ Path is outside the allowed mailbox roots")
+            elif mailbox_path and not os.path.exists(mailbox_path):
+                st.error(f"❌ Path not found: {mailbox_path}")
+            else:
+                progress_bar = st.progress(0.0)
+                start = time.perf_counter()
+                try:
+                    if mbox_file:
+                        # getbuffer() exposes the upload without copying it
+                        total, records = analyze_mailbox_buffer(mbox_file.getbuffer(), progress_bar.progress)
+                    else:
+                        total, records = analyze_mailbox_path(mailbox_path, progress_bar.progress)
+                except (OSError, ValueError) as e:
+                    st.error(f"❌ Could not read mailbox: {str(e)}")
+                    total, records = 0, None
+                progress_bar.progress(1.0)
+                elapsed = time.perf_counter() - start
+                
+                if records is not None:
+                    df = pd.DataFrame(records, columns=['recipient', 'domain', 'action', 'status', 'category', 'remote_mta', 'diagnostic', 'date'])
+                    if not include_delayed:
+                        df = df[df['action'] != 'delayed']
+                    
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("Messages Scanned", f"{total:,}")
+                    with col2:
+                        st.metric("Bounced Recipients", f"{len(df):,}")
+                    with col3:
+                        st.metric("Recipient Domains", df['domain'].nunique())
+                    with col4:
+                        st.metric("Scan Time", f"{elapsed:.1f}s")
+                    
+                    if df.empty:
+                        st.success("✅ No bounces found")
+                    else:
+                        tab1, tab2, tab3, tab4 = st.tabs(["🌐 By Domain", "🖥️ By Remote MTA", "🔢 By Status Code", "📋 All Bounces"])
+                        
+                        with tab1:
+                            by_domain = df.groupby('domain').agg(
+                                Bounces=('recipient', 'size'),
+                                Recipients=('recipient', 'nunique'),
+                                Top_Status=('status', lambda s: s.mode().iat[0] if not s.mode().empty else '')
+                            ).sort_values('Bounces', ascending=False).reset_index()
+                            st.dataframe(by_domain, use_container_width=True, hide_index=True)
+                        
+                        with tab2:
+                            by_mta = df[df['remote_mta'] != ''].groupby('remote_mta').agg(
+                                Bounces=('recipient', 'size'),
+                                Domains=('domain', 'nunique')
+                            ).sort_values('Bounces', ascending=False).reset_index()
+                            st.dataframe(by_mta, use_container_width=True, hide_index=True)
+                        
+                        with tab3:
+                            by_status = df.groupby(['status', 'category']).size().reset_index(name='Bounces')
+                            by_status = by_status.sort_values('Bounces', ascending=False)
+                            st.dataframe(by_status, use_container_width=True, hide_index=True)
+                            st.bar_chart(by_status.set_index('status')['Bounces'])
+                        
+                        with tab4:
+                            st.dataframe(df, use_container_width=True, hide_index=True)
+                        
+                        st.download_button(
+                            "📥 Download CSV",
+                            df.to_csv(index=False),
+                            f"bounces_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            "text/csv",
+                            use_container_width=True
+                        )
+
+    elif tool == "📊 DMARC Report Analyzer":
+        st.title("📊 DMARC Report Analyzer")
+        st.markdown("Aggregate DMARC (RUA) reports to see which senders pass or fail")
+        
+        report_files = st.file_uploader(
+            "Upload DMARC aggregate reports:",
+            type=['xml', 'gz', 'zip'],
+            accept_multiple_files=True,
+            help="Raw .xml, .xml.gz or .zip attachments as sent by Google, Microsoft, Yahoo, etc."
+        )
+        resolve_senders = st.checkbox("🔁 Reverse-resolve failing source IPs", value=True)
+        
+        if st.button("📊 Analyze Reports", type="primary"):
+            if not report_files:
+                st.warning("⚠️ Please upload at least one report")
+            else:
+                progress_bar = st.progress(0.0)
+                start = time.perf_counter()
+                df, stats = aggregate_dmarc_reports(report_files, progress_bar.progress)
+                elapsed = time.perf_counter() - start
+                
+                for error in stats['errors'][:10]:
+                    st.warning(f"⚠️ {error}")
+                for name in stats['empty'][:10]:
+                    st.info(f"ℹ️ {name}: 0 records")
+                
+                if df.empty:
+                    st.info(f"ℹ️ No DMARC records found in {stats['reports']} report(s)")
+                else:
+                    total = int(df['Messages'].sum())
+                    passed = int(df['DMARC Pass'].sum())
+                    
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("Reports", stats['reports'], help=f"{stats['duplicates']} duplicate report(s) skipped")
+                    with col2:
+                        st.metric("Messages", f"{total:,}")
+                    with col3:
+                        st.metric("DMARC Pass Rate", f"{passed / total * 100:.1f}%" if total else "N/A")
+                    with col4:
+                        st.metric("Parse Time", f"{elapsed:.1f}s")
+                    
+                    tab1, tab2, tab3 = st.tabs(["🚨 Failing Senders", "🌐 By Header-From Domain", "📋 All Sources"])
+                    
+                    with tab1:
+                        failing = df[df['Fail'] > 0].sort_values('Fail', ascending=False).head(100).copy()
+                        if failing.empty:
+                            st.success("✅ Every source passed DMARC")
+                        else:
+                            if resolve_senders:
+                                ptr = reverse_dns_many(failing['Source IP'].head(50).tolist())
+                                failing.insert(1, 'Hostname', failing['Source IP'].map(ptr).fillna(''))
+                            st.dataframe(failing, use_container_width=True, hide_index=True)
+                            st.caption("💡 Legitimate senders failing here usually need an SPF include or DKIM signing set up")
+                    
+                    with tab2:
+                        by_domain = df.groupby('Header From')[['Messages', 'DMARC Pass', 'DKIM Pass', 'SPF Pass', 'Fail']].sum()
+                        by_domain['Pass %'] = (by_domain['DMARC Pass'] / by_domain['Messages'] * 100).round(1)
+                        st.dataframe(by_domain.sort_values('Messages', ascending=False), use_container_width=True)
+                    
+                    with tab3:
+                        st.dataframe(df.sort_values('Messages', ascending=False), use_container_width=True, hide_index=True)
+                    
+                    st.download_button(
+                        "📥 Download CSV",
+                        df.to_csv(index=False),
+                        f"dmarc_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                        "text/csv",
+                        use_container_width=True
+                    )
 
     # WEB & SSL TOOLS
     elif tool == "🔧 Web Error Troubleshooting":
@@ -2325,6 +6837,54 @@ Be specific about web hosting environments, cPanel, and common server configurat
                             st.error("❌ Connection timed out")
                         except Exception as e:
                             st.error(f"❌ Error: {str(e)}")
+        
+        st.markdown("---")
+        st.markdown("### 📋 Bulk Check")
+        bulk_text = st.text_area(
+            "Domains (one per line):",
+            height=150,
+            key="bulk_ssl_input",
+            placeholder="example.com\nexample.org"
+        )
+        
+        if st.button("🔍 Check All", key="bulk_ssl_run"):
+            domains, truncated = parse_bulk_items(bulk_text)
+            domains = [result for valid, result in (validate_domain(d) for d in domains) if valid]
+            if not domains:
+                st.warning("⚠️ Please enter at least one valid domain")
+            else:
+                if truncated:
+                    st.warning(f"⚠️ Only the first {CONFIG['bulk_max_items']} entries are checked")
+                with st.spinner(f"Checking {len(domains)} certificates..."):
+                    with ThreadPoolExecutor(max_workers=min(CONFIG['max_workers'], len(domains))) as executor:
+                        results = list(executor.map(check_ssl_certificate, domains))
+                rows = []
+                for domain, (success, cert) in zip(domains, results):
+                    if success:
+                        rows.append({
+                            'Domain': domain,
+                            'Status': '✅ Valid' if cert['days'] > 14 else '⚠️ Expiring',
+                            'Days Left': cert['days'],
+                            'Expires': cert['expires'].strftime('%Y-%m-%d'),
+                            'Issuer': cert['issuer'],
+                            'TLS': cert['version'],
+                            'Error': ''
+                        })
+                    else:
+                        rows.append({'Domain': domain, 'Status': '❌ Failed', 'Days Left': None, 'Expires': '',
+                                     'Issuer': '', 'TLS': '', 'Error': cert})
+                df = pd.DataFrame(rows).sort_values('Days Left', na_position='first')
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Valid", int(df['Status'].eq('✅ Valid').sum()))
+                col2.metric("Expiring ≤ 14 days", int(df['Status'].eq('⚠️ Expiring').sum()))
+                col3.metric("Failed", int(df['Status'].eq('❌ Failed').sum()))
+                st.dataframe(df, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📥 Download CSV",
+                    df.to_csv(index=False),
+                    f"bulk_ssl_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    "text/csv"
+                )
 
     elif tool == "🔀 HTTPS Redirect Test":
         st.title("🔀 HTTPS Redirect Test")
@@ -2559,6 +7119,7 @@ RewriteRule ^(.*)$ https://%{HTTP_HOST}%{REQUEST_URI} [L,R=301]""", language="ap
         st.markdown("Get detailed geolocation and ISP information for any IP address")
         
         ip = st.text_input("Enter IP address:", placeholder="8.8.8.8", key="ip_input")
+        show_api_budget('ipapi.co', 'ip-api.com')
         
         if st.button("🔍 Lookup IP", use_container_width=True):
             if ip:
@@ -2569,14 +7130,21 @@ RewriteRule ^(.*)$ https://%{HTTP_HOST}%{REQUEST_URI} [L,R=301]""", language="ap
                     with st.spinner(f"Looking up {ip}..."):
                         try:
                             geo_data = None
-                            try:
-                                response = requests.get(f"https://ipapi.co/{ip}/json/", timeout=5)
-                                if response.status_code == 200:
-                                    geo_data = response.json()
-                            except:
-                                pass
+                            # Don't queue for ipapi.co - falling back to ip-api.com is faster
+                            if acquire_api('ipapi.co', max_wait=0)[0]:
+                                try:
+                                    response = requests.get(f"https://ipapi.co/{ip}/json/", timeout=5)
+                                    if response.status_code == 429:
+                                        mark_api_throttled('ipapi.co')
+                                    elif response.status_code == 200:
+                                        geo_data = response.json()
+                                except:
+                                    pass
                             
                             if not geo_data or geo_data.get('error'):
+                                allowed, reason = acquire_api('ip-api.com')
+                                if not allowed:
+                                    raise RuntimeError(reason)
                                 response = requests.get(f"http://ip-api.com/json/{ip}", timeout=5)
                                 if response.status_code == 200:
                                     fallback = response.json()
@@ -2629,6 +7197,50 @@ RewriteRule ^(.*)$ https://%{HTTP_HOST}%{REQUEST_URI} [L,R=301]""", language="ap
                             st.error(f"❌ Error: {str(e)}")
             else:
                 st.warning("⚠️ Please enter an IP address")
+        
+        st.markdown("---")
+        st.markdown("### 📋 Bulk Lookup")
+        bulk_text = st.text_area(
+            "IP addresses (one per line):",
+            height=150,
+            key="bulk_ip_input",
+            placeholder="8.8.8.8\n1.1.1.1"
+        )
+        show_api_budget('ip-api.com/batch')
+        
+        if st.button("🔍 Look Up All", key="bulk_ip_run", use_container_width=True):
+            entries, truncated = parse_bulk_items(bulk_text)
+            ips = []
+            for entry in entries:
+                try:
+                    ips.append(ipaddress.ip_address(entry).compressed)
+                except ValueError:
+                    pass
+            if not ips:
+                st.warning("⚠️ Please enter at least one valid IP address")
+            else:
+                if truncated:
+                    st.warning(f"⚠️ Only the first {CONFIG['bulk_max_items']} entries are checked")
+                with st.spinner(f"Looking up {len(ips)} IPs..."):
+                    geo = batch_lookup_ips(tuple(ips))
+                rows = []
+                for ip in ips:
+                    info = geo.get(ip)
+                    if info:
+                        rows.append({'IP': ip, 'Country': info.get('country'), 'City': info.get('city'),
+                                     'ISP': info.get('isp'), 'Organization': info.get('org'), 'AS': info.get('as')})
+                    else:
+                        note = 'Private / reserved' if not _is_public_ip(ip) else 'No data (lookup failed or API budget used up)'
+                        rows.append({'IP': ip, 'Country': note, 'City': '', 'ISP': '', 'Organization': '', 'AS': ''})
+                df = pd.DataFrame(rows)
+                st.dataframe(df, use_container_width=True, hide_index=True)
+                st.download_button(
+                    "📥 Download CSV",
+                    df.to_csv(index=False),
+                    f"bulk_ip_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    "text/csv",
+                    use_container_width=True
+                )
 
     elif tool == "🗂️ DNS Analyzer":
         st.header("🗂️ DNS Analyzer")
@@ -2952,68 +7564,112 @@ ORDER BY (data_length + index_length) DESC;""", language="sql")
         st.title("📚 HostAfrica Knowledge Base")
         st.markdown("Search our comprehensive knowledge base for guides and documentation")
         
+        if st.button("🔄 Re-index Articles", help="Pick up new or changed articles now instead of waiting for the next scheduled scan"):
+            cached_kb_sync.clear()
+            get_search_index.clear()
+        
+        with st.expander("🪞 Offline Mirror of the Help Center"):
+            pages, stored, last_fetch = kb_mirror_summary()
+            if pages:
+                st.caption(
+                    f"{pages:,} pages mirrored · {stored / 1024:,.0f} KB compressed · last fetched "
+                    f"{datetime.fromtimestamp(last_fetch, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')} UTC"
+                )
+            else:
+                st.caption("No pages mirrored yet - articles from the mirror become searchable with full text.")
+            st.caption(f"Source: {CONFIG['kb_mirror_url']} (set SUPPORTBUDDY_KB_MIRROR_URL to change)")
+            if st.button("⬇️ Update Mirror", use_container_width=True):
+                progress = st.progress(0.0, text="Reading sitemap...")
+                try:
+                    mirror_stats = sync_kb_mirror(
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Fetched {done}/{total} pages")
+                    )
+                except (requests.exceptions.RequestException, ET.ParseError, OSError) as e:
+                    progress.empty()
+                    st.error(f"❌ Could not read the sitemap: {e}")
+                else:
+                    progress.empty()
+                    cached_kb_sync.clear()
+                    get_search_index.clear()
+                    st.success(
+                        f"✅ {mirror_stats['pages']} pages in sitemap · {mirror_stats['added']} new · "
+                        f"{mirror_stats['changed']} changed · {mirror_stats['removed']} removed · "
+                        f"{mirror_stats['unchanged'] + mirror_stats['not_modified']} unchanged · "
+                        f"{mirror_stats['bytes'] / 1024:,.0f} KB downloaded"
+                    )
+                    if mirror_stats['errors']:
+                        st.warning(f"⚠️ {mirror_stats['errors']} page(s) could not be fetched and will be retried next time")
+        try:
+            sync_stats = cached_kb_sync()
+        except (OSError, sqlite3.Error) as e:
+            sync_stats = None
+            st.warning(f"⚠️ Could not update the article index: {e}")
+        categories = kb_categories()
+        if sync_stats:
+            scan = f"{sync_stats['added']} added, {sync_stats['updated']} updated, {sync_stats['removed']} removed"
+            if sync_stats['errors']:
+                scan += f", {sync_stats['errors']} unreadable"
+            st.caption(
+                f"📚 {sum(count for _, count in categories):,} articles indexed · "
+                f"last scan: {scan} in {sync_stats['seconds']:.2f}s"
+            )
+        
         search_query = st.text_input(
             "🔍 Search:",
             placeholder="e.g., email setup, dns, cpanel, ssl certificate",
-            help="Enter keywords to search the knowledge base"
+            help="Searches article titles, keywords and full text",
+            key="kb_search"
         )
         
         if search_query:
+            start = time.perf_counter()
             results = search_kb(search_query)
+            elapsed = (time.perf_counter() - start) * 1000
             
             if results:
-                st.success(f"✅ Found {len(results)} relevant article(s)")
+                st.success(f"✅ Found {len(results)} relevant article(s) in {elapsed:.1f} ms")
                 
                 for idx, result in enumerate(results, 1):
                     with st.expander(f"📄 {result['title']}", expanded=(idx <= 3)):
                         col1, col2 = st.columns([3, 1])
                         
                         with col1:
-                            st.markdown(f"**Category:** {result['category'].replace('_', ' ').title()}")
-                            st.markdown(f"**Related Topics:** {', '.join(result['keywords'][:6])}")
+                            st.markdown(f"**Category:** {kb_category_label(result['category'])}")
+                            if result['snippet']:
+                                st.markdown(f"…{result['snippet']}…")
+                            if result['keywords']:
+                                st.markdown(f"**Related Topics:** {', '.join(result['keywords'][:6])}")
                         
                         with col2:
-                            st.link_button("📖 Read", result['url'], use_container_width=True)
+                            if result['url']:
+                                st.link_button("📖 Read", result['url'], use_container_width=True)
+                        
+                        if result['body']:
+                            st.text(result['body'][:5000])
             else:
                 st.info("💡 No articles found. Try different keywords or browse categories below.")
         
         st.markdown("---")
         st.markdown("### 📂 Browse by Category")
         
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            if st.button("📧 Email", use_container_width=True):
-                st.session_state.kb_category = 'email'
-            if st.button("🌐 Domain & DNS", use_container_width=True):
-                st.session_state.kb_category = 'domain'
-        
-        with col2:
-            if st.button("🔧 cPanel", use_container_width=True):
-                st.session_state.kb_category = 'cpanel'
-            if st.button("🔒 SSL & HTTPS", use_container_width=True):
-                st.session_state.kb_category = 'ssl'
+        cols = st.columns(4)
+        for i, (category, count) in enumerate(categories):
+            with cols[i % 4]:
+                if st.button(f"{kb_category_label(category)} ({count})", key=f"kb_cat_{category}", use_container_width=True):
+                    st.session_state.kb_category = category
         
-        with col3:
-            if st.button("💻 WordPress", use_container_width=True):
-                st.session_state.kb_category = 'wordpress'
-            if st.button("📁 FTP", use_container_width=True):
-                st.session_state.kb_category = 'ftp'
-        
-        with col4:
-            if st.button("💳 Billing", use_container_width=True):
-                st.session_state.kb_category = 'billing'
-            if st.button("🔍 Troubleshooting", use_container_width=True):
-                st.session_state.kb_category = 'troubleshooting'
-        
-        if 'kb_category' in st.session_state:
+        if st.session_state.get('kb_category') in dict(categories):
             category = st.session_state.kb_category
-            st.markdown(f"### {category.title()} Articles")
+            st.markdown(f"### {kb_category_label(category)} Articles")
             
-            for article in HOSTAFRICA_KB.get(category, []):
+            for article in kb_articles(category):
                 with st.expander(f"📄 {article['title']}"):
-                    st.markdown(f"**Keywords:** {', '.join(article['keywords'][:8])}")
-                    st.link_button("📖 Read Article", article['url'], use_container_width=True)
+                    if article['keywords']:
+                        st.markdown(f"**Keywords:** {', '.join(article['keywords'][:8])}")
+                    if article['url']:
+                        st.link_button("📖 Read Article", article['url'], use_container_width=True)
+                    elif article['body']:
+                        st.text(article['body'][:5000])
         
         st.markdown("---")
         st.link_button("🌐 Browse Full Help Center", "https://help.hostafrica.com", use_container_width=True, type="primary")
@@ -3074,7 +7730,7 @@ ORDER BY (data_length + index_length) DESC;""", language="sql")
     elif tool == "📋 Copy-Paste Utilities":
         st.title("📋 Copy-Paste Utilities")
         
-        tab1, tab2, tab3 = st.tabs(["🔤 Case Converter", "📝 Line Tools", "🔧 Text Tools"])
+        tab1, tab2, tab3, tab4 = st.tabs(["🔤 Case Converter", "📝 Line Tools", "🔧 Text Tools", "🔎 Extract Entities"])
         
         with tab1:
             text = st.text_area("Enter text:", height=150, key="case_text")
@@ -3097,24 +7753,109 @@ ORDER BY (data_length + index_length) DESC;""", language="sql")
                     st.text_area("", value=text.capitalize(), height=100, key="sentence")
         
         with tab2:
-            lines = st.text_area("Enter lines (one per line):", height=150, key="lines_text")
+            line_mode = st.radio(
+                "Input:",
+                ["✏️ Paste", "📁 Large file"],
+                horizontal=True,
+                key="line_mode",
+                help="Large-file mode streams uploads of 100k+ lines and previews the result page by page"
+            )
             
-            if lines:
-                line_list = [l.strip() for l in lines.split('\n') if l.strip()]
+            if line_mode == "✏️ Paste":
+                lines = st.text_area("Enter lines (one per line):", height=150, key="lines_text")
                 
-                col1, col2 = st.columns(2)
+                if lines:
+                    line_list = [l.strip() for l in lines.split('\n') if l.strip()]
+                    
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        if st.button("Remove Duplicates"):
+                            unique = list(dict.fromkeys(line_list))
+                            st.text_area("Result:", value='\n'.join(unique), height=150, key="unique")
+                    
+                    with col2:
+                        if st.button("Sort A-Z"):
+                            sorted_lines = sorted(line_list)
+                            st.text_area("Result:", value='\n'.join(sorted_lines), height=150, key="sorted")
+                    
+                    st.info(f"📊 Total: {len(line_list)} lines, Unique: {len(set(line_list))} lines")
+            else:
+                operation = st.selectbox("Operation:", list(LINE_OPERATIONS), format_func=LINE_OPERATIONS.get, key="line_operation")
+                needs_b = operation in ('diff', 'intersect')
                 
+                col1, col2 = st.columns(2)
                 with col1:
-                    if st.button("Remove Duplicates"):
-                        unique = list(dict.fromkeys(line_list))
-                        st.text_area("Result:", value='\n'.join(unique), height=150, key="unique")
+                    file_a = st.file_uploader("List A:", type=['txt', 'csv', 'log'], key="lines_file_a")
+                with col2:
+                    file_b = st.file_uploader("List B:", type=['txt', 'csv', 'log'], key="lines_file_b", disabled=not needs_b)
                 
+                # A new or removed List A drops the previous result and its file
+                file_key = file_a.file_id if file_a else None
+                if st.session_state.get('line_file_key') != file_key:
+                    st.session_state.line_file_key = file_key
+                    st.session_state.pop('line_page', None)
+                    previous = st.session_state.pop('line_result', None)
+                    if previous and previous.get('path') and os.path.exists(previous['path']):
+                        os.remove(previous['path'])
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    ignore_case = st.checkbox("Ignore case", key="line_ignore_case")
                 with col2:
-                    if st.button("Sort A-Z"):
-                        sorted_lines = sorted(line_list)
-                        st.text_area("Result:", value='\n'.join(sorted_lines), height=150, key="sorted")
+                    unique = st.checkbox("Drop duplicates", value=True, key="line_unique", disabled=(operation != 'sort'))
+                
+                if st.button("▶️ Run", type="primary", key="line_run", disabled=not file_a or (needs_b and not file_b)):
+                    st.session_state.pop('line_page', None)
+                    previous = st.session_state.get('line_result')
+                    if previous and previous.get('path') and os.path.exists(previous['path']):
+                        os.remove(previous['path'])
+                    progress = st.empty()
+                    with st.spinner("Processing..."):
+                        st.session_state.line_result = run_line_operation(
+                            operation, file_a, file_b if needs_b else None, ignore_case, unique,
+                            on_progress=lambda n: progress.caption(f"Read {n:,} lines...")
+                        )
+                    progress.empty()
                 
-                st.info(f"📊 Total: {len(line_list)} lines, Unique: {len(set(line_list))} lines")
+                result = st.session_state.get('line_result')
+                if result:
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Input Lines", f"{result['input_lines']:,}")
+                    if result['operation'] == 'distinct':
+                        col2.metric("Distinct (≈)", f"{result['distinct']:,}", help="HyperLogLog estimate, typically within 1%")
+                    else:
+                        col2.metric("Result Lines", f"{result['lines']:,}")
+                    col3.metric("Time", f"{result['seconds']:.2f}s")
+                    
+                    if result['top']:
+                        st.markdown("**Most frequent:**")
+                        st.dataframe(pd.DataFrame(result['top'], columns=['Count', 'Line']), use_container_width=True, hide_index=True)
+                    
+                    if result.get('path') and os.path.exists(result['path']):
+                        pages = len(result['offsets'])
+                        if pages:
+                            page = st.number_input(f"Page (of {pages:,}):", min_value=1, max_value=pages, value=1, key="line_page")
+                            st.code('\n'.join(read_line_page(result, page - 1)), language=None)
+                            st.caption(
+                                f"Lines {(page - 1) * LINE_PAGE_SIZE + 1:,}–{min(page * LINE_PAGE_SIZE, result['lines']):,} "
+                                f"of {result['lines']:,}"
+                            )
+                            # Reading the whole result only happens when a download is asked for
+                            if st.session_state.get('line_download') != result['path']:
+                                if st.button("📦 Prepare Download", key="line_prepare"):
+                                    st.session_state.line_download = result['path']
+                                    st.rerun()
+                            else:
+                                with open(result['path'], 'rb') as f:
+                                    st.download_button(
+                                        f"📥 Download Result ({result['bytes'] / 1024:,.0f} KB)",
+                                        f.read(),
+                                        f"{result['operation']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                                        "text/plain"
+                                    )
+                        else:
+                            st.info("💡 The result is empty")
         
         with tab3:
             text_tool = st.text_area("Enter text:", height=150, key="text_tools")
@@ -3133,95 +7874,286 @@ ORDER BY (data_length + index_length) DESC;""", language="sql")
                 with col3:
                     st.metric("Alphanumeric", sum(c.isalnum() for c in text_tool))
                     st.metric("Special Chars", sum(not c.isalnum() and not c.isspace() for c in text_tool))
+        
+        with tab4:
+            st.markdown("Pull domains, IPs, emails and URLs out of ticket bodies or logs and send them to the bulk tools")
+            extract_text = st.text_area("Paste text:", height=150, key="extract_text")
+            extract_file = st.file_uploader("...or upload a log or text file:", type=['txt', 'log', 'csv', 'eml', 'json'], key="extract_file")
+            
+            source = extract_file.getvalue() if extract_file else extract_text.encode()
+            if source:
+                # Extraction results survive reruns until the input changes
+                digest = hashlib.sha256(source).hexdigest()
+                psl = load_public_suffixes()
+                if st.session_state.get('extract_digest') != digest:
+                    start = time.perf_counter()
+                    lines = io.TextIOWrapper(io.BytesIO(source), encoding='utf-8', errors='replace')
+                    st.session_state.extract_found = extract_entities(lines, psl)
+                    st.session_state.extract_seconds = time.perf_counter() - start
+                    st.session_state.extract_digest = digest
+                found = st.session_state.extract_found
+                
+                cols = st.columns(len(ENTITY_KINDS))
+                for col, (kind, label) in zip(cols, ENTITY_KINDS.items()):
+                    col.metric(label, len(found[kind]))
+                st.caption(
+                    f"⚡ Scanned {len(source) / 1024:,.0f} KB in {st.session_state.extract_seconds:.2f}s · "
+                    f"domains validated against the {psl[3]}"
+                )
+                
+                for kind, label in ENTITY_KINDS.items():
+                    counts = found[kind]
+                    if not counts:
+                        continue
+                    with st.expander(f"{label} ({len(counts)})", expanded=(kind == 'domains')):
+                        df = pd.DataFrame(counts.most_common(), columns=['Value', 'Count'])
+                        if kind == 'domains':
+                            df.insert(1, 'Registrable Domain', df['Value'].map(lambda host: registrable_domain(host, psl)))
+                        st.dataframe(df, use_container_width=True, hide_index=True, height=min(400, 35 * (len(df) + 1) + 3))
+                        
+                        handoffs = ENTITY_HANDOFFS.get(kind, [])
+                        cols = st.columns(1 + len(handoffs))
+                        with cols[0]:
+                            st.download_button(
+                                "📥 Download List",
+                                '\n'.join(df['Value']),
+                                f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                                "text/plain",
+                                key=f"extract_download_{kind}",
+                                use_container_width=True
+                            )
+                        for col, (target, input_key, label) in zip(cols[1:], handoffs):
+                            with col:
+                                if st.button(f"{label} ({min(len(counts), CONFIG['bulk_max_items'])})", key=f"handoff_{kind}_{input_key}", use_container_width=True):
+                                    st.session_state[input_key] = '\n'.join(df['Value'].head(CONFIG['bulk_max_items']))
+                                    st.session_state.selected_tool = target
+                                    st.rerun()
 
     elif tool == "📸 Screenshot Annotator":
         st.title("📸 Screenshot Annotator")
-        st.markdown("Upload screenshots and add notes")
+        st.markdown("Upload screenshots, mark them up, blur customer data and add notes")
         
         uploaded = st.file_uploader("Upload Screenshot:", type=['png', 'jpg', 'jpeg'])
         
         if uploaded:
-            image = Image.open(uploaded)
+            data = uploaded.getvalue()
+            digest = hashlib.sha1(data).hexdigest()
+            if st.session_state.get('annotator_digest') != digest:
+                st.session_state.annotator_digest = digest
+                st.session_state.annotations = []
+                st.session_state.annotator_export = None
+            
+            try:
+                working, info = load_screenshot(digest, data)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+                working = None
+        
+        if uploaded and working is not None:
+            annotations = tuple(st.session_state.annotations)
             
             col1, col2 = st.columns([2, 1])
             
             with col1:
-                st.image(image, use_container_width=True)
+                st.image(annotated_preview(digest, annotations, working), use_container_width=True)
             
             with col2:
                 st.markdown("### Image Info")
-                st.info(f"**Size:** {image.size[0]} x {image.size[1]}")
-                st.info(f"**Format:** {image.format}")
-                st.info(f"**Mode:** {image.mode}")
+                st.info(f"**Size:** {info['size'][0]} x {info['size'][1]}")
+                st.info(f"**Format:** {info['format']}")
+                st.info(f"**Mode:** {info['mode']}")
+                if working.size != info['size']:
+                    st.caption(f"Previewing at {working.width} x {working.height}")
+            
+            st.markdown("### ✏️ Annotate")
+            col1, col2, col3 = st.columns([1, 1, 2])
+            with col1:
+                kind = st.selectbox("Type:", list(ANNOTATION_KINDS), format_func=ANNOTATION_KINDS.get)
+            with col2:
+                color = st.color_picker("Colour:", "#E81123", disabled=(kind == 'blur'))
+            with col3:
+                if kind == 'arrow':
+                    x_range = st.slider("From → to, horizontal (%)", 0, 100, (20, 60))
+                    y_range = st.slider("From → to, vertical (%)", 0, 100, (20, 60))
+                else:
+                    x_range = st.slider("Left – right (%)", 0, 100, (20, 60))
+                    y_range = st.slider("Top – bottom (%)", 0, 100, (20, 60))
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("➕ Add", use_container_width=True):
+                    st.session_state.annotations.append((kind, x_range[0], y_range[0], x_range[1], y_range[1], color))
+                    st.session_state.annotator_export = None
+                    st.rerun()
+            with col2:
+                if st.button("↩️ Undo", use_container_width=True, disabled=not annotations):
+                    st.session_state.annotations.pop()
+                    st.session_state.annotator_export = None
+                    st.rerun()
+            with col3:
+                if st.button("🗑️ Clear Annotations", use_container_width=True, disabled=not annotations):
+                    st.session_state.annotations = []
+                    st.session_state.annotator_export = None
+                    st.rerun()
+            if annotations:
+                st.caption(" · ".join(f"{ANNOTATION_KINDS[a[0]]} ({a[1]}–{a[3]}%, {a[2]}–{a[4]}%)" for a in annotations))
             
             notes = st.text_area("Add Notes:", height=200, placeholder="Describe what's shown in the screenshot...")
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             
-            if notes:
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    if st.button("💾 Save Notes"):
-                        st.download_button(
-                            "📥 Download Notes",
-                            notes,
-                            f"screenshot_notes_{timestamp}.txt",
-                            "text/plain"
-                        )
-                
-                with col2:
-                    buf = io.BytesIO()
-                    image.save(buf, format='PNG')
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                if notes:
+                    st.download_button(
+                        "📥 Download Notes",
+                        notes,
+                        f"screenshot_notes_{timestamp}.txt",
+                        "text/plain",
+                        use_container_width=True
+                    )
+            
+            with col2:
+                # Encoding is the expensive part, so it only happens when asked for
+                full_size = st.checkbox("Full resolution", value=False, disabled=working.size == info['size'])
+                export_key = (digest, annotations, full_size)
+                export = st.session_state.annotator_export
+                if export and export[0] == export_key:
                     st.download_button(
                         "📥 Download Image",
-                        buf.getvalue(),
+                        export[1],
                         f"screenshot_{timestamp}.png",
-                        "image/png"
+                        "image/png",
+                        use_container_width=True
                     )
+                elif st.button("🖼️ Prepare Image Download", use_container_width=True):
+                    with st.spinner("Encoding image..."):
+                        try:
+                            image = open_bounded_image(data)[0] if full_size else working
+                            st.session_state.annotator_export = (export_key, export_annotated(image, annotations))
+                        except ValueError as e:
+                            st.error(f"❌ {e}")
+                        else:
+                            st.rerun()
 
     elif tool == "📝 Session Notes":
         st.title("📝 Session Notes")
-        st.markdown("Take notes during support sessions")
-        
-        st.session_state.session_notes = st.text_area(
-            "Session Notes:",
-            value=st.session_state.session_notes,
-            height=400,
-            placeholder="Document your troubleshooting steps, findings, and solutions..."
-        )
-        
-        col1, col2, col3, col4 = st.columns(4)
+        st.markdown("Take notes during support sessions - saved automatically per agent and ticket")
         
+        col1, col2 = st.columns(2)
         with col1:
-            if st.button("💾 Save", use_container_width=True):
-                st.success("✅ Notes saved in session")
-        
+            agent = st.text_input("👤 Agent:", value=st.query_params.get('agent', ''), placeholder="Your name or initials")
         with col2:
-            if st.button("📋 Add Timestamp", use_container_width=True):
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                st.session_state.session_notes += f"\n\n--- {timestamp} ---\n"
-                st.rerun()
+            ticket = st.text_input("🎫 Ticket:", value=st.query_params.get('ticket', ''), placeholder="e.g., 123456 (blank for general notes)")
         
-        with col3:
+        if not agent.strip():
+            st.info("👆 Enter your agent name to load and autosave your notes")
+        else:
+            # Keep agent and ticket in the URL so a browser refresh reopens the same note
+            st.query_params.update(agent=agent.strip(), ticket=ticket.strip())
+            owner = _note_key(agent, ticket)
+            if st.session_state.notes_loaded_for != owner:
+                flush_session_notes(force=True)
+                try:
+                    body, revision, _ = load_note(*owner)
+                except sqlite3.Error as e:
+                    st.error(f"❌ Could not load notes: {e}")
+                    body, revision = "", 0
+                st.session_state.session_notes = body
+                st.session_state.notes_saved_text = body
+                st.session_state.notes_saved_at = time.time()
+                st.session_state.notes_revision = revision
+                st.session_state.notes_loaded_for = owner
+            
+            st.session_state.session_notes = st.text_area(
+                f"Notes for {owner[1]}:",
+                value=st.session_state.session_notes,
+                height=400,
+                placeholder="Document your troubleshooting steps, findings, and solutions..."
+            )
+            notes_autosave_status()
+            
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                if st.button("💾 Save", use_container_width=True):
+                    flush_session_notes(force=True)
+                    if st.session_state.session_notes == st.session_state.notes_saved_text:
+                        st.success(f"✅ Notes saved (revision {st.session_state.notes_revision})")
+                    else:
+                        st.error("❌ Could not save notes - they are kept in this session, try again shortly")
+            
+            with col2:
+                if st.button("📋 Add Timestamp", use_container_width=True):
+                    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    st.session_state.session_notes += f"\n\n--- {timestamp} ---\n"
+                    st.rerun()
+            
+            with col3:
+                if st.session_state.session_notes:
+                    st.download_button(
+                        "📥 Download",
+                        st.session_state.session_notes,
+                        f"support_notes_{owner[1]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                        "text/plain",
+                        use_container_width=True
+                    )
+            
+            with col4:
+                if st.button("🗑️ Clear All", use_container_width=True, help="Earlier revisions stay in the history"):
+                    st.session_state.session_notes = ""
+                    flush_session_notes(force=True)
+                    st.rerun()
+            
             if st.session_state.session_notes:
-                st.download_button(
-                    "📥 Download",
-                    st.session_state.session_notes,
-                    f"support_notes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                    "text/plain",
-                    use_container_width=True
-                )
-        
-        with col4:
-            if st.button("🗑️ Clear All", use_container_width=True):
-                st.session_state.session_notes = ""
-                st.rerun()
-        
-        if st.session_state.session_notes:
-            word_count = len(st.session_state.session_notes.split())
-            char_count = len(st.session_state.session_notes)
-            st.info(f"📊 {word_count} words, {char_count} characters")
+                word_count = len(st.session_state.session_notes.split())
+                char_count = len(st.session_state.session_notes)
+                st.info(f"📊 {word_count} words, {char_count} characters")
+            
+            with st.expander("🕘 Revision History"):
+                try:
+                    history = note_history(*owner)
+                except sqlite3.Error:
+                    history = []
+                if len(history) < 2:
+                    st.caption("Earlier revisions appear here once the note has been edited over time.")
+                else:
+                    labels = {
+                        rev: f"Revision {rev} · {datetime.fromtimestamp(saved).strftime('%Y-%m-%d %H:%M')}"
+                        for rev, saved, _ in history
+                    }
+                    bodies = {rev: body for rev, _, body in history}
+                    chosen = st.selectbox("Revision:", list(labels), format_func=labels.get, index=1)
+                    st.text(bodies[chosen] or "(empty)")
+                    if chosen != history[0][0] and st.button("↩️ Restore This Revision"):
+                        st.session_state.session_notes = bodies[chosen]
+                        flush_session_notes(force=True)
+                        st.rerun()
+            
+            with st.expander("🔎 Search Past Notes"):
+                try:
+                    recent = recent_notes(agent)
+                except sqlite3.Error:
+                    recent = []
+                if recent:
+                    st.caption("Recent: " + " · ".join(t for t, _ in recent))
+                notes_query = st.text_input("Search:", placeholder="e.g., dkim selector, 550 relay", key="notes_search")
+                all_agents = st.checkbox("Include other agents' notes", key="notes_search_all")
+                if notes_query:
+                    matches = search_notes(notes_query, agent=None if all_agents else agent)
+                    if not matches:
+                        st.info("💡 No notes match that search")
+                    for i, match in enumerate(matches):
+                        col1, col2 = st.columns([4, 1])
+                        with col1:
+                            st.markdown(
+                                f"**{match['ticket']}** · {match['agent']} · "
+                                f"{datetime.fromtimestamp(match['updated']).strftime('%Y-%m-%d %H:%M')}  \n…{match['snippet']}…"
+                            )
+                        with col2:
+                            if match['agent'] == owner[0] and st.button("📂 Open", key=f"open_note_{i}", use_container_width=True):
+                                st.query_params['ticket'] = match['ticket']
+                                st.rerun()
 
     elif tool == "🗑️ Clear Cache Instructions":
         st.title("🗑️ Clear Cache Instructions")
@@ -3413,19 +8345,21 @@ ORDER BY (data_length + index_length) DESC;""", language="sql")
             check_securitytrails = st.checkbox("SecurityTrails", value=True)
         with col3:
             record_type = st.selectbox("Record Type:", ["A", "AAAA", "MX", "NS", "SOA", "TXT"])
+        
+        # Check for API key in secrets first, then allow manual input
+        securitytrails_key = SECURITYTRAILS_API_KEY
+        if check_securitytrails and not securitytrails_key:
+            securitytrails_key = st.text_input("SecurityTrails API Key:", type="password",
+                                               help="Add to secrets.toml as SECURITYTRAILS_API_KEY or enter here")
+        refresh = st.checkbox("🔄 Refresh", help="Ignore cached history and query the sources again (uses API quota)")
     
         if st.button("🔍 Check Historical DNS", use_container_width=True):
             if domain:
                 with st.spinner("Querying historical DNS records..."):
-                    check_historical_dns(domain, check_virustotal, check_securitytrails, record_type)
+                    check_historical_dns(domain, check_virustotal, check_securitytrails, record_type, securitytrails_key, refresh)
             else:
                 st.error("❌ Please enter a domain name")
 
-
-
-
-
-
-
-
-
+    # Shared AI gateway load and metrics on every tool that calls Gemini
+    if GEMINI_AVAILABLE and tool in AI_TOOLS:
+        render_ai_metrics()